@@ -0,0 +1,68 @@
+"""Benchmark the chunk cleaners, reporting the cost of each rule per MB of markdown"""
+
+import argparse
+import json
+import time
+
+import cleaners
+
+DEFAULT_CRAWL_FILE = '../example_crawl_results_2024-08-20T16-35-59.json'
+
+
+def load_pages(crawl_results_file, min_bytes):
+    """
+    Return page markdown (with end matter removed) from a crawl results file,
+    repeated until there is at least min_bytes of it.
+    """
+    with open(crawl_results_file, 'r') as f:
+        crawl_results = json.load(f)
+    pages = [cleaners.remove_end_matter(item['markdown']) for item in crawl_results]
+    if not pages:
+        raise ValueError(f"No pages in {crawl_results_file}")
+
+    corpus = []
+    size = 0
+    while size < min_bytes:
+        for page in pages:
+            corpus.append(page)
+            size += len(page.encode('utf-8'))
+    return corpus, size
+
+
+def bench_rules(pages, pipeline=cleaners.CHUNK_CLEANERS):
+    """
+    Time each rule of the pipeline over every page.
+
+    Rules run in pipeline order, so each one sees the output of the rules
+    before it, just as in get_chunk_html.
+    """
+    timings = {name: 0.0 for name in pipeline.names()}
+    for page in pages:
+        for name, cleaner in pipeline.rules:
+            start = time.perf_counter()
+            page = cleaner(page)
+            timings[name] += time.perf_counter() - start
+    return timings
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the chunk cleaners per MB of markdown")
+    parser.add_argument('crawl_results_file', nargs='?', default=DEFAULT_CRAWL_FILE)
+    parser.add_argument('--mb', type=float, default=1.0,
+                        help="minimum MB of markdown to clean (default: 1)")
+    args = parser.parse_args(argv)
+
+    pages, size = load_pages(args.crawl_results_file, int(args.mb * 1024 * 1024))
+    mb = size / (1024 * 1024)
+    timings = bench_rules(pages)
+
+    print(f"Cleaned {len(pages)} pages, {mb:.2f} MB of markdown")
+    print(f"{'rule':<35} {'total s':>10} {'ms/MB':>10}")
+    for name, seconds in timings.items():
+        print(f"{name:<35} {seconds:>10.4f} {seconds * 1000 / mb:>10.2f}")
+    total = sum(timings.values())
+    print(f"{'total':<35} {total:>10.4f} {total * 1000 / mb:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
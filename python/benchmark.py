@@ -0,0 +1,273 @@
+"""Benchmark the crawl -> chunk pipeline on synthetic crawls of increasing size"""
+
+import argparse
+import gzip
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+
+import cleaners
+import dedup
+import load
+import render
+import serializer
+import transform
+from bench_cleaners import DEFAULT_CRAWL_FILE
+from metrics import METRICS
+
+DEFAULT_SIZES = [1000, 10000, 100000]
+DEFAULT_DATA_DIR = 'bench_data'
+DEFAULT_OUTPUT = 'benchmark_results.json'
+# Modules whose import time is what a command pays before doing any work
+COLD_START_MODULES = ['cli', 'transform', 'load', 'pipeline', 'suggestions']
+# Dependencies that should only be imported by the code that uses them
+HEAVY_MODULES = ['markdown', 'requests', 'tqdm']
+# Chunks of each run kept to compare serializers on
+SERIALIZATION_SAMPLE = 10000
+
+
+def make_page(template, n, rng):
+    """
+    A Firecrawl-shaped page derived from a template page. Every third page is
+    long enough to go through process_content, with top-level sections and
+    ### subsections built from the template's own markdown.
+    """
+    metadata = dict(template['metadata'])
+    metadata['ogUrl'] = f"{template['metadata']['ogUrl']}synthetic-{n}/"
+    metadata['sourceURL'] = metadata['ogUrl']
+    if n % 50 == 49:
+        metadata['pageStatusCode'] = 404
+
+    page_markdown = template['markdown']
+    if n % 3 == 0:
+        body, separator, end_matter = page_markdown.partition('[Prev')
+        # Whole paragraphs, so links spread over several lines stay intact
+        paragraphs = [paragraph for paragraph in body.split('\n\n') if paragraph.strip()] or ['Some text']
+        parts = [body]
+        for k in range(rng.randint(2, 6)):
+            parts.append(f"\n\n[](#section-{k})\nSection {k}\n\n")
+            parts.append("\n\n".join(rng.choice(paragraphs) for _ in range(rng.randint(5, 30))))
+            for j in range(rng.randint(0, 4)):
+                parts.append(f"\n\n### [](#section-{k}-{j})\nSubsection {k}.{j}\n\n")
+                parts.append("\n\n".join(rng.choice(paragraphs) for _ in range(rng.randint(3, 20))))
+        page_markdown = "".join(parts) + "\n" + separator + end_matter
+
+    return {'markdown': page_markdown, 'metadata': metadata}
+
+
+def write_synthetic_crawl(path, pages, template_file=DEFAULT_CRAWL_FILE, seed=0):
+    """
+    Write a crawl results file of `pages` synthetic pages, one page at a time.
+    """
+    with open(template_file, 'r') as f:
+        templates = json.load(f)
+    rng = random.Random(seed)
+    with open(path, 'w') as f:
+        f.write('[\n')
+        for n in range(pages):
+            if n:
+                f.write(',\n')
+            json.dump(make_page(templates[n % len(templates)], n, rng), f)
+        f.write('\n]\n')
+
+
+def dump_indented(chunk):
+    # As transform.py writes the chunks JSON file
+    return json.dumps(chunk, indent=2)
+
+
+def timed(stages, name, func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    stages[name] = stages.get(name, 0.0) + time.perf_counter() - start
+    return result
+
+
+def get_cleaner_seconds():
+    """
+    Seconds spent in each chunk cleaner rule so far, by name.
+    """
+    stages = METRICS.snapshot()['stages']
+    return {name: stages.get(f'cleaner.{name}', {}).get('seconds', 0.0) for name in cleaners.CHUNK_CLEANERS.names()}
+
+
+def bench_crawl(path, sample=None):
+    """
+    Time each stage of the pipeline, separately, over every page of a crawl
+    file. The first SERIALIZATION_SAMPLE chunks are added to sample.
+    """
+    stages = {}
+    pages = chunks = markdown_bytes = 0
+    renderer = render.Renderer()
+    deduplicator = dedup.Deduplicator()
+    crawl_items = transform.iter_crawl_results(path)
+
+    while True:
+        item = timed(stages, 'crawl_read', next, crawl_items, None)
+        if item is None:
+            break
+        pages += 1
+        metadata = item['metadata']
+        if metadata['pageStatusCode'] != 200:
+            continue
+        markdown_bytes += len(item['markdown'].encode('utf-8'))
+
+        page_markdown = timed(stages, 'remove_end_matter', cleaners.remove_end_matter, item['markdown'])
+
+        # Chunking cleans the sections it visits: the time of each cleaner
+        # rule is split out of it, so process_content is chunking alone
+        cleaners.CHUNK_CLEANERS.start_page(metadata['ogUrl'])
+        cleaned_before = get_cleaner_seconds()
+        page_chunks = timed(stages, 'process_content', transform.chunk_page, page_markdown,
+                            metadata['ogTitle'], metadata['ogUrl'], transform.get_tags(metadata['ogUrl']),
+                            metadata.get('description', ''))
+        for name, seconds in get_cleaner_seconds().items():
+            seconds -= cleaned_before[name]
+            stages[f'cleaner.{name}'] = stages.get(f'cleaner.{name}', 0.0) + seconds
+            stages['process_content'] -= seconds
+        for chunk in page_chunks:
+            chunk['chunk_html'] = timed(stages, 'render', renderer, chunk['chunk_html'])
+            timed(stages, 'serialize_jsonl', json.dumps, chunk)
+            timed(stages, 'serialize_indent', dump_indented, chunk)
+            timed(stages, 'dedup', deduplicator.add, chunk)
+            if sample is not None and len(sample) < SERIALIZATION_SAMPLE:
+                sample.append(chunk)
+        chunks += len(page_chunks)
+
+    return {
+        'pages': pages,
+        'chunks': chunks,
+        'chunks_merged': sum(len(merged) for merged in deduplicator.merged.values()),
+        'markdown_bytes': markdown_bytes,
+        'stages': {name: round(seconds, 6) for name, seconds in stages.items()},
+        'total_seconds': round(sum(stages.values()), 6),
+    }
+
+
+def bench_serialization(chunks, batch_size=load.BATCH_SIZE):
+    """
+    CPU time of each available serializer encoding the chunks in batches as
+    load.py sends them, decoding them again and gzip-compressing them, and
+    the bytes compression saves.
+    """
+    backends = ['json'] + (['orjson'] if serializer.get_available_backend() == 'orjson' else [])
+    batches = [chunks[start:start + batch_size] for start in range(0, len(chunks), batch_size)]
+    results = {}
+    for backend in backends:
+        serializer.set_backend(backend)
+        start = time.process_time()
+        bodies = [serializer.dumps(batch) for batch in batches]
+        encode_seconds = time.process_time() - start
+        start = time.process_time()
+        for body in bodies:
+            serializer.loads(body)
+        decode_seconds = time.process_time() - start
+        start = time.process_time()
+        compressed = [gzip.compress(body, load.GZIP_LEVEL) for body in bodies]
+        gzip_seconds = time.process_time() - start
+        size = sum(map(len, bodies))
+        gzip_size = sum(map(len, compressed))
+        results[backend] = {
+            'encode_cpu_seconds': round(encode_seconds, 6),
+            'decode_cpu_seconds': round(decode_seconds, 6),
+            'gzip_cpu_seconds': round(gzip_seconds, 6),
+            'bytes': size,
+            'gzip_bytes': gzip_size,
+            'bytes_saved': size - gzip_size,
+        }
+    serializer.set_backend()
+    return {'chunks': len(chunks), 'batches': len(batches), 'backends': results}
+
+
+def bench_cold_start(modules=COLD_START_MODULES, repeat=5):
+    """
+    Median time to start a fresh interpreter and import each module, and
+    which heavy dependencies the import pulled in.
+    """
+    directory = os.path.dirname(os.path.abspath(__file__))
+    check = f"import sys; print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    results = {}
+    # 'sys' is already imported: that row is the bare interpreter start
+    for module in ['sys'] + modules:
+        seconds = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            output = subprocess.run([sys.executable, '-c', f"import {module}; {check}"], cwd=directory,
+                                    check=True, capture_output=True, text=True).stdout
+            seconds.append(time.perf_counter() - start)
+        results['interpreter' if module == 'sys' else module] = {
+            'seconds': round(statistics.median(seconds), 6),
+            'heavy_modules': [name for name in output.strip().split(',') if name],
+        }
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the crawl -> chunk pipeline on synthetic crawls")
+    parser.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)),
+                        help="comma-separated crawl sizes in pages (default: 1000,10000,100000)")
+    parser.add_argument('--template', default=DEFAULT_CRAWL_FILE,
+                        help="crawl results file the synthetic pages are derived from")
+    parser.add_argument('--data-dir', default=DEFAULT_DATA_DIR,
+                        help=f"where synthetic crawl files are written and reused (default: {DEFAULT_DATA_DIR})")
+    parser.add_argument('--output', default=DEFAULT_OUTPUT,
+                        help=f"machine-readable results file (default: {DEFAULT_OUTPUT})")
+    parser.add_argument('--cold-start-repeat', type=int, default=5,
+                        help="interpreter starts per module when timing imports (default: 5, 0 to skip)")
+    args = parser.parse_args(argv)
+
+    cold_start = {}
+    if args.cold_start_repeat:
+        cold_start = bench_cold_start(repeat=args.cold_start_repeat)
+        baseline = cold_start['interpreter']['seconds']
+        print("Cold start (interpreter + import)")
+        for module, result in cold_start.items():
+            heavy = f"  imports {', '.join(result['heavy_modules'])}" if result['heavy_modules'] else ''
+            print(f"  {module:<45} {result['seconds'] * 1000:>10.1f} ms "
+                  f"{(result['seconds'] - baseline) * 1000:>+10.1f} ms{heavy}")
+
+    os.makedirs(args.data_dir, exist_ok=True)
+    runs = []
+    for size in (int(size) for size in args.sizes.split(',')):
+        path = os.path.join(args.data_dir, f'crawl_results_synthetic_{size}.json')
+        if not os.path.exists(path):
+            print(f"Writing {size} synthetic pages to {path}")
+            write_synthetic_crawl(path, size, template_file=args.template)
+        sample = []
+        run = bench_crawl(path, sample)
+        run['serialization'] = bench_serialization(sample)
+        runs.append(run)
+
+        print(f"{size} pages, {run['chunks']} chunks, {run['markdown_bytes'] / 1024 / 1024:.1f} MB of markdown")
+        for name, seconds in run['stages'].items():
+            print(f"  {name:<45} {seconds:>10.3f} s {seconds * 1000 / size:>10.3f} ms/page")
+        print(f"  {'total':<45} {run['total_seconds']:>10.3f} s")
+        serialization = run['serialization']
+        print(f"Serialization of {serialization['chunks']} chunks in {serialization['batches']} batches (CPU)")
+        for backend, result in serialization['backends'].items():
+            print(f"  {backend:<10} encode {result['encode_cpu_seconds']:>8.3f} s  "
+                  f"decode {result['decode_cpu_seconds']:>8.3f} s  gzip {result['gzip_cpu_seconds']:>8.3f} s  "
+                  f"{result['bytes'] / 1024 / 1024:.1f} MB -> {result['gzip_bytes'] / 1024 / 1024:.1f} MB gzipped")
+
+    results = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'renderer': render.get_backend(),
+        'serializer': serializer.get_backend(),
+        'configs': transform.CONFIGS,
+        'cold_start': cold_start,
+        'runs': runs,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Saved results to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+"""Compact chunk files: gzip-compressed JSONL blocks with a sidecar offset index"""
+
+import argparse
+import gzip
+import json
+import mmap
+import os
+import zlib
+
+import serializer
+
+BLOCK_SIZE = 64
+STORE_EXTENSION = 'jsonl.gz'
+INDEX_SUFFIX = '.idx'
+INDEX_VERSION = 1
+
+
+def write_chunk_md(f, chunk):
+    f.write(f"link: {chunk['link']}\n")
+    f.write(f"tag_set: {', '.join(chunk['tags_set'])}\n")
+    f.write(f"image_urls: {', '.join(chunk['image_urls'])}\n")
+    f.write(f"tracking_id: {chunk['tracking_id']}\n")
+    f.write(f"group_tracking_ids: {', '.join(chunk['group_tracking_ids'])}\n")
+    f.write(chunk['chunk_html'])
+    f.write("\n" + "-" *80 + "\n\n")
+
+
+def get_index_path(path):
+    return path + INDEX_SUFFIX
+
+
+def is_store(path):
+    return path.endswith(STORE_EXTENSION)
+
+
+class ChunkStoreWriter:
+    """
+    Write chunks as JSON lines, block_size chunks per gzip member.
+
+    Concatenated gzip members are themselves a valid gzip file, so the store
+    reads as plain JSONL with zcat or gzip.open. Each member can also be
+    decompressed on its own: the index written next to the store on close()
+    records where each one starts, so a reader only decompresses the blocks
+    it needs.
+    """
+
+    def __init__(self, path, block_size=BLOCK_SIZE):
+        self.path = path
+        self.block_size = block_size
+        self.file = open(path, 'wb')
+        self.lines = []
+        self.blocks = []
+        self.tracking_ids = []
+
+    def write(self, chunk):
+        self.lines.append(serializer.dumps(chunk))
+        self.tracking_ids.append(chunk.get('tracking_id'))
+        if len(self.lines) == self.block_size:
+            self.flush_block()
+
+    def flush_block(self):
+        if not self.lines:
+            return
+        data = gzip.compress(b"\n".join(self.lines) + b"\n", mtime=0)
+        self.blocks.append([self.file.tell(), len(data), len(self.tracking_ids) - len(self.lines)])
+        self.file.write(data)
+        self.lines = []
+
+    def close(self):
+        self.flush_block()
+        self.file.close()
+        index = {
+            'version': INDEX_VERSION,
+            'count': len(self.tracking_ids),
+            'size': os.path.getsize(self.path),
+            'block_size': self.block_size,
+            # [offset, length, first chunk] of each gzip member
+            'blocks': self.blocks,
+            'tracking_ids': self.tracking_ids,
+        }
+        with open(get_index_path(self.path), 'w') as f:
+            json.dump(index, f)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+        self.close()
+
+
+class ChunkStore:
+    """
+    Random access to the chunks of a store through its index, over a
+    memory-mapped file: reading a range of chunks decompresses and parses
+    only the blocks that hold it.
+
+    >>> import tempfile
+    >>> path = os.path.join(tempfile.mkdtemp(), 'chunks.jsonl.gz')
+    >>> with ChunkStoreWriter(path, block_size=4) as writer:
+    ...     for i in range(10):
+    ...         writer.write({'tracking_id': f'id-{i}'})
+    >>> with ChunkStore(path) as store:
+    ...     len(store), [chunk['tracking_id'] for chunk in store[3:6]], store.tracking_ids[-1]
+    (10, ['id-3', 'id-4', 'id-5'], 'id-9')
+    >>> with gzip.open(path, 'rt') as f:
+    ...     sum(1 for line in f)
+    10
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(get_index_path(path), 'r') as f:
+            index = json.load(f)
+        if index.get('version') != INDEX_VERSION:
+            raise ValueError(f"Unsupported chunk store index version in {get_index_path(path)}")
+        if index['size'] != os.path.getsize(path):
+            raise ValueError(f"{get_index_path(path)} does not match {path}; was the store rewritten?")
+        self.blocks = index['blocks']
+        self.block_size = index['block_size']
+        self.tracking_ids = index['tracking_ids']
+        self.file = open(path, 'rb')
+        # mmap cannot map an empty file
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if index['size'] else b''
+
+    def __len__(self):
+        return len(self.tracking_ids)
+
+    def read_block(self, number):
+        offset, length, _ = self.blocks[number]
+        data = zlib.decompress(self.data[offset:offset + length], wbits=31)
+        return data.split(b'\n')[:-1]
+
+    def iter_range(self, start=0, end=None):
+        """
+        Yield the chunks at offsets [start, end), one block at a time.
+        """
+        end = len(self) if end is None else min(end, len(self))
+        if start >= end:
+            return
+        for number in range(start // self.block_size, (end - 1) // self.block_size + 1):
+            first = self.blocks[number][2]
+            lines = self.read_block(number)
+            for line in lines[max(0, start - first):end - first]:
+                yield serializer.loads(line)
+
+    def __iter__(self):
+        return self.iter_range()
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, end, step = key.indices(len(self))
+            if step != 1:
+                raise ValueError("ChunkStore slices do not support a step")
+            return list(self.iter_range(start, end))
+        if key < 0:
+            key += len(self)
+        if not 0 <= key < len(self):
+            raise IndexError(key)
+        return next(self.iter_range(key, key + 1))
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def write_store(path, chunks, block_size=BLOCK_SIZE):
+    with ChunkStoreWriter(path, block_size) as writer:
+        for chunk in chunks:
+            writer.write(chunk)
+    return len(writer.tracking_ids)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect and convert compact chunk stores")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    dump = subparsers.add_parser('dump', help="write a chunks.md for a store, or a range of it")
+    dump.add_argument('store', help=f"chunk store (*.{STORE_EXTENSION})")
+    dump.add_argument('--md', default='chunks.md', help="markdown file to write (default: chunks.md)")
+    dump.add_argument('--start', type=int, default=0)
+    dump.add_argument('--end', type=int, default=None)
+    convert = subparsers.add_parser('convert', help="convert a chunks JSON or JSONL file to a store")
+    convert.add_argument('chunks_file')
+    convert.add_argument('--block-size', type=int, default=BLOCK_SIZE,
+                         help=f"chunks per compressed block (default: {BLOCK_SIZE})")
+    args = parser.parse_args(argv)
+
+    if args.command == 'dump':
+        count = 0
+        with ChunkStore(args.store) as store, open(args.md, 'w') as f:
+            for chunk in store.iter_range(args.start, args.end):
+                write_chunk_md(f, chunk)
+                count += 1
+        print(f"Generated {args.md} with {count} entries")
+    else:
+        with open(args.chunks_file, 'r') as f:
+            if args.chunks_file.endswith('.jsonl'):
+                chunks = [json.loads(line) for line in f]
+            else:
+                chunks = json.load(f)
+        path = f"{os.path.splitext(args.chunks_file)[0]}.{STORE_EXTENSION}"
+        count = write_store(path, chunks, args.block_size)
+        print(f"Saved {count} chunks to {path} ({os.path.getsize(path)} bytes, "
+              f"from {os.path.getsize(args.chunks_file)})")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,29 @@
+import logging
 import re
+import signal
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from metrics import METRICS
+
+# Patterns are compiled once at import rather than on every call
+DOUBLE_NEWLINE_LINK_PATTERN = re.compile(r'\[(.*?\\\s*\n\s*\\\s*\n\s*.*?)\]\((.*?)\)', re.DOTALL)
+DOUBLE_NEWLINE_PATTERN = re.compile(r'\\\s*\n\s*\\\s*\n\s*')
+ANCHORTAG_HEADING_PATTERN = re.compile(r'\[\]\((#.*?)\)\n(.*?)(?=\n|$)')
+MULTI_COLUMN_LINKS_PATTERN = re.compile(r'(\n\n)(\[(?:[^\]]+\\\s*)+[^\]]+\]\([^\)]+\)(?:\s*\[(?:[^\]]+\\\s*)+[^\]]+\]\([^\)]+\))*)\s*(?=$|\n\n)', re.DOTALL)
+LINK_PATTERN = re.compile(r'\[([^\]]+)\]\(([^\)]+)\)')
+DOUBLE_ASTERISK_GAP_PATTERN = re.compile(r'\*\*(\[.*?\]\(.*?\))\n\s*\*\*')
+LINK_NEWLINE_PERIOD_PATTERN = re.compile(r'(\[.*?\]\(.*?\))\n\.')
+LINK_NEWLINE_SPACE_PATTERN = re.compile(r'(\[.*?\]\(.*?\))\n (?=\S)')
+WHITESPACE_PATTERN = re.compile(r'\s*')
+
+# Seconds a rule may run on one chunk, and the cleaners on one page, before
+# the watchdog interrupts them; transform.py's defaults
+DEFAULT_RULE_BUDGET = 1.0
+DEFAULT_PAGE_BUDGET = 5.0
+
 
 def clean_double_newline_markdown_links(text):
     """
@@ -12,20 +37,66 @@ def clean_double_newline_markdown_links(text):
     >>> clean_double_newline_markdown_links(text)
     'Some text\\n[📄️ Metrics To monitor...](/docs/metrics/)\\nMore text'
     """
+    # Every match contains a backslash; skip the scan when there is none
+    if '\\' not in text:
+        return text
+
     def replace_link(match):
         full_content = match.group(1)
         url = match.group(2)
         
-        cleaned_content = re.sub(r'\\\s*\n\s*\\\s*\n\s*', ' ', full_content)
+        cleaned_content = DOUBLE_NEWLINE_PATTERN.sub(' ', full_content)
       
         return f'[{cleaned_content}]({url})'
 
-    pattern = r'\[(.*?\\\s*\n\s*\\\s*\n\s*.*?)\]\((.*?)\)'
-    cleaned_text = re.sub(pattern, replace_link, text, flags=re.DOTALL)
+    cleaned_text = DOUBLE_NEWLINE_LINK_PATTERN.sub(replace_link, text)
 
     return cleaned_text
 
 
+def clean_double_newline_markdown_links_linear(text):
+    """
+    clean_double_newline_markdown_links in linear time, as the fallback for
+    pages where its pattern backtracks.
+
+    The lazy pattern rescans the rest of the text from every "[" that does
+    not start a link. Here each "[" takes the next double newline, "](" and
+    ")" after it, and each of those is only searched for again once the
+    scan has passed it.
+
+    >>> text = "Some text\\n[📄️ Metrics\\\\\\n\\\\\\nTo monitor...](/docs/metrics/)\\nMore text"
+    >>> clean_double_newline_markdown_links_linear(text)
+    'Some text\\n[📄️ Metrics To monitor...](/docs/metrics/)\\nMore text'
+    """
+    if '\\' not in text:
+        return text
+
+    parts = []
+    position = 0
+    double_newline = None
+    link_middle = close = -1
+    start = text.find('[')
+    while start != -1:
+        if double_newline is None or double_newline.start() <= start:
+            double_newline = DOUBLE_NEWLINE_PATTERN.search(text, start + 1)
+            if double_newline is None:
+                break
+        if link_middle < double_newline.end():
+            link_middle = text.find('](', double_newline.end())
+            if link_middle == -1:
+                break
+        if close < link_middle + 2:
+            close = text.find(')', link_middle + 2)
+            if close == -1:
+                break
+        cleaned_content = DOUBLE_NEWLINE_PATTERN.sub(' ', text[start + 1:link_middle])
+        parts.append(f'{text[position:start]}[{cleaned_content}]({text[link_middle + 2:close]})')
+        position = close + 1
+        start = text.find('[', position)
+    parts.append(text[position:])
+    return ''.join(parts)
+
+
 def clean_anchortag_headings(text):
     """
     Replace anchortag headings with h2 tags in markdown text.
@@ -37,7 +108,42 @@ def clean_anchortag_headings(text):
     >>> clean_anchortag_headings(text)
     'Some text\\n## Heading 1\\nMore text\\n## Heading 2'
     """
-    return re.sub(r'\[\]\((#.*?)\)\n(.*?)(?=\n|$)', r'## \2', text)
+    if '[](#' not in text:
+        return text
+    return ANCHORTAG_HEADING_PATTERN.sub(r'## \2', text)
+
+
+def clean_anchortag_headings_linear(text):
+    """
+    clean_anchortag_headings in linear time, as the fallback for long lines
+    with many anchors: the pattern rescans the rest of the line from each
+    anchor, this finds each line's end once.
+
+    >>> text = "Some text\\n[](#heading1)\\nHeading 1\\nMore text\\n[](#heading2)\\nHeading 2"
+    >>> clean_anchortag_headings_linear(text)
+    'Some text\\n## Heading 1\\nMore text\\n## Heading 2'
+    """
+    parts = []
+    position = 0
+    line_end = -1
+    start = text.find('[](#')
+    while start != -1:
+        if line_end < start:
+            line_end = text.find('\n', start)
+            if line_end == -1:
+                break
+        # The anchor has to close the line
+        if line_end - 1 < start + 4 or text[line_end - 1] != ')':
+            start = text.find('[](#', start + 1)
+            continue
+        heading_end = text.find('\n', line_end + 1)
+        if heading_end == -1:
+            heading_end = len(text)
+        parts.append(f'{text[position:start]}## {text[line_end + 1:heading_end]}')
+        position = heading_end
+        start = text.find('[](#', position)
+    parts.append(text[position:])
+    return ''.join(parts)
 
 
 def remove_end_matter(text):
@@ -97,25 +203,178 @@ def clean_multi_column_links(markdown_text):
     - [Using OpenTelemetry Python SDK: Send application logs directly using OpenTelemetry Python SDK](/docs/userguide/collecting_application_logs_otel_sdk_python)
     - [Using OpenTelemetry Java SDK: Send application logs directly using OpenTelemetry Java SDK](/docs/userguide/collecting_application_logs_otel_sdk_java)
     """
-    link_pattern = r'(\n\n)(\[(?:[^\]]+\\\s*)+[^\]]+\]\([^\)]+\)(?:\s*\[(?:[^\]]+\\\s*)+[^\]]+\]\([^\)]+\))*)\s*(?=$|\n\n)'
-    
+    # Every match starts with a link at the beginning of a paragraph
+    if '\n\n[' not in markdown_text:
+        return markdown_text.strip()
+
     def clean_links(match):
-        links = re.findall(r'\[([^\]]+)\]\(([^\)]+)\)', match.group(2))
-        cleaned_links = []
-        for link_text, link_url in links:
-            clean_text = link_text.replace(r'\n\n', ': ').replace('\n', ' ').strip()
-            # Replace "\ \ " with ": "
-            clean_text = clean_text.replace(r'\ \ ', ': ')
-            cleaned_links.append(f"- [{clean_text}]({link_url})")
-        return match.group(1) + '\n'.join(cleaned_links).strip()
+        return match.group(1) + spread_links(match.group(2))
 
     # Replace matching paragraphs with cleaned links
-    cleaned_text = re.sub(link_pattern, clean_links, markdown_text, flags=re.DOTALL)
-
-    
+    cleaned_text = MULTI_COLUMN_LINKS_PATTERN.sub(clean_links, markdown_text)
 
     return cleaned_text.strip()
 
+
+def spread_links(links_markdown):
+    """
+    The links of a multi-column paragraph as a list, one link per line.
+    """
+    cleaned_links = []
+    for link_text, link_url in LINK_PATTERN.findall(links_markdown):
+        clean_text = link_text.replace(r'\n\n', ': ').replace('\n', ' ').strip()
+        # Replace "\ \ " with ": "
+        clean_text = clean_text.replace(r'\ \ ', ': ')
+        cleaned_links.append(f"- [{clean_text}]({link_url})")
+    return '\n'.join(cleaned_links).strip()
+
+
+def get_offsets(text, char):
+    offsets = []
+    offset = text.find(char)
+    while offset != -1:
+        offsets.append(offset)
+        offset = text.find(char, offset + 1)
+    return offsets
+
+
+def find_multi_column_links(text):
+    """
+    Yield (start, end of the links, end) for each match of
+    MULTI_COLUMN_LINKS_PATTERN, without backtracking.
+
+    A link's text runs to the first "]" and its url to the first ")", so
+    each link is parsed once, by bisecting the offsets of those characters.
+    A run of links then ends the match after its last link that is
+    followed by a blank line or the end of the text. The pattern instead
+    tries every way of splitting each link's text around its backslashes,
+    which is exponential when the run does not end a paragraph.
+
+    >>> text = "Intro\\n\\n[A\\\\ \\\\ a](/a) [B\\\\ \\\\ b](/b)\\n\\nEnd"
+    >>> [(match.start(), match.end(2), match.end()) for match in MULTI_COLUMN_LINKS_PATTERN.finditer(text)]
+    [(5, 32, 32)]
+    >>> list(find_multi_column_links(text))
+    [(5, 32, 32)]
+    """
+    closing_brackets = get_offsets(text, ']')
+    closing_parens = get_offsets(text, ')')
+    backslashes = get_offsets(text, '\\')
+
+    def parse_link(start):
+        """End of the multi-column link at start, or None if there is none"""
+        index = bisect_left(closing_brackets, start)
+        if index == len(closing_brackets):
+            return None
+        middle = closing_brackets[index]
+        # The link text needs a backslash with text on both sides of it
+        index = bisect_left(backslashes, start + 2)
+        if index == len(backslashes) or backslashes[index] > middle - 2:
+            return None
+        if not text.startswith('(', middle + 1):
+            return None
+        index = bisect_left(closing_parens, middle + 2)
+        if index == len(closing_parens) or closing_parens[index] == middle + 2:
+            return None
+        return closing_parens[index] + 1
+
+    # Offset of a "[" -> (end of the links, end of the match) of the longest
+    # run of links from there that can end a match, or None
+    runs = {}
+
+    def find_run(start):
+        links = []
+        offset = start
+        while offset is not None and offset not in runs:
+            link_end = parse_link(offset)
+            if link_end is None:
+                runs[offset] = None
+                break
+            whitespace_end = WHITESPACE_PATTERN.match(text, link_end).end()
+            if whitespace_end == len(text):
+                match_end = whitespace_end
+            else:
+                blank_line = text.rfind('\n\n', link_end, whitespace_end)
+                match_end = blank_line if blank_line != -1 else None
+            links.append((offset, link_end, match_end))
+            offset = whitespace_end if text.startswith('[', whitespace_end) else None
+        run = runs.get(offset)
+        for offset, link_end, match_end in reversed(links):
+            if run is None and match_end is not None:
+                run = (link_end, match_end)
+            runs[offset] = run
+        return runs[start]
+
+    start = text.find('\n\n[')
+    while start != -1:
+        run = find_run(start + 2)
+        if run is None:
+            start = text.find('\n\n[', start + 1)
+            continue
+        yield start, run[0], run[1]
+        start = text.find('\n\n[', run[1])
+
+
+def clean_multi_column_links_linear(markdown_text):
+    """
+    clean_multi_column_links in linear time (up to the bisection), as the
+    fallback for pages where its pattern backtracks.
+
+    >>> markdown_text = "Some regular text in a paragraph.\\n\\n[Link 1\\\\n\\\\nDescription 1](/url1) [Link 2\\\\n\\\\nDescription 2](/url2)\\n\\nAnother paragraph with regular text."
+    >>> clean_multi_column_links_linear(markdown_text) == clean_multi_column_links(markdown_text)
+    True
+    """
+    if '\n\n[' not in markdown_text:
+        return markdown_text.strip()
+
+    parts = []
+    position = 0
+    for start, links_end, end in find_multi_column_links(markdown_text):
+        parts.append(markdown_text[position:start])
+        parts.append('\n\n' + spread_links(markdown_text[start + 2:links_end]))
+        position = end
+    parts.append(markdown_text[position:])
+    return ''.join(parts).strip()
+
+
+def join_links_to_next_line(text, opening, get_match_end, joint):
+    """
+    Replace each match of `opening`, a link and the newline after it, up
+    to get_match_end(offset of the newline), by the text up to the newline
+    and joint.
+
+    Neither part of the link spans a newline, so the link has to close its
+    line, and a line matches from its first opening or not at all. Each
+    line is searched for "](" once, where the lazy link patterns rescan it
+    from every "[" on it.
+
+    >>> text = "[a](/a)\\n.\\n[b](/b)\\nc"
+    >>> join_links_to_next_line(text, '[', lambda end: end + 2 if text.startswith('.', end + 1) else None, '.')
+    '[a](/a).\\n[b](/b)\\nc'
+    """
+    parts = []
+    position = 0
+    line_end = -1
+    match_end = None
+    start = text.find(opening)
+    while start != -1:
+        if line_end < start:
+            line_end = text.find('\n', start)
+            if line_end == -1:
+                break
+            link_start = start + len(opening) - 1
+            match_end = None
+            if text[line_end - 1] == ')' and text.find('](', link_start + 1, line_end - 1) != -1:
+                match_end = get_match_end(line_end)
+        if match_end is None:
+            start = text.find(opening, line_end + 1)
+            continue
+        parts.append(text[position:line_end] + joint)
+        position = match_end
+        start = text.find(opening, position)
+    parts.append(text[position:])
+    return ''.join(parts)
+
+
 def clean_double_asterisk_whitespace_gaps(text):
     """
     When double asterisks appear immediately before the start of a link,
@@ -148,7 +407,27 @@ def clean_double_asterisk_whitespace_gaps(text):
         >>> clean_double_asterisk_whitespace_gaps(text)
         'Unaffected **[Link](#url)** text'
     """
-    return re.sub(r'\*\*(\[.*?\]\(.*?\))\n\s*\*\*', r'**\1**', text)
+    if '**[' not in text:
+        return text
+    return DOUBLE_ASTERISK_GAP_PATTERN.sub(r'**\1**', text)
+
+
+def clean_double_asterisk_whitespace_gaps_linear(text):
+    """
+    clean_double_asterisk_whitespace_gaps in linear time, as the fallback
+    for long lines with many bold links.
+
+    >>> clean_double_asterisk_whitespace_gaps_linear("Normal text **[Link text](#link-url)\\n    ** More text")
+    'Normal text **[Link text](#link-url)** More text'
+    """
+    if '**[' not in text:
+        return text
+
+    def get_match_end(line_end):
+        whitespace_end = WHITESPACE_PATTERN.match(text, line_end).end()
+        return whitespace_end + 2 if text.startswith('**', whitespace_end) else None
+
+    return join_links_to_next_line(text, '**[', get_match_end, '**')
 
 
 def clean_extra_newlines_after_links(text):
@@ -179,15 +458,215 @@ def clean_extra_newlines_after_links(text):
         >>> clean_extra_newlines_after_links(text)
         '[link](https://example.com)\\n\\nNext good paragraph.'
     """
+    # Both passes need a link closing right before a newline. The lazy link
+    # patterns rescan each line from every "[", so skip them when they can't match
+    if ')\n' not in text:
+        return text
+
     # Remove newline between link and period
-    text = re.sub(r'(\[.*?\]\(.*?\))\n\.', r'\1.', text)
+    if ')\n.' in text:
+        text = LINK_NEWLINE_PERIOD_PATTERN.sub(r'\1.', text)
     
     # Remove newline immediately after link when it is followed by a space
-    text = re.sub(r'(\[.*?\]\(.*?\))\n (?=\S)', r'\1 ', text)
+    if ')\n ' in text:
+        text = LINK_NEWLINE_SPACE_PATTERN.sub(r'\1 ', text)
     
     return text
 
 
+def clean_extra_newlines_after_links_linear(text):
+    """
+    clean_extra_newlines_after_links in linear time, as the fallback for
+    long lines with many links.
+
+    >>> clean_extra_newlines_after_links_linear("[link](https://example.com)\\n.\\n\\nNext paragraph.")
+    '[link](https://example.com).\\n\\nNext paragraph.'
+    >>> clean_extra_newlines_after_links_linear("[link](https://example.com)\\n next words.")
+    '[link](https://example.com) next words.'
+    """
+    if ')\n' not in text:
+        return text
+
+    if ')\n.' in text:
+        text = join_links_to_next_line(
+            text, '[', lambda line_end: line_end + 2 if text.startswith('.', line_end + 1) else None, '.')
+
+    if ')\n ' in text:
+        def get_match_end(line_end):
+            if text.startswith(' ', line_end + 1) and line_end + 2 < len(text) and not text[line_end + 2].isspace():
+                return line_end + 2
+            return None
+        text = join_links_to_next_line(text, '[', get_match_end, ' ')
+
+    return text
+
+
+class CleanerTimeout(Exception):
+    """A cleaner rule ran past its time budget"""
+
+
+def can_interrupt():
+    return hasattr(signal, 'setitimer') and threading.current_thread() is threading.main_thread()
+
+
+@contextmanager
+def time_budget(seconds):
+    """
+    Raise CleanerTimeout in the block once it has run for `seconds`.
+
+    The watchdog is a SIGALRM timer, and the regex engine checks for signals
+    while it backtracks, so it interrupts a runaway pattern. Signals are
+    only delivered to the main thread: elsewhere, or without SIGALRM, the
+    block runs unbounded.
+
+    >>> try:
+    ...     with time_budget(0.05):
+    ...         MULTI_COLUMN_LINKS_PATTERN.sub('', '\\n\\n' + '[a\\\\ \\\\ b](/c) ' * 20 + '[')
+    ... except CleanerTimeout:
+    ...     print('interrupted')
+    interrupted
+    """
+    if not seconds or not can_interrupt():
+        yield
+        return
+
+    def expire(signum, frame):
+        raise CleanerTimeout()
+
+    previous = signal.signal(signal.SIGALRM, expire)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+class CleanerPipeline:
+    """
+    Apply named cleaner rules to chunk markdown in the order they were registered.
+
+    With a rule_budget, each rule gets that many seconds per call; with a
+    page_budget, the rules share that many seconds per page (from
+    start_page()). A rule that runs out of time is interrupted and its
+    fallback, a linear-time version of it, cleans the text instead; a rule
+    without a fallback leaves the text as it is. Once a page has used its
+    budget, only fallbacks run on the rest of it. Each interruption is kept
+    in timeouts, with the page, the rule and its input, until taken.
+
+    The watchdog only runs in the main thread. Elsewhere, such as the stage
+    thread of pipeline.py with --workers 1, the budgets are not enforced:
+    the first such call logs a warning, and each is counted in the
+    cleaner_budget_unenforced metric.
+
+    >>> pipeline = CleanerPipeline()
+    >>> _ = pipeline.register('strip', str.strip)
+    >>> _ = pipeline.register('upper', str.upper)
+    >>> pipeline.names()
+    ['strip', 'upper']
+    >>> pipeline("  some text ")
+    'SOME TEXT'
+    >>> def stall(text):
+    ...     while True:
+    ...         pass
+    >>> pipeline = CleanerPipeline(rule_budget=0.05)
+    >>> _ = pipeline.register('stall', stall, fallback=str.upper)
+    >>> pipeline.start_page('https://example.com/')
+    >>> pipeline("some text")
+    'SOME TEXT'
+    >>> [(timeout['page'], timeout['rule']) for timeout in pipeline.take_timeouts()]
+    [('https://example.com/', 'stall')]
+    """
+
+    def __init__(self, rule_budget=None, page_budget=None):
+        self.rules = []
+        self.fallbacks = {}
+        self.rule_budget = rule_budget
+        self.page_budget = page_budget
+        self.page = None
+        self.page_seconds = 0.0
+        self.timeouts = []
+        self.warned_unenforced = False
+
+    def register(self, name, cleaner, fallback=None):
+        self.rules.append((name, cleaner))
+        if fallback is not None:
+            self.fallbacks[name] = fallback
+        return cleaner
+
+    def names(self):
+        return [name for name, _ in self.rules]
+
+    def set_budgets(self, rule_budget=None, page_budget=None):
+        self.rule_budget = rule_budget or None
+        self.page_budget = page_budget or None
+
+    def get_budgets(self):
+        return self.rule_budget, self.page_budget
+
+    def start_page(self, page):
+        """
+        Start the page budget over, for the page (its url) whose text is
+        cleaned next.
+        """
+        self.page = page
+        self.page_seconds = 0.0
+
+    def take_timeouts(self):
+        timeouts, self.timeouts = self.timeouts, []
+        return timeouts
+
+    def fall_back(self, name, text):
+        fallback = self.fallbacks.get(name)
+        return fallback(text) if fallback else text
+
+    def apply(self, name, cleaner, text):
+        budget = self.rule_budget
+        if self.page_budget:
+            remaining = self.page_budget - self.page_seconds
+            if remaining <= 0:
+                return self.fall_back(name, text)
+            budget = min(budget, remaining) if budget else remaining
+        if budget and not can_interrupt():
+            METRICS.inc('cleaner_budget_unenforced')
+            if not self.warned_unenforced:
+                self.warned_unenforced = True
+                logging.warning("Cleaner time budgets are not enforced outside the main thread "
+                                f"({threading.current_thread().name}); run the cleaners in worker processes "
+                                "to enforce them")
+        try:
+            with time_budget(budget):
+                return cleaner(text)
+        except CleanerTimeout:
+            METRICS.inc('cleaner_timeouts')
+            self.timeouts.append({'page': self.page, 'rule': name, 'budget': round(budget, 3), 'text': text})
+            return self.fall_back(name, text)
+
+    def __call__(self, text):
+        for name, cleaner in self.rules:
+            start = time.perf_counter()
+            text = self.apply(name, cleaner, text)
+            seconds = time.perf_counter() - start
+            METRICS.add_time(f'cleaner.{name}', seconds)
+            self.page_seconds += seconds
+        return text
+
+
+# The cleaners applied to every chunk, in order, with their linear-time
+# fallbacks
+CHUNK_CLEANERS = CleanerPipeline()
+CHUNK_CLEANERS.register('multi_column_links', clean_multi_column_links,
+                        fallback=clean_multi_column_links_linear)
+CHUNK_CLEANERS.register('double_newline_markdown_links', clean_double_newline_markdown_links,
+                        fallback=clean_double_newline_markdown_links_linear)
+CHUNK_CLEANERS.register('anchortag_headings', clean_anchortag_headings,
+                        fallback=clean_anchortag_headings_linear)
+CHUNK_CLEANERS.register('extra_newlines_after_links', clean_extra_newlines_after_links,
+                        fallback=clean_extra_newlines_after_links_linear)
+CHUNK_CLEANERS.register('double_asterisk_whitespace_gaps', clean_double_asterisk_whitespace_gaps,
+                        fallback=clean_double_asterisk_whitespace_gaps_linear)
+
+
 if __name__ == "__main__":
     import doctest
     doctest.testmod()
\ No newline at end of file
@@ -0,0 +1,41 @@
+"""One command line for the crawl, transform, load and suggest scripts"""
+
+import argparse
+import importlib
+import os
+import sys
+
+# subcommand -> (module, description). A module is only imported when its
+# subcommand runs, so `cli.py load` never pays for markdown and the renderers.
+COMMANDS = {
+    'crawl': ('run_firecrawl', "crawl the site with Firecrawl and save the crawl results"),
+    'transform': ('transform', "turn crawl results into Trieve chunks"),
+    'load': ('load', "upload chunks to a Trieve dataset"),
+    'suggest': ('suggestions', "get suggested queries for the dataset"),
+    'evaluate': ('evaluate', "compare search results between the baseline and boost datasets"),
+    'pipeline': ('pipeline', "crawl, transform and load in one pipelined run"),
+    'sites': ('scheduler', "crawl, transform and load every site of a site manifest"),
+    'dedup': ('dedup', "report near-duplicate chunks in a chunks file"),
+    'store': ('chunk_store', "inspect and convert compact chunk stores"),
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Crawl a site with Firecrawl and load it into Trieve",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="commands:\n" + "\n".join(f"  {name:<10} {description}"
+                                         for name, (_, description) in COMMANDS.items())
+                + "\n\nRun `cli.py <command> --help` for the options of a command.")
+    parser.add_argument('command', choices=COMMANDS, metavar='command')
+    parser.add_argument('args', nargs=argparse.REMAINDER, help="arguments for the command")
+    args = parser.parse_args(argv)
+
+    module = importlib.import_module(COMMANDS[args.command][0])
+    # So the command's usage reads `cli.py load ...`
+    sys.argv[0] = f"{os.path.basename(sys.argv[0])} {args.command}"
+    module.main(args.args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+"""Collapse exact and near-duplicate chunks before they are loaded"""
+
+import argparse
+import hashlib
+import json
+import operator
+import re
+import zlib
+from array import array
+
+from metrics import METRICS
+
+DEFAULT_THRESHOLD = 0.9
+NUM_BINS = 64
+SHINGLE_SIZE = 4
+# Kept chunks remembered per LSH bucket; bounds the comparisons per chunk
+BUCKET_SIZE = 4
+
+TAG_PATTERN = re.compile(r'<[^>]+>')
+WORD_PATTERN = re.compile(r'\w+')
+
+
+def get_words(chunk_html):
+    """
+    Lowercased words of a chunk, leaving out its first line: the
+    "page title: heading" line transform.py sets, which differs between pages
+    even when the content below it is the same.
+
+    >>> get_words('<p>Install: Linux</p>\\n<p>Run <code>curl | sh</code> to Install.</p>')
+    ['run', 'curl', 'sh', 'to', 'install']
+    """
+    body = chunk_html.partition('\n')[2] or chunk_html
+    return WORD_PATTERN.findall(TAG_PATTERN.sub(' ', body).lower())
+
+
+def get_signature(words, num_bins=NUM_BINS, shingle_size=SHINGLE_SIZE):
+    """
+    MinHash signature of the word shingles, computed with one-permutation
+    hashing: each shingle is hashed once and the hash picks both the bin and
+    the value competing for that bin's minimum. That keeps the cost linear in
+    the length of the text. Empty bins borrow the value of the next
+    non-empty bin so short texts still have a full signature.
+
+    The fraction of bins on which two signatures agree estimates the Jaccard
+    similarity of their shingle sets.
+
+    >>> words = 'send logs to signoz from fluentd fluent bit logstash vector and the otel collector'.split()
+    >>> get_similarity(get_signature(words), get_signature(words + ['syslog']))
+    0.9375
+    >>> get_similarity(get_signature(words), get_signature(list(reversed(words))))
+    0.0
+    """
+    if len(words) > shingle_size:
+        shingles = map(' '.join, zip(*(words[i:] for i in range(shingle_size))))
+    else:
+        shingles = [' '.join(words)]
+    values = set(map(zlib.crc32, map(str.encode, shingles)))
+
+    empty = 1 << 32
+    bins = [empty] * num_bins
+    # Largest first, so the smallest value of each bin is written last
+    for value in sorted(values, reverse=True):
+        bins[value % num_bins] = value
+
+    filled = [index for index, value in enumerate(bins) if value != empty]
+    if len(filled) < num_bins:
+        # Densify: walk backwards so every empty bin takes the next filled one
+        following = bins[filled[0]]
+        for index in range(num_bins - 1, -1, -1):
+            if bins[index] == empty:
+                bins[index] = following
+            else:
+                following = bins[index]
+    return array('I', bins)
+
+
+def get_similarity(signature, other):
+    return sum(map(operator.eq, signature, other)) / len(signature)
+
+
+def get_bands(num_bins, threshold):
+    """
+    Rows per LSH band: the largest that still makes chunks at the threshold
+    share a band with high probability, so few near duplicates are missed.
+
+    >>> get_bands(64, 0.9), get_bands(64, 0.7)
+    (8, 4)
+    """
+    rows = 1
+    for candidate in (r for r in range(1, num_bins + 1) if num_bins % r == 0):
+        bands = num_bins // candidate
+        # Probability that two chunks at the threshold share no band
+        if (1 - threshold ** candidate) ** bands <= 0.05:
+            rows = candidate
+    return rows
+
+
+class Deduplicator:
+    """
+    Streaming filter that drops chunks whose content is the same as, or
+    nearly the same as, a chunk it has already let through.
+
+    Exact duplicates are found by a digest of the chunk's words. Near
+    duplicates are found through a locality-sensitive index: each kept
+    chunk's MinHash signature is split into bands and filed under each band.
+    A new chunk is only compared with the kept chunks it shares a band with,
+    and merged into the first whose estimated similarity reaches the
+    threshold. The work per chunk is bounded, so a crawl is deduplicated in
+    linear time.
+
+    >>> chunks = [{'tracking_id': page, 'chunk_html': f'<p>{page}: Send logs</p>\\n<p>{body}</p>'}
+    ...           for page, body in [('a', 'Send logs from fluentd fluent bit or vector to SigNoz cloud today'),
+    ...                              ('b', 'Send logs from fluentd fluent bit or vector to SigNoz cloud today'),
+    ...                              ('c', 'Send logs from fluentd fluent bit or vector to SigNoz cloud today!'),
+    ...                              ('d', 'Query traces with the trace explorer and filter by service')]]
+    >>> deduplicator = Deduplicator()
+    >>> [chunk['tracking_id'] for chunk in deduplicator.filter(chunks)]
+    ['a', 'd']
+    >>> deduplicator.merged
+    {'a': [{'tracking_id': 'b', 'similarity': 1.0}, {'tracking_id': 'c', 'similarity': 1.0}]}
+    """
+
+    def __init__(self, threshold=DEFAULT_THRESHOLD, num_bins=NUM_BINS, shingle_size=SHINGLE_SIZE):
+        self.threshold = threshold
+        self.num_bins = num_bins
+        self.shingle_size = shingle_size
+        self.rows = get_bands(num_bins, threshold)
+        self.exact = {}
+        self.buckets = {}
+        # Signatures and tracking_ids of kept chunks, by position
+        self.signatures = []
+        self.tracking_ids = []
+        # kept tracking_id -> chunks merged into it
+        self.merged = {}
+
+    def find(self, words):
+        """
+        Return (position of the kept chunk, similarity) for a duplicate, or
+        (None, signature) if the chunk is new.
+        """
+        digest = hashlib.blake2b(' '.join(words).encode('utf-8'), digest_size=16).digest()
+        if digest in self.exact:
+            return self.exact[digest], 1.0
+
+        signature = get_signature(words, self.num_bins, self.shingle_size)
+        keys = [(start, signature[start:start + self.rows].tobytes())
+                for start in range(0, self.num_bins, self.rows)]
+        compared = set()
+        for key in keys:
+            for position in self.buckets.get(key, ()):
+                if position in compared:
+                    continue
+                compared.add(position)
+                similarity = get_similarity(signature, self.signatures[position])
+                if similarity >= self.threshold:
+                    return position, similarity
+
+        position = len(self.signatures)
+        self.exact[digest] = position
+        for key in keys:
+            bucket = self.buckets.setdefault(key, [])
+            if len(bucket) < BUCKET_SIZE:
+                bucket.append(position)
+        return None, signature
+
+    def add(self, chunk):
+        """
+        Index a chunk, returning the tracking_id of the chunk it duplicates
+        or None if it is kept.
+        """
+        with METRICS.timer('dedup'):
+            position, found = self.find(get_words(chunk['chunk_html']))
+            if position is None:
+                self.signatures.append(found)
+                self.tracking_ids.append(chunk['tracking_id'])
+                return None
+            kept = self.tracking_ids[position]
+            self.merged.setdefault(kept, []).append(
+                {'tracking_id': chunk['tracking_id'], 'similarity': round(found, 3)})
+            METRICS.inc('chunks_merged')
+            return kept
+
+    def filter(self, chunks):
+        for chunk in chunks:
+            if self.add(chunk) is None:
+                yield chunk
+
+    def report(self):
+        return {
+            'threshold': self.threshold,
+            'kept': len(self.tracking_ids),
+            'merged': sum(len(merged) for merged in self.merged.values()),
+            'groups': self.merged,
+        }
+
+    def save_report(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=2)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Report near-duplicate chunks in a chunks file")
+    parser.add_argument('chunks_file', help="chunks JSON or JSONL file")
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help=f"minimum estimated Jaccard similarity to merge (default: {DEFAULT_THRESHOLD})")
+    parser.add_argument('--output', default=None, help="write the kept chunks to this JSONL file")
+    parser.add_argument('--report', default='dedup_report.json',
+                        help="where to write which tracking_ids were merged (default: dedup_report.json)")
+    args = parser.parse_args(argv)
+
+    with open(args.chunks_file, 'r') as f:
+        if args.chunks_file.endswith('.jsonl'):
+            chunks = [json.loads(line) for line in f]
+        else:
+            chunks = json.load(f)
+
+    deduplicator = Deduplicator(args.threshold)
+    kept = list(deduplicator.filter(chunks))
+    if args.output:
+        with open(args.output, 'w') as f:
+            for chunk in kept:
+                f.write(json.dumps(chunk) + "\n")
+    deduplicator.save_report(args.report)
+    print(f"Kept {len(kept)} of {len(chunks)} chunks; merged tracking_ids written to {args.report}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,321 @@
+"""Run queries concurrently against the baseline and boost datasets and compare their results"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import dotenv
+
+import load
+import suggestions
+from load_test import percentile
+
+DATASETS = {
+    'baseline': 'TRIEVE_DATASET_ID_BASELINE',
+    'boost': 'TRIEVE_DATASET_ID_BOOST',
+}
+SEARCH_TYPE = 'fulltext'
+PAGE_SIZE = 10
+DEFAULT_CACHE = 'query_cache.sqlite3'
+DEFAULT_OUTPUT = 'eval_results.json'
+
+
+def get_configurations(dataset_ids=None):
+    """
+    Configuration per dataset, as suggestions.get_configuration() builds it,
+    for the datasets whose id is set.
+    """
+    base = suggestions.get_configuration()
+    dataset_ids = dataset_ids or {name: os.getenv(variable) for name, variable in DATASETS.items()}
+    return {name: dict(base, dataset_id=dataset_id) for name, dataset_id in dataset_ids.items() if dataset_id}
+
+
+def get_request(config, query, search_type=SEARCH_TYPE, page_size=PAGE_SIZE):
+    # Dataset ids are unique across Trieve hosts, so the host is left out
+    return {
+        'path': '/api/chunk/search',
+        'dataset_id': config['dataset_id'],
+        'payload': {'query': query, 'search_type': search_type, 'page_size': page_size},
+    }
+
+
+def get_request_key(request):
+    """
+    Hash of everything that determines the response to a search request.
+
+    >>> request = get_request({'dataset_id': 'd'}, 'traces')
+    >>> get_request_key(request) == get_request_key(json.loads(json.dumps(request)))
+    True
+    >>> get_request_key(request) == get_request_key(get_request({'dataset_id': 'e'}, 'traces'))
+    False
+    """
+    return hashlib.blake2b(json.dumps(request, sort_keys=True).encode('utf-8'), digest_size=16).hexdigest()
+
+
+class ResponseCache:
+    """
+    On-disk cache of search responses by request hash, so re-running an
+    evaluation only sends the requests it has not sent before. Responses
+    are kept until the file is removed, including across reloads of a
+    dataset, so main() only uses a cache with --cache.
+
+    >>> cache = ResponseCache(':memory:')
+    >>> cache.put('key', {'chunks': []})
+    >>> cache.get('key'), cache.get('other'), (cache.hits, cache.misses)
+    ({'chunks': []}, None, (1, 1))
+    >>> cache.close()
+    """
+
+    def __init__(self, path):
+        self.hits = 0
+        self.misses = 0
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, response TEXT, created REAL)")
+        self.connection.commit()
+
+    def get(self, key):
+        row = self.connection.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, key, response):
+        self.connection.execute("INSERT OR REPLACE INTO responses (key, response, created) VALUES (?, ?, ?)",
+                                (key, json.dumps(response), time.time()))
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
+
+
+def search(session, config, request, max_retries=load.MAX_RETRIES):
+    """
+    Send a search request, retrying 429s and 5xx as load.py does. Return the
+    response body and the latency of the request that answered it.
+    """
+    headers = {
+        "Authorization": f"Bearer {config['api_key']}",
+        "TR-Dataset": request['dataset_id'],
+        "X-API-Version": "V2",
+        "Content-Type": "application/json",
+    }
+    for attempt in range(max_retries + 1):
+        start = time.perf_counter()
+        response = session.post(config['base_path'] + request['path'], json=request['payload'],
+                                headers=headers, timeout=load.REQUEST_TIMEOUT)
+        latency = time.perf_counter() - start
+        if response.status_code in load.RETRY_STATUS_CODES and attempt < max_retries:
+            retry_after = load.get_retry_after(response)
+            time.sleep(retry_after if retry_after is not None else load.get_backoff(attempt))
+            continue
+        response.raise_for_status()
+        return response.json(), latency
+
+
+def get_result_ids(response):
+    """
+    tracking_ids of the chunks in a search response, best first, from either
+    the V2 ('chunks') or the V1 ('score_chunks') response shape.
+
+    >>> get_result_ids({'chunks': [{'chunk': {'tracking_id': 'a'}, 'score': 2.0}]})
+    ['a']
+    >>> get_result_ids({'score_chunks': [{'metadata': [{'tracking_id': 'b'}], 'score': 1.0}]})
+    ['b']
+    """
+    if 'chunks' in response:
+        return [result['chunk'].get('tracking_id') for result in response['chunks']]
+    return [result['metadata'][0].get('tracking_id') for result in response.get('score_chunks', [])]
+
+
+def get_overlap(ids, other):
+    """
+    Share of the top results two result lists have in common.
+
+    >>> get_overlap(['a', 'b', 'c', 'd'], ['b', 'a', 'e', 'f'])
+    0.5
+    >>> get_overlap([], [])
+    1.0
+    """
+    size = max(len(ids), len(other))
+    return len(set(ids) & set(other)) / size if size else 1.0
+
+
+def evaluate(queries, configs, session, cache=None, concurrency=4, search_type=SEARCH_TYPE,
+             page_size=PAGE_SIZE):
+    """
+    Search every query in every dataset with at most `concurrency` requests
+    in flight, answering from the cache where possible. Return the results
+    per query and the latency statistics per dataset, which are None for a
+    dataset that was sent no requests.
+
+    >>> from fake_trieve import FakeTrieve
+    >>> cache = ResponseCache(':memory:')
+    >>> with FakeTrieve() as trieve:
+    ...     trieve.chunks['d'] = {'a': {'tracking_id': 'a', 'chunk_html': 'traces'}}
+    ...     configs = {'baseline': {'api_key': 'key', 'base_path': trieve.url, 'dataset_id': 'd'}}
+    ...     session = load.get_session()
+    ...     first = evaluate(['traces'], configs, session, cache)['datasets']['baseline']
+    ...     second = evaluate(['traces'], configs, session, cache)['datasets']['baseline']
+    >>> first['requests'], first['latency_p50'] is not None, second['requests'], second['cached'], second['latency_p50']
+    (1, True, 0, 1, None)
+    """
+    import requests
+
+    results = {query: {} for query in queries}
+    pending = []
+    for query in queries:
+        for name, config in configs.items():
+            request = get_request(config, query, search_type, page_size)
+            key = get_request_key(request)
+            cached = cache.get(key) if cache else None
+            if cached is not None:
+                results[query][name] = {'tracking_ids': get_result_ids(cached), 'cached': True}
+            else:
+                pending.append((query, name, request, key))
+
+    latencies = {name: [] for name in configs}
+    errors = {name: 0 for name in configs}
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = {executor.submit(search, session, configs[name], request): (query, name, key)
+                   for query, name, request, key in pending}
+        for future in as_completed(futures):
+            query, name, key = futures[future]
+            try:
+                response, latency = future.result()
+            except requests.RequestException as e:
+                logging.error(f"Search for {query!r} in {name} failed: {e}")
+                results[query][name] = {'error': str(e)}
+                errors[name] += 1
+                continue
+            # The cache is only used from this thread
+            if cache:
+                cache.put(key, response)
+            latencies[name].append(latency)
+            results[query][name] = {'tracking_ids': get_result_ids(response), 'cached': False,
+                                    'latency': round(latency, 4)}
+
+    datasets = {name: {
+        'requests': len(latencies[name]),
+        'cached': sum(1 for query in queries if results[query][name].get('cached')),
+        'errors': errors[name],
+        'latency_p50': round(percentile(latencies[name], 0.50), 4) if latencies[name] else None,
+        'latency_p95': round(percentile(latencies[name], 0.95), 4) if latencies[name] else None,
+    } for name in configs}
+
+    overlap_mean = None
+    if 'baseline' in configs and 'boost' in configs:
+        overlaps = []
+        for query in queries:
+            baseline, boost = results[query]['baseline'], results[query]['boost']
+            if 'tracking_ids' in baseline and 'tracking_ids' in boost:
+                results[query]['overlap'] = get_overlap(baseline['tracking_ids'], boost['tracking_ids'])
+                overlaps.append(results[query]['overlap'])
+        overlap_mean = round(sum(overlaps) / len(overlaps), 4) if overlaps else None
+
+    return {'queries': results, 'datasets': datasets, 'overlap_mean': overlap_mean}
+
+
+def get_queries(args, config):
+    queries = list(args.query or [])
+    if args.queries_file:
+        with open(args.queries_file, 'r') as f:
+            queries.extend(line.strip() for line in f if line.strip())
+    if not queries:
+        for seed in args.suggest or ["<string>"]:
+            queries.extend(suggestions.get_suggestions(config, seed).get('queries', []))
+    # Keep the first occurrence of each query
+    return list(dict.fromkeys(queries))
+
+
+def start_local(chunk_files, latency):
+    """
+    Start a FakeTrieve holding each chunk file in its own dataset, and point
+    the configuration at it. Each dataset is named after its chunk file, so
+    cached responses are reused only for the same chunks.
+    """
+    from fake_trieve import FakeTrieve
+
+    trieve = FakeTrieve(latency=latency).start()
+    dataset_ids = {}
+    for name, chunk_file in chunk_files.items():
+        dataset_id = f"local-{os.path.basename(chunk_file)}"
+        chunks = load.read_chunks(chunk_file)
+        trieve.chunks[dataset_id] = {chunk['tracking_id']: chunk for chunk in chunks}
+        if isinstance(chunks, load.ChunkStore):
+            chunks.close()
+        dataset_ids[name] = dataset_id
+        print(f"Serving {len(trieve.chunks[dataset_id])} {name} chunks from {chunk_file}")
+    os.environ['TRIEVE_BASE_URL'] = trieve.url
+    return trieve, dataset_ids
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare search results between the baseline and boost datasets")
+    parser.add_argument('--query', action='append', default=None, help="query to run (repeatable)")
+    parser.add_argument('--queries-file', default=None, help="file of queries, one per line")
+    parser.add_argument('--suggest', action='append', default=None,
+                        help="without queries: run the queries Trieve suggests for this (repeatable)")
+    parser.add_argument('--concurrency', type=int, default=4, help="searches in flight at once (default: 4)")
+    parser.add_argument('--search-type', default=SEARCH_TYPE, help=f"(default: {SEARCH_TYPE})")
+    parser.add_argument('--page-size', type=int, default=PAGE_SIZE, help=f"results per query (default: {PAGE_SIZE})")
+    parser.add_argument('--cache', nargs='?', const=DEFAULT_CACHE, default=None,
+                        help="answer repeated requests from this response cache; clear it after reloading a "
+                             f"dataset (default: {DEFAULT_CACHE})")
+    parser.add_argument('--output', default=DEFAULT_OUTPUT, help=f"results file (default: {DEFAULT_OUTPUT})")
+    parser.add_argument('--local', action='store_true',
+                        help="search a local fake Trieve loaded with the latest baseline and boost chunk files")
+    parser.add_argument('--latency', type=float, default=0.0, help="with --local: seconds added to every response")
+    args = parser.parse_args(argv)
+
+    dotenv.load_dotenv()
+    load.setup_logging()
+
+    trieve = None
+    dataset_ids = None
+    if args.local:
+        chunk_files = {name: load.find_variant_chunk_file(name) for name in DATASETS}
+        trieve, dataset_ids = start_local({name: path for name, path in chunk_files.items() if path},
+                                          args.latency)
+    configs = get_configurations(dataset_ids)
+    if not configs:
+        print(f"No datasets to search: set {' or '.join(DATASETS.values())}")
+        return
+
+    cache = ResponseCache(args.cache) if args.cache else None
+    try:
+        queries = get_queries(args, next(iter(configs.values())))
+        session = load.get_session(args.concurrency)
+        start = time.perf_counter()
+        results = evaluate(queries, configs, session, cache, args.concurrency, args.search_type, args.page_size)
+        seconds = time.perf_counter() - start
+    finally:
+        if cache:
+            cache.close()
+        if trieve:
+            trieve.stop()
+
+    print(f"{len(queries)} queries in {seconds:.2f} s")
+    for name in configs:
+        stats = results['datasets'][name]
+        latency = "  no requests sent"
+        if stats['latency_p50'] is not None:
+            latency = f"  p50 {stats['latency_p50'] * 1000:.1f} ms  p95 {stats['latency_p95'] * 1000:.1f} ms"
+        print(f"  {name:<10} {stats['requests']:>5} requests {stats['cached']:>5} cached {stats['errors']:>3} errors"
+              + latency)
+    if results['overlap_mean'] is not None:
+        print(f"  mean top-{args.page_size} overlap between baseline and boost: {results['overlap_mean']:.2f}")
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Saved results to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
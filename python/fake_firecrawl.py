@@ -0,0 +1,108 @@
+"""Local stand-in for the Firecrawl v0 crawl API, serving pages from a crawl results file"""
+
+import argparse
+import json
+import time
+import uuid
+from urllib.parse import urlparse
+
+from fake_trieve import LocalServer
+
+DEFAULT_CRAWL_FILE = '../example_crawl_results_2024-08-20T16-35-59.json'
+PARTIAL_DATA_PAGES = 50
+
+
+class FakeFirecrawl(LocalServer):
+    """
+    POST /v0/crawl starts a job that "crawls" the given pages on the host of
+    its url at pages_per_second. GET /v0/crawl/status/<jobId> reports it as
+    active, with the most recently crawled pages in partial_data, until
+    every page is crawled; then it is completed with all pages in data.
+
+    >>> import requests
+    >>> pages = [{'markdown': 'a', 'metadata': {'sourceURL': 'https://example.com/a'}}]
+    >>> with FakeFirecrawl(pages, pages_per_second=1000, api_key='key') as firecrawl:
+    ...     headers = {'Authorization': 'Bearer key'}
+    ...     job = requests.post(f'{firecrawl.url}/v0/crawl', headers=headers,
+    ...                         json={'url': 'https://example.com/'}).json()
+    ...     time.sleep(0.05)
+    ...     status = requests.get(f"{firecrawl.url}/v0/crawl/status/{job['jobId']}", headers=headers).json()
+    >>> status['status'], status['total'], status['data'] == pages
+    ('completed', 1, True)
+    """
+
+    def __init__(self, pages, host='127.0.0.1', port=0, api_key=None, pages_per_second=10.0,
+                 partial_data_pages=PARTIAL_DATA_PAGES, **options):
+        super().__init__(host, port, **options)
+        self.pages = list(pages)
+        self.api_key = api_key
+        self.pages_per_second = pages_per_second
+        self.partial_data_pages = partial_data_pages
+        # jobId -> (start time, pages of the job)
+        self.jobs = {}
+
+    def get_pages(self, url):
+        host = urlparse(url).netloc
+        return [page for page in self.pages if urlparse(page['metadata'].get('sourceURL', '')).netloc == host]
+
+    def get_status(self, job_id):
+        started, pages = self.jobs[job_id]
+        crawled = min(len(pages), int((time.monotonic() - started) * self.pages_per_second))
+        if crawled == len(pages):
+            return {'status': 'completed', 'current': crawled, 'total': len(pages),
+                    'data': pages, 'partial_data': []}
+        return {'status': 'active', 'current': crawled, 'total': len(pages), 'data': None,
+                'partial_data': pages[max(0, crawled - self.partial_data_pages):crawled]}
+
+    def dispatch(self, method, path, headers, body):
+        if self.api_key and headers.get('Authorization') != f"Bearer {self.api_key}":
+            return 401, {}, {'error': 'Unauthorized'}
+        if method == 'POST' and path == '/v0/crawl':
+            try:
+                request = json.loads(body)
+            except ValueError:
+                return 400, {}, {'error': 'Invalid JSON'}
+            if not isinstance(request, dict) or not request.get('url'):
+                return 400, {}, {'error': 'url is required'}
+            job_id = str(uuid.uuid4())
+            with self.lock:
+                self.jobs[job_id] = (time.monotonic(), self.get_pages(request['url']))
+            return 200, {}, {'jobId': job_id}
+        if method == 'GET' and path.startswith('/v0/crawl/status/'):
+            job_id = path[len('/v0/crawl/status/'):]
+            if job_id not in self.jobs:
+                return 404, {}, {'error': 'Job not found'}
+            return 200, {}, self.get_status(job_id)
+        return super().dispatch(method, path, headers, body)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a local stand-in for the Firecrawl crawl API")
+    parser.add_argument('crawl_results_file', nargs='?', default=DEFAULT_CRAWL_FILE,
+                        help="crawl results file whose pages every crawl returns")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8091)
+    parser.add_argument('--api-key', default=None, help="require this bearer token")
+    parser.add_argument('--pages-per-second', type=float, default=10.0, help="how fast pages are crawled")
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument('--rate-429', type=float, default=0.0, help="fraction of requests answered with 429")
+    parser.add_argument('--rate-5xx', type=float, default=0.0, help="fraction of requests answered with a 5xx")
+    args = parser.parse_args(argv)
+
+    with open(args.crawl_results_file, 'r') as f:
+        pages = json.load(f)
+    firecrawl = FakeFirecrawl(pages, args.host, args.port, api_key=args.api_key,
+                              pages_per_second=args.pages_per_second, latency=args.latency,
+                              rate_429=args.rate_429, rate_5xx=args.rate_5xx)
+    print(f"Fake Firecrawl serving {len(pages)} pages on {firecrawl.url} "
+          f"(set FIRECRAWL_API_URL={firecrawl.url})")
+    try:
+        firecrawl.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(json.dumps(firecrawl.stats, indent=2))
+
+
+if __name__ == "__main__":
+    main()
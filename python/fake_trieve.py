@@ -0,0 +1,370 @@
+"""Local stand-in for the Trieve chunk API, for load testing and tests"""
+
+import argparse
+import gzip
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+MAX_CHUNKS_PER_REQUEST = 120
+MAX_SUGGESTIONS = 10
+
+TAG_PATTERN = re.compile(r'<[^>]+>')
+WORD_PATTERN = re.compile(r'\w+')
+
+
+def get_words(text):
+    return WORD_PATTERN.findall(TAG_PATTERN.sub(' ', text).lower())
+
+
+class LocalServer:
+    """
+    Threaded local HTTP server that answers every request with dispatch(),
+    after an optional injected latency, 429 (with Retry-After) or 5xx.
+    Gzip-compressed request bodies are decompressed, or answered with
+    gzip_rejected_status (415, or 400 like some proxies) without accept_gzip.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, latency_jitter=0.0,
+                 rate_429=0.0, rate_5xx=0.0, retry_after=0, seed=None, accept_gzip=True,
+                 gzip_rejected_status=415):
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.rate_429 = rate_429
+        self.rate_5xx = rate_5xx
+        self.retry_after = retry_after
+        self.accept_gzip = accept_gzip
+        self.gzip_rejected_status = gzip_rejected_status
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = {'requests': 0, 'gzip_requests': 0, 'status': {}}
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def inject(self):
+        """
+        Sleep for the configured latency, then return an injected error
+        (status, headers) or None.
+        """
+        delay = self.latency + (self.random.uniform(0, self.latency_jitter) if self.latency_jitter else 0)
+        if delay:
+            time.sleep(delay)
+        roll = self.random.random()
+        if roll < self.rate_429:
+            return 429, {'Retry-After': str(self.retry_after)}
+        if roll < self.rate_429 + self.rate_5xx:
+            return self.random.choice([500, 502, 503]), {}
+        return None
+
+    def decode(self, headers, body):
+        """
+        Return (error, body) for a request body, decompressing it if it is
+        gzip-compressed; error is a (status, headers, response body) to answer
+        with, or None.
+        """
+        encoding = headers.get('Content-Encoding', 'identity').lower()
+        if encoding == 'identity':
+            return None, body
+        if encoding != 'gzip' or not self.accept_gzip:
+            return (self.gzip_rejected_status, {}, {'message': f'Unsupported Content-Encoding: {encoding}'}), body
+        with self.lock:
+            self.stats['gzip_requests'] += 1
+        try:
+            return None, gzip.decompress(body)
+        except (OSError, EOFError):
+            return (400, {}, {'message': 'Invalid gzip body'}), body
+
+    def _handler(self):
+        local_server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def _respond(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length)
+                with local_server.lock:
+                    local_server.stats['requests'] += 1
+                injected = local_server.inject()
+                if injected:
+                    status, extra_headers = injected
+                    payload = {'message': 'Injected failure'}
+                else:
+                    error, body = local_server.decode(self.headers, body)
+                    status, extra_headers, payload = error or local_server.dispatch(
+                        self.command, self.path, self.headers, body)
+                with local_server.lock:
+                    local_server.stats['status'][status] = local_server.stats['status'].get(status, 0) + 1
+                data = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                for name, value in extra_headers.items():
+                    self.send_header(name, value)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = do_POST = do_PUT = do_DELETE = _respond
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def dispatch(self, method, path, headers, body):
+        """
+        Return (status, extra headers, response body) for a request.
+        """
+        return 404, {}, {'message': f'No route for {method} {path}'}
+
+
+class FakeTrieve(LocalServer):
+    """
+    In-memory Trieve datasets behind POST /api/chunk.
+
+    Chunks are stored per TR-Dataset by tracking_id: with
+    upsert_by_tracking_id an existing chunk is replaced, otherwise the create
+    is counted as a duplicate and the stored chunk is kept. Latency, 429/5xx
+    responses and a maximum body size can be injected.
+
+    DELETE /api/chunk deletes the chunks matched by a tracking_id or
+    group_tracking_ids match_any filter, as load.py sends them.
+
+    POST /api/chunk/search ranks the dataset's chunks by how often they
+    contain the query words, plus fulltext_boost.boost_factor for each query
+    word in the boost phrase, and answers in the V2 shape. POST
+    /api/chunk/suggestions suggests the headings of the best matching chunks.
+
+    >>> import requests
+    >>> with FakeTrieve(api_key='key', datasets={'dataset'}) as trieve:
+    ...     headers = {'TR-Dataset': 'dataset', 'Authorization': 'Bearer key'}
+    ...     ok = requests.post(f'{trieve.url}/api/chunk', headers=headers,
+    ...                        json=[{'chunk_html': '<p>a</p>', 'tracking_id': 'a'}])
+    ...     wrong_dataset = requests.post(f'{trieve.url}/api/chunk', headers=dict(headers, **{'TR-Dataset': 'other'}),
+    ...                                   json=[{'chunk_html': '<p>a</p>', 'tracking_id': 'a'}])
+    ...     search = requests.post(f'{trieve.url}/api/chunk/search', headers=headers,
+    ...                            json={'query': 'a', 'page_size': 10}).json()
+    >>> ok.status_code, wrong_dataset.status_code, sorted(trieve.chunks['dataset'])
+    (200, 400, ['a'])
+    >>> [(result['chunk']['tracking_id'], result['score']) for result in search['chunks']]
+    [('a', 1)]
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, api_key=None, datasets=None,
+                 max_body_bytes=None, max_chunks=MAX_CHUNKS_PER_REQUEST, **options):
+        super().__init__(host, port, **options)
+        self.api_key = api_key
+        self.datasets = set(datasets) if datasets else None
+        self.max_body_bytes = max_body_bytes
+        self.max_chunks = max_chunks
+        # dataset -> tracking_id -> chunk
+        self.chunks = {}
+        # id(chunk) -> (chunk, its words), so searches tokenize each chunk once
+        self.words = {}
+        self.stats.update({'created': 0, 'upserted': 0, 'duplicates': 0, 'deleted': 0})
+
+    def check_dataset(self, headers):
+        """
+        Return (error, dataset) for a request; error is a (status, response
+        body) to answer with, or None.
+        """
+        if self.api_key and headers.get('Authorization') != f"Bearer {self.api_key}":
+            return (401, {'message': 'Unauthorized'}), None
+        dataset = headers.get('TR-Dataset')
+        if not dataset or (self.datasets is not None and dataset not in self.datasets):
+            return (400, {'message': f'Unknown TR-Dataset: {dataset}'}), None
+        return None, dataset
+
+    def handle_chunks(self, headers, body):
+        """
+        Return (status, response body) for a POST /api/chunk request.
+        """
+        error, dataset = self.check_dataset(headers)
+        if error:
+            return error
+        if self.max_body_bytes is not None and len(body) > self.max_body_bytes:
+            return 413, {'message': 'Payload too large'}
+        try:
+            chunks = json.loads(body)
+        except ValueError:
+            return 400, {'message': 'Invalid JSON'}
+        if isinstance(chunks, dict):
+            chunks = [chunks]
+        if not isinstance(chunks, list) or not chunks:
+            return 400, {'message': 'Expected a chunk or a list of chunks'}
+        if len(chunks) > self.max_chunks:
+            return 413, {'message': f'At most {self.max_chunks} chunks per request'}
+        if not all(isinstance(chunk, dict) and isinstance(chunk.get('chunk_html'), str) for chunk in chunks):
+            return 400, {'message': 'Every chunk needs a chunk_html string'}
+
+        with self.lock:
+            stored = self.chunks.setdefault(dataset, {})
+            for chunk in chunks:
+                tracking_id = chunk.get('tracking_id') or f"untracked-{len(stored)}"
+                if tracking_id in stored:
+                    if chunk.get('upsert_by_tracking_id'):
+                        stored[tracking_id] = chunk
+                        self.stats['upserted'] += 1
+                    else:
+                        self.stats['duplicates'] += 1
+                else:
+                    stored[tracking_id] = chunk
+                    self.stats['created'] += 1
+        return 200, {'chunk_metadata': [{'tracking_id': chunk.get('tracking_id')} for chunk in chunks]}
+
+    def handle_delete(self, headers, body):
+        """
+        Return (status, response body) for a DELETE /api/chunk request.
+        """
+        error, dataset = self.check_dataset(headers)
+        if error:
+            return error
+        try:
+            conditions = json.loads(body)['filter']['must']
+            tracking_ids = [tracking_id for condition in conditions if condition['field'] == 'tracking_id'
+                            for tracking_id in condition['match_any']]
+            groups = {group for condition in conditions if condition['field'] == 'group_tracking_ids'
+                      for group in condition['match_any']}
+        except (ValueError, KeyError, TypeError):
+            return 400, {'message': 'Expected a filter on tracking_id or group_tracking_ids'}
+        with self.lock:
+            stored = self.chunks.get(dataset, {})
+            tracking_ids += [tracking_id for tracking_id, chunk in stored.items()
+                             if groups.intersection(chunk.get('group_tracking_ids') or [])]
+            for tracking_id in tracking_ids:
+                if stored.pop(tracking_id, None) is not None:
+                    self.stats['deleted'] += 1
+        return 200, {}
+
+    def check_request(self, headers, body):
+        """
+        Return (error, dataset, parsed body) for a query request; error is a
+        (status, response body) to answer with, or None.
+        """
+        error, dataset = self.check_dataset(headers)
+        if error:
+            return error, None, None
+        try:
+            request = json.loads(body)
+        except ValueError:
+            return (400, {'message': 'Invalid JSON'}), None, None
+        if not isinstance(request, dict) or not isinstance(request.get('query'), str):
+            return (400, {'message': 'query is required'}), None, None
+        return None, dataset, request
+
+    def rank(self, dataset, query):
+        """
+        (score, chunk) of the dataset's chunks that match the query, best first.
+        """
+        query_words = set(get_words(query))
+        with self.lock:
+            chunks = list(self.chunks.get(dataset, {}).values())
+        scored = []
+        for chunk in chunks:
+            indexed = self.words.get(id(chunk))
+            if indexed is None or indexed[0] is not chunk:
+                indexed = self.words[id(chunk)] = chunk, get_words(chunk['chunk_html'])
+            score = sum(1 for word in indexed[1] if word in query_words)
+            boost = chunk.get('fulltext_boost')
+            if score and boost:
+                score += boost.get('boost_factor', 0) * len(query_words.intersection(get_words(boost['phrase'])))
+            if score:
+                scored.append((score, chunk))
+        scored.sort(key=lambda item: (-item[0], item[1].get('tracking_id') or ''))
+        return scored
+
+    def handle_search(self, headers, body):
+        error, dataset, request = self.check_request(headers, body)
+        if error:
+            return error
+        page_size = request.get('page_size') or 10
+        scored = self.rank(dataset, request['query'])
+        return 200, {
+            'id': f"search-{self.stats['requests']}",
+            'chunks': [{'chunk': chunk, 'score': score} for score, chunk in scored[:page_size]],
+            'total_pages': -(-len(scored) // page_size),
+        }
+
+    def handle_suggestions(self, headers, body):
+        error, dataset, request = self.check_request(headers, body)
+        if error:
+            return error
+        queries = []
+        for _, chunk in self.rank(dataset, request['query']):
+            heading = ' '.join(get_words(chunk['chunk_html'].partition('\n')[0]))
+            if heading and heading not in queries:
+                queries.append(heading)
+            if len(queries) == MAX_SUGGESTIONS:
+                break
+        return 200, {'queries': queries}
+
+    def dispatch(self, method, path, headers, body):
+        if method == 'POST' and path == '/api/chunk':
+            status, payload = self.handle_chunks(headers, body)
+            return status, {}, payload
+        if method == 'DELETE' and path == '/api/chunk':
+            status, payload = self.handle_delete(headers, body)
+            return status, {}, payload
+        if method == 'POST' and path == '/api/chunk/search':
+            status, payload = self.handle_search(headers, body)
+            return status, {}, payload
+        if method == 'POST' and path == '/api/chunk/suggestions':
+            status, payload = self.handle_suggestions(headers, body)
+            return status, {}, payload
+        return super().dispatch(method, path, headers, body)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a local stand-in for the Trieve chunk API")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8090)
+    parser.add_argument('--api-key', default=None, help="require this bearer token")
+    parser.add_argument('--dataset', action='append', default=None,
+                        help="accepted TR-Dataset value (repeatable; default: any)")
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument('--latency-jitter', type=float, default=0.0, help="up to this many extra seconds")
+    parser.add_argument('--rate-429', type=float, default=0.0, help="fraction of requests answered with 429")
+    parser.add_argument('--rate-5xx', type=float, default=0.0, help="fraction of requests answered with a 5xx")
+    parser.add_argument('--retry-after', type=int, default=1, help="Retry-After seconds sent with 429s")
+    parser.add_argument('--max-body-bytes', type=int, default=None, help="answer 413 above this body size")
+    parser.add_argument('--no-gzip', action='store_true', help="answer gzip-compressed requests with 415")
+    args = parser.parse_args(argv)
+
+    trieve = FakeTrieve(args.host, args.port, api_key=args.api_key, datasets=args.dataset,
+                        latency=args.latency, latency_jitter=args.latency_jitter,
+                        rate_429=args.rate_429, rate_5xx=args.rate_5xx, retry_after=args.retry_after,
+                        max_body_bytes=args.max_body_bytes, accept_gzip=not args.no_gzip)
+    print(f"Fake Trieve listening on {trieve.url} (set TRIEVE_BASE_URL={trieve.url})")
+    try:
+        trieve.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(json.dumps(trieve.stats, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""Append-only journal of chunk batches acknowledged by Trieve"""
+
+import hashlib
+import json
+import threading
+
+DEFAULT_JOURNAL = 'load_journal.jsonl'
+
+
+# Set by load.py on each chunk it sends, so not part of the chunk's content
+IGNORED_FIELDS = ('upsert_by_tracking_id',)
+
+
+def get_batch_digest(chunks):
+    """
+    Digest of the chunks in a batch, to check that a journaled offset range
+    still holds the same chunks, and not only the same tracking_ids.
+
+    >>> get_batch_digest([{'tracking_id': 'a', 'chunk_html': 'a'}]) == get_batch_digest(
+    ...     [{'tracking_id': 'a', 'chunk_html': 'b'}])
+    False
+    """
+    digest = hashlib.sha256()
+    for chunk in chunks:
+        content = {key: value for key, value in chunk.items() if key not in IGNORED_FIELDS}
+        digest.update(json.dumps(content, sort_keys=True).encode('utf-8') + b"\n")
+    return digest.hexdigest()[:16]
+
+
+def get_range(chunks, start, end):
+    # A chunk store decompresses only the blocks of the range
+    if hasattr(chunks, 'iter_range'):
+        return chunks.iter_range(start, end)
+    return chunks[start:end]
+
+
+class Journal:
+    """
+    Record each acknowledged batch as one JSON line: chunk file, dataset,
+    offset range in the chunk file and a digest of its chunks.
+
+    Records are appended and flushed to the OS, without an fsync, so each one
+    costs a single small write.
+
+    >>> import os, tempfile
+    >>> path = os.path.join(tempfile.mkdtemp(), 'journal.jsonl')
+    >>> chunks = [{'tracking_id': f'id-{i}'} for i in range(5)]
+    >>> with Journal(path) as journal:
+    ...     journal.record('chunks.json', 'dataset', 0, chunks[0:2])
+    ...     journal.record('chunks.json', 'dataset', 3, chunks[3:5])
+    >>> sorted(completed_offsets(path, 'chunks.json', 'dataset', chunks))
+    [0, 1, 3, 4]
+    >>> completed_offsets(path, 'chunks.json', 'other-dataset', chunks)
+    set()
+    >>> chunks[4] = {'tracking_id': 'id-4', 'chunk_html': 'changed'}
+    >>> sorted(completed_offsets(path, 'chunks.json', 'dataset', chunks))
+    [0, 1]
+    """
+
+    def __init__(self, path=DEFAULT_JOURNAL):
+        self.file = open(path, 'a')
+        self.lock = threading.Lock()
+
+    def record(self, chunk_file, dataset, start, chunks):
+        line = json.dumps({
+            'file': chunk_file,
+            'dataset': dataset,
+            'start': start,
+            'end': start + len(chunks),
+            'digest': get_batch_digest(chunks),
+        })
+        with self.lock:
+            self.file.write(line + "\n")
+            self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def completed_offsets(path, chunk_file, dataset, chunks):
+    """
+    Offsets of the chunks already acknowledged for this chunk file and
+    dataset, given the chunks in the file (a list or a chunk store).
+
+    Ranges whose digest no longer matches the chunks at those offsets (the
+    chunk file was regenerated with other content) are ignored, as is a
+    truncated last line.
+    """
+    done = set()
+    try:
+        f = open(path, 'r')
+    except FileNotFoundError:
+        return done
+    with f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if entry['file'] != chunk_file or entry['dataset'] != dataset:
+                continue
+            start, end = entry['start'], entry['end']
+            if end <= len(chunks) and get_batch_digest(get_range(chunks, start, end)) == entry['digest']:
+                done.update(range(start, end))
+    return done
+
+
+def pending_ranges(total, done):
+    """
+    Contiguous [start, end) ranges of offsets below total that are not done.
+
+    >>> pending_ranges(6, {0, 1, 4})
+    [(2, 4), (5, 6)]
+    """
+    ranges = []
+    start = None
+    for offset in range(total):
+        if offset in done:
+            if start is not None:
+                ranges.append((start, offset))
+                start = None
+        elif start is None:
+            start = offset
+    if start is not None:
+        ranges.append((start, total))
+    return ranges
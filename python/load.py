@@ -1,90 +1,829 @@
 """Load chunks to Trieve"""
 
-import sys
-import json
+import argparse
+import email.utils
+import gzip
 import os
-import requests
-from typing import List, Dict, Any
-from tqdm import tqdm
+import random
+import re
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+from contextlib import ExitStack
+import serializer
+from chunk_store import ChunkStore, is_store
+from metrics import METRICS
+from journal import DEFAULT_JOURNAL, Journal, completed_offsets, pending_ranges
+from manifest import DEFAULT_MANIFEST, Manifest
+from typing import TYPE_CHECKING, List, Dict, Any, Iterable, Iterator, Optional, Sequence
 import logging
 import dotenv
 
-dotenv.load_dotenv()
+# requests and tqdm are imported where they are used, so importing this
+# module stays cheap
+if TYPE_CHECKING:
+    import requests
+    from tqdm import tqdm
 
 BATCH_SIZE = 120
+MAX_RETRIES = 5
+BASE_BACKOFF = 0.5
+MAX_BACKOFF = 30.0
+REQUEST_TIMEOUT = 60
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+MAX_BATCH_BYTES = 4 * 1024 * 1024
+MIN_BATCH_BYTES = 16 * 1024
+TARGET_LATENCY = 10.0
+DELETE_BATCH_SIZE = 100
+# Request bodies at least GZIP_MIN_BYTES long are sent gzip-compressed,
+# unless the server has rejected a compressed body: a 415, or a 400 from a
+# server or proxy that does not decompress, after which the plain body is
+# accepted
+GZIP = True
+GZIP_LEVEL = 5
+GZIP_MIN_BYTES = 1024
+GZIP_REJECTED_STATUS_CODES = {400, 415}
+DEFAULT_BASE_URL = "https://api.trieve.ai"
 DATASET_NAME = "TRIEVE_DATASET_ID_BASELINE"
-CHUNK_FILENAME = max([f for f in os.listdir() if f.startswith('chunks') and f.endswith('.json') and not f.endswith('boost.json')], key=os.path.getctime)
-
+# A variant's dataset id is in TRIEVE_DATASET_ID_<VARIANT>
+DATASET_PREFIX = "TRIEVE_DATASET_ID_"
+BOOST = False
 # DATASET_NAME = "TRIEVE_DATASET_ID_BOOST"
-# CHUNK_FILENAME = max([f for f in os.listdir() if f.startswith('chunks') and f.endswith('boost.json')], key=os.path.getctime)
+# BOOST = True
+LOG_FILE = 'load.log'
+# transform.py writes the chunks of a crawl delta (the new and changed pages
+# only) to chunks_delta_<ts>.json, and the groups of removed pages to
+# removed_groups_<ts>.json
+DELTA_CHUNKS_PREFIX = 'chunks_delta_'
+REMOVED_GROUPS_FILE = 'removed_groups_{}.json'
+
+
+def find_chunk_file(boost: bool = BOOST) -> str:
+    """
+    The latest chunks file (JSON, JSONL or chunk store) in the working
+    directory, or '' if there is none. Delta chunk files are only loaded
+    when they are named.
+    """
+    suffixes = ('boost.json', 'boost.jsonl', 'boost.jsonl.gz')
+    # Variant files (chunks_<ts>.<variant>.json) are left to find_variant_chunk_file
+    return max([f for f in os.listdir() if re.match(r'chunks[^.]*\.(json|jsonl|jsonl\.gz)$', f)
+                and f.endswith(suffixes) == boost and not is_delta_file(f)], key=os.path.getctime, default='')
+
+
+def find_variant_chunk_file(variant: str) -> str:
+    """
+    The latest chunks file transform.py wrote for a variant. baseline and
+    boost fall back to the files of a transform run without variants.
+    """
+    pattern = re.compile(rf'chunks[^.]*\.{re.escape(variant)}\.(json|jsonl|jsonl\.gz)$')
+    chunk_filename = max([f for f in os.listdir() if pattern.match(f) and not is_delta_file(f)],
+                         key=os.path.getctime, default='')
+    if not chunk_filename and variant in ('baseline', 'boost'):
+        chunk_filename = find_chunk_file(boost=variant == 'boost')
+    return chunk_filename
+
+
+def is_delta_file(chunk_filename: str) -> bool:
+    return os.path.basename(chunk_filename).startswith(DELTA_CHUNKS_PREFIX)
+
+
+def find_removed_groups_file(chunk_filename: str) -> str:
+    """
+    The removed_groups_<ts>.json transform.py wrote with a delta chunk file,
+    or '' if there is none.
+
+    >>> import tempfile
+    >>> directory = tempfile.mkdtemp()
+    >>> open(os.path.join(directory, 'removed_groups_2024-08-20_16-35-59.json'), 'w').close()
+    >>> os.path.basename(find_removed_groups_file(os.path.join(directory, 'chunks_delta_2024-08-20_16-35-59_boost.json')))
+    'removed_groups_2024-08-20_16-35-59.json'
+    """
+    match = re.match(rf'{DELTA_CHUNKS_PREFIX}(.+?)(_boost)?\.', os.path.basename(chunk_filename))
+    if not match:
+        return ''
+    removed_file = os.path.join(os.path.dirname(chunk_filename), REMOVED_GROUPS_FILE.format(match.group(1)))
+    return removed_file if os.path.exists(removed_file) else ''
+
 
-# Set up file handler for logging
-log_file = 'load.log'
-file_handler = logging.FileHandler(log_file)
-file_handler.setLevel(logging.INFO)
-file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+def get_dataset_variable(variant: str) -> str:
+    """
+    >>> get_dataset_variable('boost'), get_dataset_variable('max_words-300')
+    ('TRIEVE_DATASET_ID_BOOST', 'TRIEVE_DATASET_ID_MAX_WORDS_300')
+    """
+    return DATASET_PREFIX + re.sub(r'\W', '_', variant).upper()
 
-# Configure the root logger
-logger = logging.getLogger()
-logger.setLevel(logging.INFO)
-logger.addHandler(file_handler)
 
-logging.info(f"Logging to file: {log_file}")
+def setup_logging(log_file: str = LOG_FILE) -> None:
+    # Set up file handler for logging
+    file_handler = logging.FileHandler(log_file)
+    file_handler.setLevel(logging.INFO)
+    file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
 
+    # Configure the root logger
+    logger = logging.getLogger()
+    logger.setLevel(logging.INFO)
+    logger.addHandler(file_handler)
 
+    logging.info(f"Logging to file: {log_file}")
 
-def read_chunks() -> List[Dict[str, Any]]:
-    with open(CHUNK_FILENAME, 'r') as f:
-        return json.load(f)
+
+def read_chunks(chunk_filename: str) -> Sequence[Dict[str, Any]]:
+    """
+    The chunks of a chunks JSON file, a JSONL file as transform.py --stream
+    writes, or a chunk store.
+
+    >>> import tempfile
+    >>> path = os.path.join(tempfile.mkdtemp(), 'chunks_1.jsonl')
+    >>> with open(path, 'w') as f:
+    ...     _ = f.write('{"tracking_id": "a"}\\n{"tracking_id": "b"}\\n')
+    >>> [chunk['tracking_id'] for chunk in read_chunks(path)]
+    ['a', 'b']
+    """
+    # A chunk store is read batch by batch, through its index
+    if is_store(chunk_filename):
+        return ChunkStore(chunk_filename)
+    with open(chunk_filename, 'rb') as f:
+        if chunk_filename.endswith('.jsonl'):
+            return [serializer.loads(line) for line in f if line.strip()]
+        return serializer.loads(f.read())
+
+
+def get_tracking_ids(chunks: Sequence[Dict[str, Any]]) -> List[str]:
+    if isinstance(chunks, ChunkStore):
+        return chunks.tracking_ids
+    return [chunk.get('tracking_id') for chunk in chunks]
+
+
+def iter_chunk_range(chunks: Sequence[Dict[str, Any]], start: int, end: int) -> Iterable[Dict[str, Any]]:
+    if isinstance(chunks, ChunkStore):
+        return chunks.iter_range(start, end)
+    return chunks[start:end]
 
 def get_configuration() -> Dict[str, str]:
     return {
         "api_key": os.getenv('TRIEVE_API_KEY'),
-        "base_path": "https://api.trieve.ai",
+        "base_path": os.getenv('TRIEVE_BASE_URL') or DEFAULT_BASE_URL,
         "dataset_id": os.getenv(DATASET_NAME)
     }
 
 
-def load_chunks(chunks: List[Dict[str, Any]], config: Dict[str, str], upsert: bool = False) -> None:
-    url = f"{config['base_path']}/api/chunk"
+class TokenBucket:
+    """
+    Thread-safe token bucket allowing `rate` requests per second on average,
+    with bursts of up to `capacity` requests.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self) -> None:
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class TokenBuckets:
+    """
+    Take a token from each of several token buckets, such as the limit of
+    one run and a limit shared by several runs, in the order given. Buckets
+    that are None are left out.
+
+    Put the run's own bucket first: waiting on it then holds no shared
+    token that other runs could use.
+    """
+
+    def __init__(self, *buckets: Optional[TokenBucket]):
+        self.buckets = [bucket for bucket in buckets if bucket]
+
+    def acquire(self) -> None:
+        for bucket in self.buckets:
+            bucket.acquire()
+
+
+def get_session(pool_size: int = 10) -> 'requests.Session':
+    """
+    Session whose connection pool can hold one connection per in-flight batch.
+    """
+    import requests
+
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def get_retry_after(response: 'requests.Response') -> Optional[float]:
+    """
+    Seconds to wait according to a Retry-After header (in seconds or as an
+    HTTP date), at most MAX_BACKOFF.
+
+    >>> from types import SimpleNamespace
+    >>> [get_retry_after(SimpleNamespace(headers=headers)) for headers in
+    ...  ({'Retry-After': '2'}, {'Retry-After': '3600'}, {'Retry-After': 'soon'}, {})]
+    [2.0, 30.0, None, None]
+    """
+    retry_after = response.headers.get('Retry-After')
+    if not retry_after:
+        return None
+    try:
+        delay = float(retry_after)
+    except ValueError:
+        try:
+            retry_at = email.utils.parsedate_to_datetime(retry_after)
+        except (TypeError, ValueError):
+            return None
+        delay = retry_at.timestamp() - time.time()
+    return min(MAX_BACKOFF, max(0.0, delay))
+
+
+def get_backoff(attempt: int) -> float:
+    """
+    Exponential backoff with full jitter.
+    """
+    return random.uniform(0, min(MAX_BACKOFF, BASE_BACKOFF * 2 ** attempt))
+
+
+# base_paths that rejected a gzip-compressed body and accepted it plain
+_gzip_rejected = set()
+
+
+def compress_body(body: bytes, base_path: str, compress: Optional[bool] = None) -> tuple:
+    """
+    The body to send and its extra headers: gzip-compressed if it is large
+    enough and the server at base_path has not rejected compressed bodies.
+
+    >>> data, headers = compress_body(b'a' * 2000, 'http://localhost')
+    >>> headers, len(data) < 2000, gzip.decompress(data) == b'a' * 2000
+    ({'Content-Encoding': 'gzip'}, True, True)
+    >>> compress_body(b'[]', 'http://localhost')
+    (b'[]', {})
+    """
+    if compress is None:
+        compress = GZIP
+    if not compress or len(body) < GZIP_MIN_BYTES or base_path in _gzip_rejected:
+        return body, {}
+    with METRICS.timer('compress'):
+        return gzip.compress(body, GZIP_LEVEL), {'Content-Encoding': 'gzip'}
+
+
+def send_request(method: str, path: str, payload: Any, config: Dict[str, str],
+                 session: Optional['requests.Session'] = None, rate_limiter: Optional[TokenBucket] = None,
+                 max_retries: int = MAX_RETRIES, stage: str = 'http_batch',
+                 action: str = 'send request', compress: Optional[bool] = None) -> 'requests.Response':
+    """
+    Send a JSON request to the dataset of config. Connection errors, 429s
+    and 5xx are retried with jittered backoff, honouring Retry-After.
+
+    >>> from fake_trieve import FakeTrieve
+    >>> with FakeTrieve(rate_429=0.5, retry_after=0, seed=7) as trieve:
+    ...     config = {'api_key': 'key', 'base_path': trieve.url, 'dataset_id': 'dataset'}
+    ...     response = send_request('POST', '/api/chunk', [{'chunk_html': 'a', 'tracking_id': 'a'}], config)
+    >>> response.status_code, trieve.stats['status'], sorted(trieve.chunks['dataset'])
+    (200, {429: 2, 200: 1}, ['a'])
+
+    The payload is encoded (and compressed) once, and the same body is sent
+    on every attempt. A compressed body answered with a 415 or a 400 is sent
+    again plain. If that is accepted, the server is sent no compressed
+    bodies from then on.
+
+    >>> chunks = [{'chunk_html': 'a' * 2048, 'tracking_id': str(i)} for i in range(2)]
+    >>> with FakeTrieve(accept_gzip=False, gzip_rejected_status=400) as trieve:
+    ...     config = {'api_key': 'key', 'base_path': trieve.url, 'dataset_id': 'dataset'}
+    ...     statuses = [send_request('POST', '/api/chunk', [chunk], config).status_code for chunk in chunks]
+    >>> statuses, trieve.stats['status'], trieve.url in _gzip_rejected
+    ([200, 200], {400: 1, 200: 2}, True)
+    """
+    import requests
+
+    url = f"{config['base_path']}{path}"
     headers = {
         "TR-Dataset": config['dataset_id'],
         "Authorization": f"Bearer {config['api_key']}",
         "Content-Type": "application/json"
     }
-    try:
+    session = session or requests
+    with METRICS.timer('serialize'):
+        body = serializer.dumps(payload)
+    METRICS.inc('bytes_uncompressed', len(body))
+    data, encoding = compress_body(body, config['base_path'], compress)
+
+    for attempt in range(max_retries + 1):
+        if rate_limiter:
+            rate_limiter.acquire()
+        response = None
+        try:
+            with METRICS.timer(stage):
+                response = session.request(method, url, data=data, headers=dict(headers, **encoding),
+                                           timeout=REQUEST_TIMEOUT)
+            METRICS.inc('bytes_sent', len(data))
+            if encoding and response.status_code in GZIP_REJECTED_STATUS_CODES:
+                data, encoding = body, {}
+                with METRICS.timer(stage):
+                    response = session.request(method, url, data=data, headers=headers, timeout=REQUEST_TIMEOUT)
+                METRICS.inc('bytes_sent', len(data))
+                if response.ok:
+                    logging.info(f"{config['base_path']} does not accept gzip-compressed requests, "
+                                 "sending them as is")
+                    _gzip_rejected.add(config['base_path'])
+            response.raise_for_status()
+            return response
+        except requests.RequestException as e:
+            retryable = response is None or response.status_code in RETRY_STATUS_CODES
+            if response is not None:
+                logging.error(f"Failed to {action}. Status code: {response.status_code}")
+                logging.error(f"Response: {response.text}")
+            logging.error(f"Error: {e}")
+            if not retryable or attempt == max_retries:
+                raise e
+            delay = get_retry_after(response) if response is not None else None
+            if delay is None:
+                delay = get_backoff(attempt)
+            logging.info(f"Retrying {action} in {delay:.2f}s (attempt {attempt + 1} of {max_retries})")
+            METRICS.inc('retries')
+            time.sleep(delay)
+
+
+def set_upsert(chunks: Iterable[Dict[str, Any]], upsert: bool) -> Iterator[Dict[str, Any]]:
+    """
+    Set upsert_by_tracking_id on each chunk before it is packed, so the
+    batcher measures the chunk as it is sent.
+
+    >>> batcher = AdaptiveBatcher(max_bytes=200, min_bytes=200)
+    >>> batches = list(batcher.batches(set_upsert([{'tracking_id': str(i)} for i in range(20)], True)))
+    >>> max(len(serializer.dumps(batch)) for batch in batches) <= 200, sum(map(len, batches))
+    (True, 20)
+    """
+    for chunk in chunks:
+        chunk['upsert_by_tracking_id'] = upsert
+        yield chunk
+
+
+def load_chunks(chunks: List[Dict[str, Any]], config: Dict[str, str], upsert: bool = False,
+                session: Optional['requests.Session'] = None, rate_limiter: Optional[TokenBucket] = None,
+                max_retries: int = MAX_RETRIES) -> None:
+    for chunk in chunks:
+        chunk['upsert_by_tracking_id'] = upsert
+
+    send_request('POST', '/api/chunk', chunks, config, session, rate_limiter, max_retries,
+                 action=f"{'upsert' if upsert else 'create'} batch")
+    METRICS.inc('batches')
+    METRICS.inc('chunks_sent', len(chunks))
+    logging.info(f"Successfully {'upserted' if upsert else 'created'} batch of {len(chunks)} chunks to {config['dataset_id']}")
+
+
+def delete_chunks(tracking_ids: List[str], config: Dict[str, str],
+                  session: Optional['requests.Session'] = None, rate_limiter: Optional[TokenBucket] = None,
+                  max_retries: int = MAX_RETRIES, field: str = 'tracking_id') -> None:
+    """
+    Delete the chunks with these tracking_ids in one bulk delete request, or
+    the chunks in any of these groups with field='group_tracking_ids'.
+    """
+    payload = {"filter": {"must": [{"field": field, "match_any": tracking_ids}]}}
+    send_request('DELETE', '/api/chunk', payload, config, session, rate_limiter, max_retries,
+                 stage='http_delete', action='delete batch')
+    if field == 'tracking_id':
+        METRICS.inc('chunks_deleted', len(tracking_ids))
+    else:
+        METRICS.inc('groups_deleted', len(tracking_ids))
+    logging.info(f"Successfully deleted batch of {len(tracking_ids)} {field} from {config['dataset_id']}")
+
+
+class AdaptiveBatcher:
+    """
+    Pack chunks into batches bounded by serialized size and chunk count.
+
+    Both limits start at their configured maximum. Both shrink when a batch
+    takes longer than target_latency and grow back towards the maximum while
+    batches come back quickly. A batch rejected as too large (413) halves the
+    byte limit only, which then never grows past the size of a batch the
+    server has already rejected.
+
+    >>> batcher = AdaptiveBatcher(max_bytes=60, max_chunks=3, min_bytes=10)
+    >>> [len(batch) for batch in batcher.batches([{'id': i} for i in range(7)])]
+    [3, 3, 1]
+    >>> batcher.too_large(60)
+    >>> batcher.byte_limit, batcher.chunk_limit
+    (30, 3)
+    """
+
+    GROW = 1.1
+    SHRINK = 0.75
+
+    def __init__(self, max_bytes: int = MAX_BATCH_BYTES, max_chunks: int = BATCH_SIZE,
+                 target_latency: float = TARGET_LATENCY, min_bytes: int = MIN_BATCH_BYTES):
+        self.max_bytes = max_bytes
+        self.max_chunks = max_chunks
+        self.min_bytes = min(min_bytes, max_bytes)
+        self.target_latency = target_latency
+        self.bytes = float(max_bytes)
+        self.chunks = float(max_chunks)
+        # Smallest batch size the server has rejected, minus one
+        self.ceiling = max_bytes
+        self.lock = threading.Lock()
+
+    @property
+    def byte_limit(self) -> int:
+        return int(self.bytes)
+
+    @property
+    def chunk_limit(self) -> int:
+        return max(1, int(self.chunks))
+
+    def batches(self, chunks: Iterable[Dict[str, Any]]) -> Iterator[List[Dict[str, Any]]]:
+        """
+        Yield batches, reading the current limits as each batch is packed.
+        """
+        batch: List[Dict[str, Any]] = []
+        size = 2
         for chunk in chunks:
-            chunk['upsert_by_tracking_id'] = upsert
+            # json.dumps of the batch separates chunks with ", " (orjson with ",")
+            chunk_size = len(serializer.dumps(chunk)) + 2
+            if batch and (size + chunk_size > self.byte_limit or len(batch) >= self.chunk_limit):
+                yield batch
+                batch, size = [], 2
+            batch.append(chunk)
+            size += chunk_size
+        if batch:
+            yield batch
+
+    def record(self, latency: float) -> None:
+        with self.lock:
+            factor = self.SHRINK if latency > self.target_latency else self.GROW
+            self.bytes = max(self.min_bytes, min(self.ceiling, self.bytes * factor))
+            self.chunks = max(1.0, min(self.max_chunks, self.chunks * factor))
+
+    def too_large(self, batch_bytes: int) -> None:
+        with self.lock:
+            self.ceiling = max(self.min_bytes, min(self.ceiling, batch_bytes - 1))
+            self.bytes = max(self.min_bytes, min(self.bytes, batch_bytes) / 2)
+
+
+def load_all(chunks: Sequence[Dict[str, Any]], config: Dict[str, str], upsert: bool = False,
+             batcher: Optional[AdaptiveBatcher] = None, concurrency: int = 1,
+             rate: Optional[float] = None, journal: Optional[Journal] = None,
+             chunk_file: str = '', skip: Iterable[int] = (),
+             session: Optional['requests.Session'] = None, manifest: Optional[Manifest] = None) -> None:
+    """
+    Send chunks in batches with up to `concurrency` batches in flight over a
+    shared connection pool, optionally limited to `rate` requests per second.
+
+    Each acknowledged batch is recorded in the journal and the manifest, and
+    chunks at the offsets in `skip` (already acknowledged in an earlier run,
+    or unchanged since the last sync) are not sent.
+    """
+    session = session or get_session(concurrency)
+    rate_limiter = TokenBucket(rate) if rate else None
+    batcher = batcher or AdaptiveBatcher()
+    skip = set(skip)
+    loader = BatchLoader(config, upsert, session, rate_limiter, batcher, journal, chunk_file, manifest)
+
+    def iter_batches():
+        for start, end in pending_ranges(len(chunks), skip):
+            # Batches are contiguous runs of chunks, so their offsets follow on
+            for batch in batcher.batches(set_upsert(iter_chunk_range(chunks, start, end), upsert)):
+                yield start, batch
+                start += len(batch)
+
+    from tqdm import tqdm
+
+    with tqdm(total=len(chunks), initial=len(skip), desc="Processing chunks") as progress:
+        send_batches(loader, iter_batches(), concurrency, progress)
+
+
+def load_stream(chunks: Iterable[Dict[str, Any]], config: Dict[str, str], upsert: bool = False,
+                batcher: Optional[AdaptiveBatcher] = None, concurrency: int = 1,
+                rate: Optional[float] = None, journal: Optional[Journal] = None,
+                chunk_file: str = '', session: Optional['requests.Session'] = None,
+                rate_limiter: Optional[TokenBucket] = None, executor: Optional[ThreadPoolExecutor] = None,
+                desc: str = "Processing chunks") -> int:
+    """
+    load_all for chunks that are still being produced: batches are packed
+    and sent as chunks arrive. Returns the number of chunks loaded.
+
+    Loads running at once can share an executor, which then bounds the
+    batches in flight across all of them, and a rate_limiter.
+    """
+    session = session or get_session(concurrency)
+    rate_limiter = rate_limiter or (TokenBucket(rate) if rate else None)
+    batcher = batcher or AdaptiveBatcher()
+    loader = BatchLoader(config, upsert, session, rate_limiter, batcher, journal, chunk_file)
+
+    def iter_batches():
+        start = 0
+        for batch in batcher.batches(set_upsert(chunks, upsert)):
+            yield start, batch
+            start += len(batch)
+
+    from tqdm import tqdm
 
-        response = requests.post(url, json=chunks, headers=headers)
-        response.raise_for_status()
-        logging.info(f"Successfully {'upserted' if upsert else 'created'} batch of {len(chunks)} chunks to {DATASET_NAME}")
-    except requests.RequestException as e:
-        logging.error(f"Failed to {'upsert' if upsert else 'create'} batch. Status code: {response.status_code}")
-        logging.error(f"Response: {response.text}")
-        logging.error(f"Error: {e}")
-        raise e
+    with tqdm(desc=desc) as progress:
+        send_batches(loader, iter_batches(), concurrency, progress, executor)
+        return progress.n
 
 
-def main():
-    chunks = read_chunks()
+def send_batches(loader: 'BatchLoader', batches: Iterable, concurrency: int, progress: 'tqdm',
+                 executor: Optional[ThreadPoolExecutor] = None) -> None:
+    """
+    Send (offset, batch) pairs with up to `concurrency` batches in flight,
+    on a pool of their own or on a shared executor.
+    """
+    with ExitStack() as stack:
+        if executor is None:
+            executor = stack.enter_context(ThreadPoolExecutor(max_workers=concurrency))
+        pending = set()
+        for start, batch in batches:
+            if len(pending) >= concurrency:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    progress.update(future.result())
+            pending.add(executor.submit(loader.load, start, batch))
+        for future in as_completed(pending):
+            progress.update(future.result())
+
+
+class BatchLoader:
+    """
+    Send one batch, adapting the batcher to its outcome and journaling it.
+    """
+
+    def __init__(self, config, upsert, session, rate_limiter, batcher, journal, chunk_file, manifest=None):
+        self.config = config
+        self.upsert = upsert
+        self.session = session
+        self.rate_limiter = rate_limiter
+        self.batcher = batcher
+        self.journal = journal
+        self.chunk_file = chunk_file
+        self.manifest = manifest
+
+    def load(self, start: int, batch: List[Dict[str, Any]]) -> int:
+        import requests
+
+        started = time.monotonic()
+        try:
+            load_chunks(batch, self.config, upsert=self.upsert, session=self.session,
+                        rate_limiter=self.rate_limiter)
+        except requests.HTTPError as e:
+            if e.response is None or e.response.status_code != 413 or len(batch) == 1:
+                raise
+            # Too large for the server: shrink the limits and resend this batch
+            # re-packed under them (or in halves if that does not split it)
+            self.batcher.too_large(len(serializer.dumps(batch)))
+            parts = list(self.batcher.batches(batch))
+            if len(parts) == 1:
+                middle = len(batch) // 2
+                parts = [batch[:middle], batch[middle:]]
+            loaded = 0
+            for part in parts:
+                loaded += self.load(start + loaded, part)
+            return loaded
+        self.batcher.record(time.monotonic() - started)
+        if self.journal:
+            self.journal.record(self.chunk_file, self.config['dataset_id'], start, batch)
+        if self.manifest:
+            self.manifest.record(self.config['dataset_id'], batch)
+            # Saved as the load goes, not only at exit, so a killed load still
+            # leaves the chunks it pushed on record for the next sync
+            self.manifest.save_if_due()
+        return len(batch)
+
+
+def delete_stale(tracking_ids: List[str], config: Dict[str, str], manifest: Manifest,
+                 rate: Optional[float] = None, session: Optional['requests.Session'] = None,
+                 batch_size: int = DELETE_BATCH_SIZE) -> None:
+    """
+    Delete chunks from the dataset of config in batches of batch_size
+    tracking_ids, removing each batch from the manifest once it is deleted.
+    """
+    session = session or get_session()
+    rate_limiter = TokenBucket(rate) if rate else None
+    for start in range(0, len(tracking_ids), batch_size):
+        batch = tracking_ids[start:start + batch_size]
+        delete_chunks(batch, config, session=session, rate_limiter=rate_limiter)
+        manifest.remove(config['dataset_id'], batch)
+        manifest.save_if_due()
+
+
+def delete_groups(group_tracking_ids: List[str], config: Dict[str, str], manifest: Optional[Manifest] = None,
+                  rate: Optional[float] = None, session: Optional['requests.Session'] = None,
+                  batch_size: int = DELETE_BATCH_SIZE) -> None:
+    """
+    Delete the chunks of these groups (the pages a crawl delta removed) from
+    the dataset of config, and from the manifest.
+
+    >>> import tempfile
+    >>> from fake_trieve import FakeTrieve
+    >>> chunks = [{'chunk_html': name, 'tracking_id': name, 'group_tracking_ids': [name.split('-')[0]]}
+    ...           for name in ('a-intro', 'a-usage', 'b-intro')]
+    >>> manifest = Manifest(os.path.join(tempfile.mkdtemp(), 'manifest.json'))
+    >>> manifest.record('dataset', chunks)
+    >>> with FakeTrieve() as trieve:
+    ...     config = {'api_key': 'key', 'base_path': trieve.url, 'dataset_id': 'dataset'}
+    ...     _ = send_request('POST', '/api/chunk', chunks, config)
+    ...     delete_groups(['a'], config, manifest)
+    >>> sorted(trieve.chunks['dataset']), manifest.stale_ids('dataset', [])
+    (['b-intro'], ['b-intro'])
+    """
+    session = session or get_session()
+    rate_limiter = TokenBucket(rate) if rate else None
+    for start in range(0, len(group_tracking_ids), batch_size):
+        batch = group_tracking_ids[start:start + batch_size]
+        delete_chunks(batch, config, session=session, rate_limiter=rate_limiter, field='group_tracking_ids')
+        if manifest:
+            manifest.remove(config['dataset_id'], manifest.group_members(config['dataset_id'], batch))
+            manifest.save_if_due()
+
+
+def get_superseded_ids(chunks: Sequence[Dict[str, Any]], dataset: str, manifest: Manifest) -> List[str]:
+    """
+    tracking_ids the manifest has in the groups of these chunks that are not
+    among them.
+    """
+    groups = set()
+    tracking_ids = set()
+    for chunk in iter_chunk_range(chunks, 0, len(chunks)):
+        groups.update(chunk.get('group_tracking_ids') or [])
+        tracking_ids.add(chunk.get('tracking_id'))
+    return [tracking_id for tracking_id in manifest.group_members(dataset, groups) if tracking_id not in tracking_ids]
+
+
+def load_file(chunk_filename: str, config: Dict[str, str], upsert: bool, batcher: AdaptiveBatcher,
+              concurrency: int, rate: Optional[float], journal: Journal,
+              resume_journal: Optional[str] = None, manifest: Optional[Manifest] = None,
+              sync: bool = False) -> None:
+    """
+    Load a chunks file into the dataset of config. With resume_journal, the
+    batches that journal records as loaded are skipped.
+
+    A sync upserts only the chunks that are new or changed since the
+    manifest's record of the dataset, then deletes the chunks whose
+    tracking_ids are no longer in the file.
+
+    A delta chunk file holds every chunk of each page in it, so once it is
+    loaded, the manifest's other chunks in those pages' groups (sections a
+    changed page no longer has) are deleted.
+
+    >>> import tempfile
+    >>> from fake_trieve import FakeTrieve
+    >>> directory = tempfile.mkdtemp()
+    >>> page = lambda *sections: [{'chunk_html': section, 'tracking_id': f'docs-a-{section}',
+    ...                            'group_tracking_ids': ['docs-a']} for section in sections]
+    >>> for name, chunks in (('chunks_1.json', page('intro', 'usage', 'faq')), ('chunks_delta_2.json', page('intro', 'usage'))):
+    ...     with open(os.path.join(directory, name), 'w') as f:
+    ...         _ = f.write(serializer.dumps(chunks).decode())
+    >>> manifest = Manifest(os.path.join(directory, 'manifest.json'))
+    >>> with FakeTrieve() as trieve, Journal(os.path.join(directory, 'journal.jsonl')) as journal:  # doctest: +ELLIPSIS
+    ...     config = {'api_key': 'key', 'base_path': trieve.url, 'dataset_id': 'dataset'}
+    ...     for name in ('chunks_1.json', 'chunks_delta_2.json'):
+    ...         load_file(os.path.join(directory, name), config, True, AdaptiveBatcher(), 1, None, journal,
+    ...                   manifest=manifest)
+    Deleting 1 chunks of changed pages that are no longer in .../chunks_delta_2.json
+    >>> sorted(trieve.chunks['dataset']), manifest.stale_ids('dataset', [])
+    (['docs-a-intro', 'docs-a-usage'], ['docs-a-intro', 'docs-a-usage'])
+    """
+    chunks = read_chunks(chunk_filename)
+    try:
+        skip = set()
+        if resume_journal:
+            skip = completed_offsets(resume_journal, chunk_filename, config['dataset_id'], chunks)
+            logging.info(f"Resuming: {len(skip)} of {len(chunks)} chunks already loaded")
+        stale = []
+        if sync:
+            unchanged = manifest.unchanged_offsets(config['dataset_id'], chunks)
+            stale = manifest.stale_ids(config['dataset_id'], get_tracking_ids(chunks))
+            print(f"Sync: {len(chunks) - len(unchanged)} new or changed chunks, {len(unchanged)} unchanged, "
+                  f"{len(stale)} to delete")
+            METRICS.inc('chunks_unchanged', len(unchanged))
+            skip |= unchanged
+        load_all(chunks, config, upsert=upsert or sync, batcher=batcher, concurrency=concurrency, rate=rate,
+                 journal=journal, chunk_file=chunk_filename, skip=skip, manifest=manifest)
+        if manifest and is_delta_file(chunk_filename):
+            stale = get_superseded_ids(chunks, config['dataset_id'], manifest)
+            if stale:
+                print(f"Deleting {len(stale)} chunks of changed pages that are no longer in {chunk_filename}")
+        if stale:
+            delete_stale(stale, config, manifest, rate=rate)
+    finally:
+        if isinstance(chunks, ChunkStore):
+            chunks.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load chunks to Trieve")
+    parser.add_argument('chunks_file', nargs='?', default=None,
+                        help="chunks JSON or JSONL file or chunk store (default: the latest chunks file here)")
+    operation = parser.add_mutually_exclusive_group(required=True)
+    operation.add_argument('-c', action='store_true', help="create chunks")
+    operation.add_argument('-u', action='store_true', help="upsert chunks")
+    operation.add_argument('-s', action='store_true',
+                           help="sync: upsert only new or changed chunks and delete chunks no longer in the file")
+    parser.add_argument('--removed', default=None, metavar='FILE',
+                        help="also delete the chunks of these groups, as transform.py writes them for removed "
+                             "pages (default: the removed_groups_<ts>.json of a chunks_delta_<ts> file)")
+    parser.add_argument('--variant', action='append', default=None, metavar='NAME',
+                        help="load the latest chunks of this transform.py variant into the dataset in "
+                             f"{DATASET_PREFIX}<NAME> (repeatable)")
+    parser.add_argument('--dataset', action='append', default=[], metavar='NAME=ID',
+                        help=f"dataset id for a variant, instead of {DATASET_PREFIX}<NAME> (repeatable)")
+    parser.add_argument('--concurrency', type=int, default=4,
+                        help="number of batches in flight at once (default: 4)")
+    parser.add_argument('--rate', type=float, default=None,
+                        help="maximum requests per second (default: unlimited)")
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                        help=f"maximum chunks per batch (default: {BATCH_SIZE})")
+    parser.add_argument('--batch-bytes', type=int, default=MAX_BATCH_BYTES,
+                        help=f"maximum serialized bytes per batch (default: {MAX_BATCH_BYTES})")
+    parser.add_argument('--target-latency', type=float, default=TARGET_LATENCY,
+                        help=f"shrink batches that take longer than this many seconds (default: {TARGET_LATENCY})")
+    parser.add_argument('--no-gzip', action='store_true',
+                        help="send request bodies uncompressed")
+    parser.add_argument('--serializer', choices=[serializer.AUTO_BACKEND, *serializer.BACKENDS],
+                        default=serializer.AUTO_BACKEND,
+                        help="JSON library to read and send chunks with (default: orjson if installed, else json)")
+    parser.add_argument('--journal', default=DEFAULT_JOURNAL,
+                        help=f"journal of acknowledged batches (default: {DEFAULT_JOURNAL})")
+    parser.add_argument('--resume', action='store_true',
+                        help="skip batches the journal records as already loaded")
+    parser.add_argument('--manifest', default=DEFAULT_MANIFEST,
+                        help=f"record of what each dataset holds, kept by -u and -s (default: {DEFAULT_MANIFEST})")
+    parser.add_argument('--report', default=None,
+                        help="write a JSON run report of stage timings and counters to this file")
+    parser.add_argument('--prometheus', default=None,
+                        help="write the same metrics in Prometheus text format to this file")
+    args = parser.parse_args(argv)
+
+    if args.variant and args.chunks_file:
+        parser.error("give either a chunks file or --variant")
+    dataset_ids = dict(dataset.partition('=')[::2] for dataset in args.dataset)
+    global GZIP
+    GZIP = not args.no_gzip
+    serializer.set_backend(args.serializer)
+
+    dotenv.load_dotenv()
+    setup_logging()
     config = get_configuration()
-    
-    if len(sys.argv) != 2 or sys.argv[1] not in ['-c', '-u']:
-        print("Usage: python load.py [-c|-u]")
-        print("-c: create chunks")
-        print("-u: upsert chunks")
-        sys.exit(1)
-    
-    operation = sys.argv[1]
-    
-    
-    for i in tqdm(range(0, len(chunks), BATCH_SIZE), desc="Processing chunks"):
-        batch = chunks[i:i + BATCH_SIZE]
-        if operation == '-c':
-            load_chunks(batch, config)
-        elif operation == '-u':
-            load_chunks(batch, config, upsert=True)
+    # (chunks file, configuration) of each dataset to load
+    loads = []
+    if args.variant:
+        for variant in args.variant:
+            chunk_filename = find_variant_chunk_file(variant)
+            dataset_id = dataset_ids.get(variant) or os.getenv(get_dataset_variable(variant))
+            if not chunk_filename or not dataset_id:
+                print(f"No chunks file found for variant {variant}" if not chunk_filename else
+                      f"No dataset for variant {variant}: set {get_dataset_variable(variant)} "
+                      f"or --dataset {variant}=<id>")
+                sys.exit(1)
+            loads.append((chunk_filename, dict(config, dataset_id=dataset_id)))
+    else:
+        chunk_filename = args.chunks_file or find_chunk_file()
+        if not chunk_filename:
+            print("No chunks file found")
+            sys.exit(1)
+        loads.append((chunk_filename, config))
+    if args.s and any(is_delta_file(chunk_filename) for chunk_filename, _ in loads):
+        parser.error("a delta chunks file holds only the new and changed pages: a sync would delete the chunks "
+                     "of every other page. Load it with -u")
+    removed_file = args.removed or find_removed_groups_file(loads[0][0])
+    removed_groups = []
+    if removed_file:
+        with open(removed_file, 'rb') as f:
+            removed_groups = serializer.loads(f.read())
+
+    batcher = AdaptiveBatcher(max_bytes=args.batch_bytes, max_chunks=args.batch_size,
+                              target_latency=args.target_latency)
+    # Created chunks are not recorded: a create does not replace a chunk the dataset already has
+    manifest = Manifest(args.manifest) if args.u or args.s else None
+    try:
+        with Journal(args.journal) as journal:
+            for chunk_filename, config in loads:
+                if args.variant:
+                    print(f"Loading {chunk_filename} into dataset {config['dataset_id']}")
+                load_file(chunk_filename, config, args.u, batcher, args.concurrency, args.rate,
+                          journal, args.journal if args.resume else None, manifest, sync=args.s)
+                if removed_groups:
+                    print(f"Deleting the chunks of {len(removed_groups)} removed pages from {removed_file}")
+                    delete_groups(removed_groups, config, manifest, rate=args.rate)
+    finally:
+        if manifest:
+            manifest.save()
+        METRICS.export(args.report, args.prometheus, command='load',
+                       chunk_file=', '.join(chunk_filename for chunk_filename, _ in loads),
+                       dataset=', '.join(args.variant) if args.variant else DATASET_NAME,
+                       concurrency=args.concurrency)
+
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,154 @@
+"""Load-test load.py against a local stand-in for the Trieve chunk API"""
+
+import argparse
+import json
+import math
+import time
+
+import load
+import serializer
+from chunk_store import ChunkStore, is_store
+from fake_trieve import FakeTrieve
+from metrics import METRICS
+
+DATASET_ID = 'load-test-dataset'
+API_KEY = 'load-test-key'
+
+
+def percentile(values, fraction):
+    """
+    Nearest-rank percentile.
+
+    >>> percentile([0.1, 0.2, 0.3, 0.4], 0.5)
+    0.2
+    >>> percentile([], 0.99)
+    0.0
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+def make_chunks(count, chunk_bytes):
+    words = ("observability traces metrics logs dashboards alerts " * (chunk_bytes // 50 + 1)).split()
+    body = " ".join(words)[:chunk_bytes]
+    return [{
+        'chunk_html': f"<p>Chunk {i}: {body}</p>",
+        'link': f"https://example.com/docs/load-test/{i}",
+        'tags_set': ['load-test'],
+        'image_urls': [],
+        'tracking_id': f"load-test-{i}",
+        'group_tracking_ids': ['load-test'],
+        'metadata': {'title': f"Chunk {i}"},
+    } for i in range(count)]
+
+
+def read_chunk_file(path):
+    if is_store(path):
+        with ChunkStore(path) as store:
+            return list(store)
+    with open(path, 'r') as f:
+        if path.endswith('.jsonl'):
+            return [json.loads(line) for line in f]
+        return json.load(f)
+
+
+def run(chunks, trieve_options, upsert=False, concurrency=4, rate=None,
+        batch_size=load.BATCH_SIZE, batch_bytes=load.MAX_BATCH_BYTES):
+    """
+    Load chunks into a fresh FakeTrieve and return the measurements.
+    """
+    latencies = []
+    METRICS.reset()
+    with FakeTrieve(api_key=API_KEY, datasets={DATASET_ID}, **trieve_options) as trieve:
+        config = {'api_key': API_KEY, 'base_path': trieve.url, 'dataset_id': DATASET_ID}
+        session = load.get_session(concurrency)
+        # Response.elapsed covers sending the request until the response headers arrive
+        session.hooks['response'].append(lambda response, *args, **kwargs: latencies.append(
+            response.elapsed.total_seconds()))
+        batcher = load.AdaptiveBatcher(max_bytes=batch_bytes, max_chunks=batch_size)
+
+        start = time.perf_counter()
+        # CPU time of the whole process, so it includes the fake server's
+        cpu_start = time.process_time()
+        load.load_all(chunks, config, upsert=upsert, batcher=batcher, concurrency=concurrency,
+                      rate=rate, session=session)
+        cpu_seconds = time.process_time() - cpu_start
+        seconds = time.perf_counter() - start
+
+        stored = len(trieve.chunks.get(DATASET_ID, {}))
+        server_stats = dict(trieve.stats)
+
+    snapshot = METRICS.snapshot()
+    counters = snapshot['counters']
+    return {
+        'chunks': len(chunks),
+        'stored': stored,
+        'seconds': round(seconds, 3),
+        'chunks_per_second': round(len(chunks) / seconds, 1) if seconds else None,
+        'requests': len(latencies),
+        'batches': counters.get('batches', 0),
+        'retries': counters.get('retries', 0),
+        'cpu_seconds': round(cpu_seconds, 3),
+        'serialize_seconds': round(snapshot['stages'].get('serialize', {}).get('seconds', 0.0), 3),
+        'compress_seconds': round(snapshot['stages'].get('compress', {}).get('seconds', 0.0), 3),
+        'serializer': serializer.get_backend(),
+        'bytes_sent': counters.get('bytes_sent', 0),
+        'bytes_uncompressed': counters.get('bytes_uncompressed', 0),
+        'bytes_saved': counters.get('bytes_uncompressed', 0) - counters.get('bytes_sent', 0),
+        'latency_p50': round(percentile(latencies, 0.50), 4),
+        'latency_p95': round(percentile(latencies, 0.95), 4),
+        'latency_p99': round(percentile(latencies, 0.99), 4),
+        'server': server_stats,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load-test load.py against a local fake Trieve")
+    parser.add_argument('--chunks', default=None, help="chunks JSON/JSONL file (default: synthetic chunks)")
+    parser.add_argument('--count', type=int, default=10000, help="number of synthetic chunks")
+    parser.add_argument('--chunk-bytes', type=int, default=2000, help="size of each synthetic chunk")
+    parser.add_argument('-u', dest='upsert', action='store_true', help="upsert instead of create")
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--rate', type=float, default=None)
+    parser.add_argument('--batch-size', type=int, default=load.BATCH_SIZE)
+    parser.add_argument('--batch-bytes', type=int, default=load.MAX_BATCH_BYTES)
+    parser.add_argument('--latency', type=float, default=0.05, help="server latency per request, in seconds")
+    parser.add_argument('--latency-jitter', type=float, default=0.05)
+    parser.add_argument('--rate-429', type=float, default=0.0)
+    parser.add_argument('--rate-5xx', type=float, default=0.0)
+    parser.add_argument('--retry-after', type=int, default=0)
+    parser.add_argument('--max-body-bytes', type=int, default=None)
+    parser.add_argument('--no-gzip', action='store_true', help="send request bodies uncompressed")
+    parser.add_argument('--server-no-gzip', action='store_true',
+                        help="have the server answer gzip-compressed requests with 415")
+    parser.add_argument('--serializer', choices=[serializer.AUTO_BACKEND, *serializer.BACKENDS],
+                        default=serializer.AUTO_BACKEND)
+    parser.add_argument('--output', default=None, help="also write the results as JSON to this file")
+    args = parser.parse_args(argv)
+
+    load.setup_logging()
+    load.GZIP = not args.no_gzip
+    serializer.set_backend(args.serializer)
+
+    chunks = read_chunk_file(args.chunks) if args.chunks else make_chunks(args.count, args.chunk_bytes)
+    results = run(chunks, {
+        'latency': args.latency,
+        'latency_jitter': args.latency_jitter,
+        'rate_429': args.rate_429,
+        'rate_5xx': args.rate_5xx,
+        'retry_after': args.retry_after,
+        'max_body_bytes': args.max_body_bytes,
+        'accept_gzip': not args.server_no_gzip,
+    }, upsert=args.upsert, concurrency=args.concurrency, rate=args.rate,
+        batch_size=args.batch_size, batch_bytes=args.batch_bytes)
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
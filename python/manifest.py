@@ -0,0 +1,127 @@
+"""Local record of the chunks last pushed to each dataset, for delta syncs"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+
+DEFAULT_MANIFEST = 'sync_manifest.json'
+# Seconds between saves of the manifest while a load records batches, so a
+# killed load loses at most this much of its record
+SAVE_INTERVAL = 10.0
+# Fields that change without the chunk changing: the crawl timestamp, and
+# the flag load.py sets on each request
+IGNORED_FIELDS = ('timestamp', 'upsert_by_tracking_id')
+
+
+def get_chunk_hash(chunk):
+    """
+    Digest of a chunk's content, leaving out IGNORED_FIELDS.
+
+    >>> get_chunk_hash({'chunk_html': 'a', 'timestamp': '1'}) == get_chunk_hash({'chunk_html': 'a', 'timestamp': '2'})
+    True
+    >>> get_chunk_hash({'chunk_html': 'a'}) == get_chunk_hash({'chunk_html': 'b'})
+    False
+    """
+    content = {key: value for key, value in chunk.items() if key not in IGNORED_FIELDS}
+    return hashlib.blake2b(json.dumps(content, sort_keys=True).encode('utf-8'), digest_size=16).hexdigest()
+
+
+def get_entry(chunk):
+    return [get_chunk_hash(chunk), chunk.get('group_tracking_ids', [])]
+
+
+class Manifest:
+    """
+    tracking_id -> [content hash, group_tracking_ids] of the chunks each
+    dataset has acknowledged.
+
+    A sync compares a chunk file with the manifest of its dataset: only new
+    or changed chunks are sent, and tracking_ids that are no longer in the
+    file are deleted. Entries are recorded as batches are acknowledged, and
+    save() replaces the file atomically, so an interrupted sync leaves a
+    manifest that is still true. Entries written before groups were
+    recorded are plain hashes; those chunks count as changed once.
+
+    >>> import tempfile
+    >>> path = os.path.join(tempfile.mkdtemp(), 'manifest.json')
+    >>> manifest = Manifest(path)
+    >>> manifest.record('dataset', [{'tracking_id': 'a', 'chunk_html': 'a'}, {'tracking_id': 'b', 'chunk_html': 'b'}])
+    >>> manifest.save()
+    >>> chunks = [{'tracking_id': 'a', 'chunk_html': 'a'}, {'tracking_id': 'c', 'chunk_html': 'c'}]
+    >>> sorted(Manifest(path).unchanged_offsets('dataset', chunks)), Manifest(path).stale_ids('dataset', ['a', 'c'])
+    ([0], ['b'])
+    >>> manifest.record('dataset', [{'tracking_id': 'd-intro', 'chunk_html': 'd', 'group_tracking_ids': ['d']}])
+    >>> manifest.group_members('dataset', ['d'])
+    ['d-intro']
+    """
+
+    def __init__(self, path=DEFAULT_MANIFEST):
+        self.path = path
+        self.lock = threading.Lock()
+        try:
+            with open(path, 'r') as f:
+                self.datasets = json.load(f)
+        except FileNotFoundError:
+            self.datasets = {}
+        self.saved_at = time.monotonic()
+
+    def unchanged_offsets(self, dataset, chunks):
+        """
+        Offsets of the chunks the dataset already holds as they are.
+        """
+        pushed = self.datasets.get(dataset, {})
+        return {offset for offset, chunk in enumerate(chunks)
+                if pushed.get(chunk.get('tracking_id')) == get_entry(chunk)}
+
+    def stale_ids(self, dataset, tracking_ids):
+        """
+        tracking_ids pushed to the dataset that are not among tracking_ids.
+        """
+        current = set(tracking_ids)
+        return sorted(tracking_id for tracking_id in self.datasets.get(dataset, {}) if tracking_id not in current)
+
+    def group_members(self, dataset, group_tracking_ids):
+        """
+        tracking_ids pushed to the dataset in any of these groups.
+        """
+        groups = set(group_tracking_ids)
+        return sorted(tracking_id for tracking_id, entry in self.datasets.get(dataset, {}).items()
+                      if isinstance(entry, list) and groups.intersection(entry[1]))
+
+    def record(self, dataset, chunks):
+        entries = {chunk.get('tracking_id'): get_entry(chunk) for chunk in chunks}
+        with self.lock:
+            self.datasets.setdefault(dataset, {}).update(entries)
+
+    def remove(self, dataset, tracking_ids):
+        with self.lock:
+            pushed = self.datasets.get(dataset, {})
+            for tracking_id in tracking_ids:
+                pushed.pop(tracking_id, None)
+
+    def save(self):
+        with self.lock:
+            with open(self.path + '.tmp', 'w') as f:
+                json.dump(self.datasets, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(self.path + '.tmp', self.path)
+            self.saved_at = time.monotonic()
+
+    def save_if_due(self, interval=SAVE_INTERVAL):
+        """
+        Save if the last save was at least interval seconds ago.
+
+        >>> import tempfile
+        >>> path = os.path.join(tempfile.mkdtemp(), 'manifest.json')
+        >>> manifest = Manifest(path)
+        >>> manifest.record('dataset', [{'tracking_id': 'a', 'chunk_html': 'a'}])
+        >>> manifest.save_if_due(); os.path.exists(path)
+        False
+        >>> manifest.save_if_due(0); Manifest(path).stale_ids('dataset', [])
+        ['a']
+        """
+        if time.monotonic() - self.saved_at >= interval:
+            self.save()
@@ -0,0 +1,116 @@
+"""Run metrics: time spent per stage and event counters, exported as JSON or Prometheus text"""
+
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+PROMETHEUS_PREFIX = 'firecrawl_to_trieve'
+
+
+class Metrics:
+    """
+    Thread-safe stage timers and counters for one process.
+
+    Worker processes send their snapshot() back to be merge()d into the
+    parent's metrics.
+
+    >>> metrics = Metrics()
+    >>> with metrics.timer('render'):
+    ...     pass
+    >>> metrics.inc('pages_skipped_status', 2)
+    >>> snapshot = metrics.snapshot()
+    >>> snapshot['stages']['render']['calls'], snapshot['counters']
+    (1, {'pages_skipped_status': 2})
+    >>> print(Metrics.to_prometheus({'stages': {}, 'counters': {'bytes_sent': 10}}))
+    # TYPE firecrawl_to_trieve_stage_seconds_total counter
+    # TYPE firecrawl_to_trieve_stage_calls_total counter
+    # TYPE firecrawl_to_trieve_bytes_sent_total counter
+    firecrawl_to_trieve_bytes_sent_total 10
+    <BLANKLINE>
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.seconds = {}
+            self.calls = {}
+            self.counters = {}
+
+    def add_time(self, stage, seconds, calls=1):
+        with self.lock:
+            self.seconds[stage] = self.seconds.get(stage, 0.0) + seconds
+            self.calls[stage] = self.calls.get(stage, 0) + calls
+
+    @contextmanager
+    def timer(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(stage, time.perf_counter() - start)
+
+    def timed_iter(self, iterable, stage):
+        """
+        Yield from iterable, timing how long each item takes to produce.
+        """
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add_time(stage, time.perf_counter() - start, calls=0)
+                return
+            self.add_time(stage, time.perf_counter() - start)
+            yield item
+
+    def inc(self, counter, value=1):
+        with self.lock:
+            self.counters[counter] = self.counters.get(counter, 0) + value
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'stages': {stage: {'seconds': round(self.seconds[stage], 6), 'calls': self.calls[stage]}
+                           for stage in self.seconds},
+                'counters': dict(self.counters),
+            }
+
+    def merge(self, snapshot):
+        for stage, timing in snapshot['stages'].items():
+            self.add_time(stage, timing['seconds'], calls=timing['calls'])
+        for counter, value in snapshot['counters'].items():
+            self.inc(counter, value)
+
+    @staticmethod
+    def to_prometheus(snapshot, prefix=PROMETHEUS_PREFIX):
+        lines = [f"# TYPE {prefix}_stage_seconds_total counter"]
+        for stage, timing in sorted(snapshot['stages'].items()):
+            lines.append(f'{prefix}_stage_seconds_total{{stage="{stage}"}} {timing["seconds"]}')
+        lines.append(f"# TYPE {prefix}_stage_calls_total counter")
+        for stage, timing in sorted(snapshot['stages'].items()):
+            lines.append(f'{prefix}_stage_calls_total{{stage="{stage}"}} {timing["calls"]}')
+        for counter, value in sorted(snapshot['counters'].items()):
+            lines.append(f"# TYPE {prefix}_{counter}_total counter")
+            lines.append(f"{prefix}_{counter}_total {value}")
+        return "\n".join(lines) + "\n"
+
+    def export(self, report_path=None, prometheus_path=None, **run_info):
+        """
+        Write the JSON run report and/or the Prometheus text file.
+        """
+        snapshot = self.snapshot()
+        if report_path:
+            with open(report_path, 'w') as f:
+                json.dump(dict(run_info, **snapshot), f, indent=2)
+        if prometheus_path:
+            with open(prometheus_path, 'w') as f:
+                f.write(self.to_prometheus(snapshot))
+
+
+# Metrics of the current process
+METRICS = Metrics()
@@ -0,0 +1,104 @@
+"""Persistent cache of the chunks produced for each crawled page"""
+
+import json
+import sqlite3
+import time
+
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+COMMIT_EVERY = 500
+
+
+class PageCache:
+    """
+    On-disk cache mapping a page URL to the chunks it produced.
+
+    Each entry stores a digest of the page content; a lookup only hits when
+    the digest still matches. The cache as a whole is tagged with a version
+    (a digest of the configs and cleaning code) and is cleared when that
+    version changes. Once the stored chunks grow past max_bytes, the least
+    recently used entries are evicted.
+
+    >>> cache = PageCache(':memory:', version='v1')
+    >>> cache.put('https://example.com/a', 'digest-1', [{'chunk_html': 'a'}])
+    >>> cache.get('https://example.com/a', 'digest-1')
+    [{'chunk_html': 'a'}]
+    >>> cache.get('https://example.com/a', 'digest-2') is None
+    True
+    >>> cache.close()
+    """
+
+    def __init__(self, path, version, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+        # Opened in one thread and used from another, as pipeline.py's
+        # transform stage does, but never from two at once
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS pages ("
+            "url TEXT PRIMARY KEY, digest TEXT, chunks TEXT, size INTEGER, last_used REAL)")
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS pages_last_used ON pages (last_used)")
+
+        row = self.connection.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        if row is None or row[0] != version:
+            # Configs or cleaning code changed: every cached chunk is stale
+            self.connection.execute("DELETE FROM pages")
+            self.connection.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('version', ?)", (version,))
+        self.connection.commit()
+
+    def get(self, url, digest):
+        row = self.connection.execute(
+            "SELECT chunks FROM pages WHERE url = ? AND digest = ?", (url, digest)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.connection.execute("UPDATE pages SET last_used = ? WHERE url = ?", (time.time(), url))
+        self._maybe_commit()
+        return json.loads(row[0])
+
+    def put(self, url, digest, chunks):
+        data = json.dumps(chunks)
+        self.connection.execute(
+            "INSERT OR REPLACE INTO pages (url, digest, chunks, size, last_used) VALUES (?, ?, ?, ?, ?)",
+            (url, digest, data, len(data), time.time()))
+        self._maybe_commit()
+
+    def evict(self):
+        """
+        Remove least recently used entries until the cache is within max_bytes.
+        """
+        total = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM pages").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = self.connection.execute("SELECT url, size FROM pages ORDER BY last_used")
+        evicted = []
+        for url, size in rows:
+            if total <= self.max_bytes:
+                break
+            evicted.append((url,))
+            total -= size
+        self.connection.executemany("DELETE FROM pages WHERE url = ?", evicted)
+        self.connection.commit()
+
+    def close(self):
+        self.evict()
+        self.connection.commit()
+        self.connection.close()
+
+    def _maybe_commit(self):
+        self._writes += 1
+        if self._writes % COMMIT_EVERY == 0:
+            self.connection.commit()
+            self.evict()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,132 @@
+"""Local record of every page of the last crawl, for incremental re-crawls"""
+
+import hashlib
+import json
+import sqlite3
+import time
+
+DEFAULT_PAGE_STORE = 'page_store.sqlite'
+
+
+def get_page_url(page):
+    # transform.py links a page's chunks to its ogUrl, so removed URLs map
+    # to the group_tracking_ids of their chunks
+    metadata = page.get('metadata', {})
+    return metadata.get('ogUrl') or metadata.get('sourceURL')
+
+
+def get_page_status(page):
+    return page.get('metadata', {}).get('pageStatusCode', 200)
+
+
+def get_content_digest(page):
+    """
+    Digest of a page's markdown and metadata.
+
+    >>> page = {'markdown': 'a', 'metadata': {'sourceURL': 'https://example.com/a', 'title': 'A'}}
+    >>> get_content_digest(page) == get_content_digest(dict(page, markdown='b'))
+    False
+    """
+    content = {'markdown': page.get('markdown', ''), 'metadata': page.get('metadata', {})}
+    return hashlib.sha256(json.dumps(content, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class PageStore:
+    """
+    On-disk record of the pages of a site by URL: the page as last crawled,
+    a digest of its content, and when it was first and last seen.
+
+    merge() compares a new crawl with the store and returns the delta:
+    pages that are new or changed, and URLs whose chunks should go, because
+    the page is no longer crawled or no longer answers 200. The store is
+    updated in one transaction, so an interrupted merge leaves it as it was.
+    pages() is then the complete crawl snapshot.
+
+    >>> store = PageStore(':memory:')
+    >>> page = lambda name, text: {'markdown': text, 'metadata': {'sourceURL': f'https://example.com/{name}'}}
+    >>> delta = store.merge([page('a', 'a'), page('b', 'b')])
+    >>> delta['new'], delta['removed']
+    (['https://example.com/a', 'https://example.com/b'], [])
+    >>> delta = store.merge([page('a', 'a'), page('c', 'c'), page('b', 'b2')])
+    >>> delta['new'], delta['changed'], delta['unchanged'], [p['markdown'] for p in delta['pages']]
+    (['https://example.com/c'], ['https://example.com/b'], 1, ['c', 'b2'])
+    >>> store.merge([page('c', 'c'), page('b', 'b2')])['removed']
+    ['https://example.com/a']
+    >>> [p['markdown'] for p in store.pages()]
+    ['b2', 'c']
+    >>> store.close()
+    """
+
+    def __init__(self, path=DEFAULT_PAGE_STORE):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS pages ("
+            "url TEXT PRIMARY KEY, digest TEXT, status INTEGER, page TEXT, first_seen REAL, last_seen REAL)")
+        self.connection.commit()
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM pages").fetchone()[0]
+
+    def merge(self, pages, crawled_at=None):
+        """
+        Record a complete crawl of the site and return what changed since
+        the last one: {'pages': new and changed pages, in crawl order,
+        'new': their URLs, 'changed': ..., 'unchanged': a count, 'removed': URLs}.
+        """
+        crawled_at = crawled_at or time.time()
+        known = {url: (digest, status) for url, digest, status in
+                 self.connection.execute("SELECT url, digest, status FROM pages")}
+        if known and not pages:
+            raise ValueError("The crawl returned no pages: the page store is left as it was")
+        delta = {'pages': [], 'new': [], 'changed': [], 'unchanged': 0, 'removed': []}
+        seen = set()
+        with self.connection:
+            for page in pages:
+                url = get_page_url(page)
+                if not url or url in seen:
+                    continue
+                seen.add(url)
+                digest = get_content_digest(page)
+                status = get_page_status(page)
+                if url not in known:
+                    self.connection.execute(
+                        "INSERT INTO pages (url, digest, status, page, first_seen, last_seen) "
+                        "VALUES (?, ?, ?, ?, ?, ?)", (url, digest, status, json.dumps(page), crawled_at, crawled_at))
+                    if status == 200:
+                        delta['pages'].append(page)
+                        delta['new'].append(url)
+                    continue
+                known_digest, known_status = known[url]
+                if known_digest == digest:
+                    self.connection.execute("UPDATE pages SET last_seen = ? WHERE url = ?", (crawled_at, url))
+                    delta['unchanged'] += 1
+                    continue
+                self.connection.execute(
+                    "UPDATE pages SET digest = ?, status = ?, page = ?, last_seen = ? WHERE url = ?",
+                    (digest, status, json.dumps(page), crawled_at, url))
+                if status == 200:
+                    delta['pages'].append(page)
+                    delta['changed'].append(url)
+                elif known_status == 200:
+                    delta['removed'].append(url)
+            gone = [url for url in known if url not in seen]
+            self.connection.executemany("DELETE FROM pages WHERE url = ?", [(url,) for url in gone])
+            delta['removed'] += [url for url in gone if known[url][1] == 200]
+        return delta
+
+    def pages(self):
+        """
+        Yield every stored page, in the order they were first crawled.
+        """
+        for (page,) in self.connection.execute("SELECT page FROM pages ORDER BY rowid"):
+            yield json.loads(page)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
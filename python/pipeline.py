@@ -0,0 +1,315 @@
+"""Crawl, transform and load in one run, chunking pages while the crawl is still going"""
+
+import argparse
+import json
+import os
+import queue
+import threading
+import time
+
+import dotenv
+
+import dedup
+import load
+import page_cache
+import render
+import serializer
+import transform
+from journal import DEFAULT_JOURNAL, Journal
+from metrics import METRICS
+from run_firecrawl import CRAWL_PARAMS, CRAWL_URL
+
+DEFAULT_API_URL = 'https://api.firecrawl.dev'
+POLL_INTERVAL = 2
+QUEUE_SIZE = 64
+
+
+class FirecrawlClient:
+    """
+    The two Firecrawl v0 crawl endpoints the pipeline needs: start a crawl
+    job and check its status. 429s, 5xx responses and connection errors are
+    retried as load.py retries batches, and requests can be held to a
+    load.TokenBucket.
+    """
+
+    def __init__(self, api_key, api_url=DEFAULT_API_URL, session=None, rate_limiter=None):
+        import requests
+
+        self.api_url = api_url.rstrip('/')
+        self.headers = {'Authorization': f'Bearer {api_key}', 'Content-Type': 'application/json'}
+        self.session = session or requests.Session()
+        self.rate_limiter = rate_limiter
+
+    def request(self, method, path, **kwargs):
+        import requests
+
+        for attempt in range(load.MAX_RETRIES + 1):
+            if self.rate_limiter:
+                self.rate_limiter.acquire()
+            response = None
+            try:
+                response = self.session.request(method, f"{self.api_url}{path}", headers=self.headers,
+                                                timeout=load.REQUEST_TIMEOUT, **kwargs)
+                response.raise_for_status()
+                return response.json()
+            except requests.RequestException:
+                retryable = response is None or response.status_code in load.RETRY_STATUS_CODES
+                if not retryable or attempt == load.MAX_RETRIES:
+                    raise
+                delay = load.get_retry_after(response) if response is not None else None
+                time.sleep(load.get_backoff(attempt) if delay is None else delay)
+
+    def start_crawl(self, url, params=None):
+        return self.request('POST', '/v0/crawl', json={'url': url, **(params or {})})['jobId']
+
+    def get_status(self, job_id):
+        return self.request('GET', f'/v0/crawl/status/{job_id}')
+
+
+def get_page_key(page):
+    metadata = page['metadata']
+    return metadata.get('sourceURL'), metadata.get('ogUrl')
+
+
+def poll_crawl(client, job_id, poll_interval=POLL_INTERVAL):
+    """
+    Yield each page of a crawl job once, as soon as a status poll returns it.
+
+    While the job is active, the status only carries the most recently
+    crawled pages (partial_data). Pages crawled between two polls that fell
+    out of that window come with the full data once the job completes.
+
+    >>> from fake_firecrawl import FakeFirecrawl
+    >>> pages = [{'markdown': str(n), 'metadata': {'sourceURL': f'https://example.com/{n}'}} for n in range(5)]
+    >>> with FakeFirecrawl(pages, pages_per_second=50, partial_data_pages=2) as firecrawl:
+    ...     client = FirecrawlClient('key', firecrawl.url)
+    ...     crawled = [page['markdown'] for page in poll_crawl(client, client.start_crawl('https://example.com/'), 0.01)]
+    >>> sorted(crawled)
+    ['0', '1', '2', '3', '4']
+    """
+    seen = set()
+    while True:
+        status = client.get_status(job_id)
+        state = status.get('status')
+        if state == 'failed':
+            raise RuntimeError(f"Crawl job {job_id} failed: {status}")
+        pages = status.get('data') if state == 'completed' else status.get('partial_data')
+        for page in pages or []:
+            key = get_page_key(page)
+            if key not in seen:
+                seen.add(key)
+                yield page
+        if state == 'completed':
+            return
+        time.sleep(poll_interval)
+
+
+class Stopped(Exception):
+    """
+    Raised in a pipeline stage once a later stage has failed.
+    """
+
+
+class Failed:
+    """
+    Sent down a queue in place of the remaining items when a stage fails.
+    """
+
+    def __init__(self, error):
+        self.error = error
+
+
+DONE = object()
+
+
+def put(items_queue, item, stopped):
+    # Bounded queues block a stage that gets ahead of the next one; check
+    # regularly whether the run was stopped so it does not block forever
+    while not stopped.is_set():
+        try:
+            items_queue.put(item, timeout=0.1)
+            return
+        except queue.Full:
+            continue
+    raise Stopped()
+
+
+def drain(items_queue):
+    """
+    Yield the items a stage puts on a queue, re-raising its failure.
+    """
+    while True:
+        item = items_queue.get()
+        if item is DONE:
+            return
+        if isinstance(item, Failed):
+            raise item.error
+        yield item
+
+
+def start_stage(name, items, output, stopped):
+    """
+    Put each item of `items` on the output queue from a new thread, timing
+    the stage as a whole.
+    """
+    def run():
+        start = time.perf_counter()
+        try:
+            for item in items:
+                put(output, item, stopped)
+            put(output, DONE, stopped)
+        except Stopped:
+            pass
+        except BaseException as e:
+            try:
+                put(output, Failed(e), stopped)
+            except Stopped:
+                pass
+        finally:
+            METRICS.add_time(f'pipeline.{name}', time.perf_counter() - start)
+
+    thread = threading.Thread(target=run, name=name, daemon=True)
+    thread.start()
+    return thread
+
+
+def save_crawl(pages, crawl_results_file):
+    """
+    Yield pages while writing them to the crawl results file, so transform.py
+    and load.py can be re-run on this crawl later.
+    """
+    with open(crawl_results_file, 'w') as f:
+        f.write('[\n')
+        for n, page in enumerate(pages):
+            if n:
+                f.write(',\n')
+            json.dump(page, f)
+            yield page
+        f.write('\n]\n')
+
+
+def save_chunks(chunks, chunk_filename):
+    with open(chunk_filename, 'wb') as f:
+        for chunk in chunks:
+            f.write(serializer.dumps(chunk) + b"\n")
+            yield chunk
+
+
+def run(client, config, crawl_url=CRAWL_URL, crawl_params=CRAWL_PARAMS, upsert=False,
+        poll_interval=POLL_INTERVAL, workers=1, cache=None, queue_size=QUEUE_SIZE,
+        concurrency=4, rate=None, batcher=None, journal=None, session=None, deduplicator=None):
+    """
+    Crawl crawl_url and load its chunks, with the crawl, transform and load
+    stages running at once and handing over pages and chunks through bounded
+    queues. Returns the crawl results file, the chunks file and the number of
+    chunks loaded.
+
+    Against the local stand-ins, the dataset ends up with the chunks a
+    serial transform of the crawl makes:
+
+    >>> import os, tempfile
+    >>> from fake_firecrawl import FakeFirecrawl
+    >>> from fake_trieve import FakeTrieve
+    >>> with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+    ...                        'example_crawl_results_2024-08-20T16-35-59.json')) as f:
+    ...     pages = json.load(f)
+    >>> cwd = os.getcwd()
+    >>> os.chdir(tempfile.mkdtemp())
+    >>> with FakeFirecrawl(pages, pages_per_second=100) as firecrawl, FakeTrieve() as trieve:
+    ...     config = {'api_key': 'key', 'base_path': trieve.url, 'dataset_id': 'dataset'}
+    ...     _, chunk_filename, loaded = run(FirecrawlClient('key', firecrawl.url), config,
+    ...                                     crawl_url='https://signoz.io/docs/', poll_interval=0.05, workers=2)
+    >>> os.chdir(cwd)
+    >>> expected = {chunk['tracking_id']: chunk['chunk_html'] for chunk in transform.iter_chunks(pages)}
+    >>> loaded, {tracking_id: chunk['chunk_html'] for tracking_id, chunk in trieve.chunks['dataset'].items()} == expected
+    (10, True)
+    """
+    timestamp = time.strftime("%Y-%m-%d_%H-%M-%S")
+    crawl_results_file = f'crawl_results_{timestamp}.json'
+    transform.TIMESTAMP = timestamp
+    chunk_filename = transform.get_chunk_filename('jsonl')
+
+    job_id = client.start_crawl(crawl_url, crawl_params)
+    stopped = threading.Event()
+    page_queue = queue.Queue(maxsize=queue_size)
+    chunk_queue = queue.Queue(maxsize=queue_size)
+
+    pages = save_crawl(METRICS.timed_iter(poll_crawl(client, job_id, poll_interval), 'crawl'),
+                       crawl_results_file)
+    start_stage('crawl', pages, page_queue, stopped)
+    # One page per group, so a page is chunked as soon as it is crawled
+    chunks = transform.iter_chunks(drain(page_queue), workers=workers, group_size=1, page_cache=cache)
+    if deduplicator:
+        chunks = deduplicator.filter(chunks)
+    start_stage('transform', save_chunks(chunks, chunk_filename), chunk_queue, stopped)
+    try:
+        loaded = load.load_stream(drain(chunk_queue), config, upsert=upsert, batcher=batcher,
+                                  concurrency=concurrency, rate=rate, journal=journal,
+                                  chunk_file=chunk_filename, session=session)
+    finally:
+        stopped.set()
+    return crawl_results_file, chunk_filename, loaded
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Crawl, transform and load chunks in one pipelined run")
+    operation = parser.add_mutually_exclusive_group(required=True)
+    operation.add_argument('-c', action='store_true', help="create chunks")
+    operation.add_argument('-u', action='store_true', help="upsert chunks")
+    parser.add_argument('--url', default=CRAWL_URL, help=f"site to crawl (default: {CRAWL_URL})")
+    parser.add_argument('--poll-interval', type=float, default=POLL_INTERVAL,
+                        help=f"seconds between crawl status polls (default: {POLL_INTERVAL})")
+    parser.add_argument('--queue-size', type=int, default=QUEUE_SIZE,
+                        help=f"pages and chunks buffered between stages (default: {QUEUE_SIZE})")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="number of processes used to transform pages (default: 1)")
+    parser.add_argument('--cache', nargs='?', const='page_cache.sqlite', default=None,
+                        help="reuse chunks of unchanged pages from this cache (default: page_cache.sqlite)")
+    parser.add_argument('--dedup', nargs='?', type=float, const=dedup.DEFAULT_THRESHOLD, default=None,
+                        help="drop chunks at least this similar to an earlier chunk "
+                             f"(default: {dedup.DEFAULT_THRESHOLD})")
+    parser.add_argument('--dedup-report', default='dedup_report.json',
+                        help="where --dedup writes which tracking_ids were merged (default: dedup_report.json)")
+    parser.add_argument('--concurrency', type=int, default=4,
+                        help="number of batches in flight at once (default: 4)")
+    parser.add_argument('--rate', type=float, default=None,
+                        help="maximum requests per second (default: unlimited)")
+    parser.add_argument('--journal', default=DEFAULT_JOURNAL,
+                        help=f"journal of acknowledged batches (default: {DEFAULT_JOURNAL})")
+    parser.add_argument('--report', default=None,
+                        help="write a JSON run report of stage timings and counters to this file")
+    parser.add_argument('--prometheus', default=None,
+                        help="write the same metrics in Prometheus text format to this file")
+    args = parser.parse_args(argv)
+
+    dotenv.load_dotenv(dotenv.find_dotenv(filename='../.env'))
+    load.setup_logging()
+    client = FirecrawlClient(os.getenv('FIRECRAWL_API_KEY'), os.getenv('FIRECRAWL_API_URL') or DEFAULT_API_URL)
+    config = load.get_configuration()
+    cache = None
+    if args.cache:
+        cache = page_cache.PageCache(args.cache, transform.get_cache_version())
+
+    deduplicator = dedup.Deduplicator(args.dedup) if args.dedup is not None else None
+
+    start = time.perf_counter()
+    try:
+        with Journal(args.journal) as journal:
+            crawl_results_file, chunk_filename, loaded = run(
+                client, config, crawl_url=args.url, upsert=args.u, poll_interval=args.poll_interval,
+                workers=args.workers, cache=cache, queue_size=args.queue_size,
+                concurrency=args.concurrency, rate=args.rate, journal=journal, deduplicator=deduplicator)
+        if deduplicator:
+            deduplicator.save_report(args.dedup_report)
+        print(f"Saved the crawl to {crawl_results_file} and {loaded} chunks to {chunk_filename}")
+        crawl_seconds = METRICS.snapshot()['stages'].get('pipeline.crawl', {}).get('seconds', 0.0)
+        print(f"Crawl took {crawl_seconds:.1f}s, the whole run {time.perf_counter() - start:.1f}s")
+    finally:
+        if cache:
+            cache.close()
+        METRICS.export(args.report, args.prometheus, command='pipeline', url=args.url,
+                       workers=args.workers, concurrency=args.concurrency, renderer=render.get_backend())
+
+
+if __name__ == "__main__":
+    main()
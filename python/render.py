@@ -0,0 +1,215 @@
+"""Render chunk markdown to html"""
+
+import argparse
+import hashlib
+import importlib
+import json
+from collections import OrderedDict
+
+import cleaners
+
+DEFAULT_BACKEND = 'markdown'
+DEFAULT_CACHE_SIZE = 4096
+
+
+def python_markdown_backend():
+    """
+    One Python-Markdown converter, reset between chunks instead of being
+    rebuilt (with its extensions) for every call as markdown.markdown() does.
+    """
+    import markdown
+    md = markdown.Markdown()
+
+    def convert(text):
+        md.reset()
+        return md.convert(text)
+    return convert
+
+
+# Backends map a name to a factory returning a text -> html function. A new
+# backend must pass `python render.py --check <name>` before it is used for
+# real output.
+BACKENDS = {
+    'markdown': python_markdown_backend,
+}
+
+
+def get_factory_path(factory):
+    return f'{factory.__module__}:{factory.__qualname__}'
+
+
+def load_factory(path):
+    """
+    The factory at a 'module:name' path.
+    """
+    module, _, name = path.partition(':')
+    factory = importlib.import_module(module)
+    for attribute in name.split('.'):
+        factory = getattr(factory, attribute)
+    return factory
+
+
+def register_backend(name, factory):
+    """
+    Add a backend: a factory, or its 'module:name' path. Transform worker
+    processes start from a fresh interpreter and import the factory by that
+    path, so it has to be defined at the top level of a module.
+
+    >>> import os, sys, tempfile, textwrap, transform
+    >>> directory = tempfile.mkdtemp()
+    >>> with open(os.path.join(directory, 'pre_renderer.py'), 'w') as f:
+    ...     _ = f.write(textwrap.dedent('''
+    ...         def pre_backend():
+    ...             return lambda text: '<pre>' + text + '</pre>'
+    ...     '''))
+    >>> sys.path.insert(0, directory)
+    >>> register_backend('pre', 'pre_renderer:pre_backend')
+    >>> set_backend('pre')
+    >>> path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+    ...                     'example_crawl_results_2024-08-20T16-35-59.json')
+    >>> serial = [chunk['chunk_html'] for chunk in transform.iter_chunks(transform.iter_crawl_results(path))]
+    >>> parallel = [chunk['chunk_html'] for chunk in transform.iter_chunks(transform.iter_crawl_results(path),
+    ...                                                                     workers=2, group_size=2)]
+    >>> serial == parallel, all(html.startswith('<pre>') for html in parallel)
+    (True, True)
+    >>> set_backend(DEFAULT_BACKEND); del BACKENDS['pre']; sys.path.remove(directory)
+    """
+    BACKENDS[name] = load_factory(factory) if isinstance(factory, str) else factory
+
+
+class Renderer:
+    """
+    Render markdown with one converter, memoizing the html of recently seen
+    chunk bodies (by content hash) in a bounded LRU.
+
+    >>> renderer = Renderer(cache_size=2)
+    >>> renderer('Some *text*')
+    '<p>Some <em>text</em></p>'
+    >>> renderer('Some *text*')
+    '<p>Some <em>text</em></p>'
+    >>> renderer.hits, renderer.misses
+    (1, 1)
+    """
+
+    def __init__(self, backend=DEFAULT_BACKEND, cache_size=DEFAULT_CACHE_SIZE):
+        self.backend = backend
+        self.convert = BACKENDS[backend]()
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __call__(self, text):
+        if not self.cache_size:
+            return self.convert(text)
+        key = hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest()
+        html = self.cache.get(key)
+        if html is not None:
+            self.hits += 1
+            self.cache.move_to_end(key)
+            return html
+        self.misses += 1
+        html = self.convert(text)
+        self.cache[key] = html
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return html
+
+
+_renderer = None
+_backend = DEFAULT_BACKEND
+
+
+def set_backend(backend, factory_path=None):
+    """
+    Select the backend used by render_markdown in this process. Transform
+    worker processes pass get_backend_spec(), registering the backend by
+    its factory's path if they don't have it.
+    """
+    global _renderer, _backend
+    if backend not in BACKENDS and factory_path:
+        register_backend(backend, factory_path)
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown renderer backend: {backend}")
+    _backend = backend
+    _renderer = None
+
+
+def get_backend():
+    return _backend
+
+
+def get_backend_spec():
+    """
+    (name, factory path) of the backend, for worker processes to set up.
+    """
+    return _backend, get_factory_path(BACKENDS[_backend])
+
+
+def render_markdown(text):
+    """
+    Render with this process's renderer, created on first use.
+    """
+    global _renderer
+    if _renderer is None:
+        _renderer = Renderer(_backend)
+    return _renderer(text)
+
+
+def get_chunk_texts(crawl_results_file):
+    """
+    The chunk bodies of a crawl, as transform.py has them before rendering.
+    """
+    # Imported here: transform.py imports this module
+    import transform
+    return [chunk['chunk_html'] for item in transform.iter_crawl_results(crawl_results_file)
+            for chunk in transform.transform_page(item)['']]
+
+
+def check_parity(backend, texts):
+    """
+    Return the texts a backend's Renderer (with its converter reuse and
+    cache) renders differently from a fresh markdown.markdown() call per text.
+
+    >>> check_parity('markdown', ['# Title', 'Some [link](/docs/)'])
+    []
+
+    Over the chunks of the example crawl:
+
+    >>> import os
+    >>> texts = get_chunk_texts(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+    ...                                      'example_crawl_results_2024-08-20T16-35-59.json'))
+    >>> len(texts), check_parity('markdown', texts)
+    (10, [])
+    """
+    import markdown
+    renderer = Renderer(backend)
+    return [text for text in texts if renderer(text) != markdown.markdown(text)]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check a renderer backend against markdown.markdown() on crawled pages")
+    parser.add_argument('--check', required=True, choices=sorted(BACKENDS),
+                        help="backend to compare with markdown.markdown()")
+    parser.add_argument('crawl_results_file', nargs='?', default='../example_crawl_results_2024-08-20T16-35-59.json')
+    args = parser.parse_args(argv)
+
+    with open(args.crawl_results_file, 'r') as f:
+        crawl_results = json.load(f)
+    # Cleaned pages, and the chunk bodies transform.py renders
+    pages = [cleaners.CHUNK_CLEANERS(cleaners.remove_end_matter(item['markdown']))
+             for item in crawl_results]
+    chunks = get_chunk_texts(args.crawl_results_file)
+
+    mismatches = check_parity(args.check, pages + chunks)
+    print(f"{args.check}: {len(pages) + len(chunks) - len(mismatches)} of {len(pages) + len(chunks)} texts "
+          f"({len(pages)} pages, {len(chunks)} chunks) match markdown.markdown()")
+    for text in mismatches[:10]:
+        print("-" * 80)
+        print(text[:500])
+    if mismatches:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
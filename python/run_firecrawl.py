@@ -1,19 +1,17 @@
 # Firecrawl Docs: https://docs.firecrawl.dev/features/crawl
 # Firecrawl Github: https://github.com/mendableai/firecrawl/tree/main/apps/python-sdk
+import argparse
+import copy
 import os
 import json
 import time
-from firecrawl import FirecrawlApp
 import dotenv
 
-dotenv.load_dotenv(dotenv.find_dotenv(filename='../.env'))
-
-# Initialize the FirecrawlApp with your API key
-app = FirecrawlApp(api_key=os.getenv('FIRECRAWL_API_KEY'))
+from page_store import DEFAULT_PAGE_STORE, PageStore
 
 # Define crawl parameters
-crawl_url = 'https://signoz.io/docs/'
-params = {
+CRAWL_URL = 'https://signoz.io/docs/'
+CRAWL_PARAMS = {
     'crawlerOptions': {
         'limit': 1000,
         'maxDepth': 10,
@@ -24,14 +22,105 @@ params = {
     }
 }
 
-# Crawl the website
-crawl_result = app.crawl_url(
-    url=crawl_url,
-    params=params,
-    wait_until_done=True,
-    poll_interval=2
-)
-
-# Save the crawl result to a file (with a timestamp)
-with open(f'crawl_results_{time.strftime("%Y-%m-%d_%H-%M-%S")}.json', 'w') as f:
-    json.dump(crawl_result, f, indent=2)
\ No newline at end of file
+
+def get_crawl_params(**crawler_options):
+    """
+    CRAWL_PARAMS with some of its crawlerOptions replaced.
+
+    >>> get_crawl_params(includes=['guides/*'], limit=50)['crawlerOptions']
+    {'limit': 50, 'maxDepth': 10, 'includes': ['guides/*']}
+    """
+    params = copy.deepcopy(CRAWL_PARAMS)
+    params['crawlerOptions'].update(crawler_options)
+    return params
+
+
+def crawl_incremental(client, store, url=CRAWL_URL, params=CRAWL_PARAMS, poll_interval=2):
+    """
+    Crawl the site and merge the crawl into the page store. Returns the
+    delta of PageStore.merge(): the new and changed pages, and the URLs of
+    removed pages.
+
+    >>> from fake_firecrawl import FakeFirecrawl
+    >>> from pipeline import FirecrawlClient
+    >>> page = lambda name, text: {'markdown': text, 'metadata': {'sourceURL': f'https://example.com/{name}'}}
+    >>> store = PageStore(':memory:')
+    >>> with FakeFirecrawl([page('a', 'a'), page('b', 'b')], pages_per_second=1000) as firecrawl:
+    ...     client = FirecrawlClient('key', firecrawl.url)
+    ...     first = crawl_incremental(client, store, 'https://example.com/', poll_interval=0.01)
+    ...     firecrawl.pages = [page('b', 'b2'), page('c', 'c')]
+    ...     second = crawl_incremental(client, store, 'https://example.com/', poll_interval=0.01)
+    >>> len(first['pages']), second['new'], second['changed'], second['removed']
+    (2, ['https://example.com/c'], ['https://example.com/b'], ['https://example.com/a'])
+    >>> [page['markdown'] for page in store.pages()]
+    ['b2', 'c']
+    """
+    # Imported here: pipeline.py imports this module
+    from pipeline import poll_crawl
+
+    job_id = client.start_crawl(url, params)
+    return store.merge(list(poll_crawl(client, job_id, poll_interval)))
+
+
+def write_incremental(store, delta, timestamp):
+    """
+    Write the complete crawl snapshot to crawl_results_<ts>.json, the new
+    and changed pages to crawl_delta_<ts>.json and the removed URLs to
+    crawl_removed_<ts>.json. Returns the three filenames.
+    """
+    snapshot_file = f'crawl_results_{timestamp}.json'
+    delta_file = f'crawl_delta_{timestamp}.json'
+    removed_file = f'crawl_removed_{timestamp}.json'
+    with open(snapshot_file, 'w') as f:
+        json.dump(list(store.pages()), f, indent=2)
+    with open(delta_file, 'w') as f:
+        json.dump(delta['pages'], f, indent=2)
+    with open(removed_file, 'w') as f:
+        json.dump(delta['removed'], f, indent=2)
+    return snapshot_file, delta_file, removed_file
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Crawl a site with Firecrawl and save the crawl results")
+    parser.add_argument('--url', default=CRAWL_URL, help=f"site to crawl (default: {CRAWL_URL})")
+    parser.add_argument('--incremental', nargs='?', const=DEFAULT_PAGE_STORE, default=None, metavar='STORE',
+                        help="merge the crawl into a page store and also write the new and changed pages "
+                             f"and the removed URLs (default store: {DEFAULT_PAGE_STORE})")
+    parser.add_argument('--poll-interval', type=float, default=2,
+                        help="seconds between crawl status polls (default: 2)")
+    args = parser.parse_args(argv)
+
+    dotenv.load_dotenv(dotenv.find_dotenv(filename='../.env'))
+
+    if args.incremental:
+        from pipeline import DEFAULT_API_URL, FirecrawlClient
+
+        client = FirecrawlClient(os.getenv('FIRECRAWL_API_KEY'), os.getenv('FIRECRAWL_API_URL') or DEFAULT_API_URL)
+        with PageStore(args.incremental) as store:
+            delta = crawl_incremental(client, store, args.url, CRAWL_PARAMS, args.poll_interval)
+            files = write_incremental(store, delta, time.strftime("%Y-%m-%d_%H-%M-%S"))
+        print(f"{len(delta['new'])} new, {len(delta['changed'])} changed, {delta['unchanged']} unchanged, "
+              f"{len(delta['removed'])} removed pages")
+        print("Saved the crawl to {}, the new and changed pages to {} and the removed URLs to {}".format(*files))
+        return
+
+    from firecrawl import FirecrawlApp
+
+    # Initialize the FirecrawlApp with your API key
+    app = FirecrawlApp(api_key=os.getenv('FIRECRAWL_API_KEY'))
+
+    # Crawl the website
+    crawl_result = app.crawl_url(
+        url=args.url,
+        params=CRAWL_PARAMS,
+        wait_until_done=True,
+        poll_interval=2
+    )
+
+    # Save the crawl result to a file (with a timestamp)
+    with open(f'crawl_results_{time.strftime("%Y-%m-%d_%H-%M-%S")}.json', 'w') as f:
+        json.dump(crawl_result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
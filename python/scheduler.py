@@ -0,0 +1,295 @@
+"""Crawl, transform and load many docs sites at once, from a site manifest"""
+
+import argparse
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlparse
+
+import dotenv
+
+import load
+import page_cache
+import pipeline
+import transform
+from journal import DEFAULT_JOURNAL, Journal
+from metrics import METRICS
+from run_firecrawl import get_crawl_params
+
+DEFAULT_SITES = 'sites.json'
+# Settings of a site that the manifest's defaults, or these, fill in
+SITE_DEFAULTS = {
+    # Crawl
+    'includes': [],
+    'limit': 1000,
+    'max_depth': 10,
+    # Transform: CONFIGS overrides, besides root_url and tag_root
+    'tag_root': 'docs',
+    'configs': {},
+    # Load: batches in flight and requests per second for this site
+    'concurrency': 2,
+    'rate': None,
+}
+# Settings without a default: root_url is the url's scheme and host, and the
+# dataset id is read from dataset_variable (TRIEVE_DATASET_ID_<NAME>)
+SITE_SETTINGS = {'name', 'url', 'root_url', 'dataset', 'dataset_variable'} | set(SITE_DEFAULTS)
+
+
+def get_sites(manifest):
+    """
+    The sites of a manifest, {"defaults": {...}, "sites": [{...}, ...]},
+    with every setting filled in.
+
+    >>> sites = get_sites({'defaults': {'rate': 5}, 'sites': [
+    ...     {'name': 'signoz', 'url': 'https://signoz.io/docs/', 'configs': {'boost': True}}]})
+    >>> [(site['root_url'], site['dataset_variable'], site['rate']) for site in sites]
+    [('https://signoz.io/', 'TRIEVE_DATASET_ID_SIGNOZ', 5)]
+    >>> get_sites({'sites': [{'name': 'signoz', 'url': 'https://signoz.io/', 'configs': {'max_word': 1}}]})
+    Traceback (most recent call last):
+    ...
+    ValueError: Site 'signoz' sets unknown configs: max_word
+    """
+    defaults = dict(SITE_DEFAULTS, **manifest.get('defaults', {}))
+    sites = []
+    for entry in manifest.get('sites', []):
+        site = dict(defaults, **entry)
+        name = site.get('name', '')
+        if not transform.VARIANT_NAME_PATTERN.match(name):
+            raise ValueError(f"Site names may only use letters, digits, _ and -: {name!r}")
+        if any(other['name'] == name for other in sites):
+            raise ValueError(f"Site {name!r} is given twice")
+        if not site.get('url'):
+            raise ValueError(f"Site {name!r} has no url")
+        unknown = sorted(set(site) - SITE_SETTINGS)
+        if unknown:
+            raise ValueError(f"Site {name!r} has unknown settings: {', '.join(unknown)}")
+        unknown = sorted(set(site['configs']) - set(transform.CONFIGS))
+        if unknown:
+            raise ValueError(f"Site {name!r} sets unknown configs: {', '.join(unknown)}")
+        url = urlparse(site['url'])
+        site.setdefault('root_url', f"{url.scheme}://{url.netloc}/")
+        site.setdefault('dataset_variable', load.get_dataset_variable(name))
+        sites.append(site)
+    return sites
+
+
+def read_sites(path=DEFAULT_SITES):
+    with open(path, 'r') as f:
+        return get_sites(json.load(f))
+
+
+def get_overrides(site):
+    """
+    CONFIGS overrides that transform the site's pages.
+    """
+    return dict(site['configs'], root_url=site['root_url'], tag_root=site['tag_root'])
+
+
+def get_site_configuration(site):
+    config = load.get_configuration()
+    config['dataset_id'] = site.get('dataset') or os.getenv(site['dataset_variable'])
+    return config
+
+
+class SharedPools:
+    """
+    What the sites of a run share: the process pool that transforms their
+    pages, the threads and connection pool that upload their chunks, and
+    the rate limit on all of their uploads.
+    """
+
+    def __init__(self, workers, concurrency, rate=None):
+        self.workers = workers
+        self.transform = transform.start_workers(workers)
+        self.uploads = ThreadPoolExecutor(max_workers=concurrency)
+        self.session = load.get_session(concurrency)
+        self.rate_limiter = load.TokenBucket(rate) if rate else None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.uploads.shutdown()
+        self.transform.shutdown()
+
+
+def run_site(site, client, pools, upsert=False, poll_interval=pipeline.POLL_INTERVAL,
+             queue_size=pipeline.QUEUE_SIZE, cache_path=None, cache_version=None, journal=None):
+    """
+    Crawl a site and load its chunks into its dataset, with the stages
+    running at once as in pipeline.run(), on the shared pools. Returns the
+    crawl results file, the chunks file and the number of chunks loaded.
+    """
+    name = site['name']
+    config = get_site_configuration(site)
+    if not config['dataset_id']:
+        raise ValueError(f"Site {name!r} has no dataset: set {site['dataset_variable']} or its dataset")
+    crawl_results_file = f'crawl_results_{transform.TIMESTAMP}.{name}.json'
+    chunk_filename = transform.get_chunk_filename('jsonl', name)
+    cache = page_cache.PageCache(cache_path, cache_version) if cache_path else None
+    # The site's own limit first, so a site waiting on it holds no shared token
+    rate_limiter = load.TokenBuckets(load.TokenBucket(site['rate']) if site['rate'] else None, pools.rate_limiter)
+
+    job_id = client.start_crawl(site['url'], get_crawl_params(includes=site['includes'], limit=site['limit'],
+                                                              maxDepth=site['max_depth']))
+    stopped = threading.Event()
+    page_queue = queue.Queue(maxsize=queue_size)
+    chunk_queue = queue.Queue(maxsize=queue_size)
+
+    pages = pipeline.save_crawl(METRICS.timed_iter(pipeline.poll_crawl(client, job_id, poll_interval), 'crawl'),
+                                crawl_results_file)
+    pipeline.start_stage(f'crawl.{name}', pages, page_queue, stopped)
+    # Pages are transformed one at a time on the shared pool, with the
+    # site's CONFIGS
+    variant_chunks = transform.iter_variant_chunks(pipeline.drain(page_queue), workers=pools.workers, group_size=1,
+                                                   page_cache=cache, executor=pools.transform,
+                                                   overrides=get_overrides(site))
+    chunks = (chunk for _, chunk in variant_chunks)
+    pipeline.start_stage(f'transform.{name}', pipeline.save_chunks(chunks, chunk_filename), chunk_queue, stopped)
+    try:
+        loaded = load.load_stream(pipeline.drain(chunk_queue), config, upsert=upsert, batcher=load.AdaptiveBatcher(),
+                                  concurrency=site['concurrency'], journal=journal, chunk_file=chunk_filename,
+                                  session=pools.session, rate_limiter=rate_limiter, executor=pools.uploads,
+                                  desc=name)
+    finally:
+        stopped.set()
+        if cache:
+            METRICS.inc('page_cache_hits', cache.hits)
+            cache.close()
+    return crawl_results_file, chunk_filename, loaded
+
+
+def run(sites, client, workers=1, concurrency=8, rate=None, max_sites=4, upsert=False,
+        poll_interval=pipeline.POLL_INTERVAL, queue_size=pipeline.QUEUE_SIZE, cache_path=None, journal=None):
+    """
+    Run up to max_sites sites at once. All of them share `workers`
+    transform processes, `concurrency` upload threads and at most `rate`
+    upload requests per second, on top of each site's own concurrency and
+    rate. A site that fails does not stop the others. Returns the outcome of
+    each site, by name.
+
+    >>> import tempfile
+    >>> from fake_firecrawl import FakeFirecrawl
+    >>> from fake_trieve import FakeTrieve
+    >>> with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+    ...                        'example_crawl_results_2024-08-20T16-35-59.json')) as f:
+    ...     pages = json.load(f)
+    >>> other_pages = json.loads(json.dumps(pages).replace('https://signoz.io/', 'https://docs.example.com/'))
+    >>> sites = get_sites({'defaults': {'rate': 50}, 'sites': [
+    ...     {'name': 'signoz', 'url': 'https://signoz.io/docs/', 'dataset': 'signoz-dataset'},
+    ...     {'name': 'example', 'url': 'https://docs.example.com/docs/', 'dataset': 'example-dataset',
+    ...      'configs': {'boost': True}},
+    ...     {'name': 'rejected', 'url': 'https://signoz.io/docs/', 'dataset': 'unknown-dataset'}]})
+    >>> cwd = os.getcwd()
+    >>> os.chdir(tempfile.mkdtemp())
+    >>> with FakeFirecrawl(pages + other_pages, pages_per_second=100) as firecrawl, \\
+    ...         FakeTrieve(datasets={'signoz-dataset', 'example-dataset'}) as trieve:
+    ...     os.environ['TRIEVE_BASE_URL'] = trieve.url
+    ...     results = run(sites, pipeline.FirecrawlClient('key', firecrawl.url), poll_interval=0.05)
+    >>> del os.environ['TRIEVE_BASE_URL']
+    >>> os.chdir(cwd)
+    >>> [(name, result['status'], result.get('chunks')) for name, result in results.items()]
+    [('signoz', 'loaded', 10), ('example', 'loaded', 10), ('rejected', 'failed', None)]
+    >>> sorted(trieve.chunks['signoz-dataset']) == sorted(trieve.chunks['example-dataset'])
+    True
+    """
+    transform.TIMESTAMP = time.strftime("%Y-%m-%d_%H-%M-%S")
+    # Each site has its own cache, whose version depends on its CONFIGS.
+    # Worked out before the sites start, as it changes CONFIGS for a moment
+    cache_versions = {}
+    for site in sites:
+        with transform.variant_configs(get_overrides(site)):
+            cache_versions[site['name']] = transform.get_cache_version()
+
+    results = {}
+    with SharedPools(workers, concurrency, rate) as pools, ThreadPoolExecutor(max_workers=max_sites) as executor:
+        futures = {executor.submit(run_site, site, client, pools, upsert, poll_interval, queue_size,
+                                   transform.get_variant_path(cache_path, site['name']) if cache_path else None,
+                                   cache_versions[site['name']], journal): site['name']
+                   for site in sites}
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                crawl_results_file, chunk_filename, loaded = future.result()
+            except Exception as e:
+                logging.error(f"Site {name} failed: {e}")
+                results[name] = {'status': 'failed', 'error': str(e)}
+                continue
+            results[name] = {'status': 'loaded', 'crawl_results_file': crawl_results_file,
+                             'chunk_file': chunk_filename, 'chunks': loaded}
+    return {site['name']: results[site['name']] for site in sites}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Crawl, transform and load every site of a site manifest")
+    operation = parser.add_mutually_exclusive_group(required=True)
+    operation.add_argument('-c', action='store_true', help="create chunks")
+    operation.add_argument('-u', action='store_true', help="upsert chunks")
+    parser.add_argument('--sites', default=DEFAULT_SITES, help=f"site manifest (default: {DEFAULT_SITES})")
+    parser.add_argument('--only', action='append', default=None, metavar='NAME',
+                        help="run only this site of the manifest (repeatable)")
+    parser.add_argument('--max-sites', type=int, default=4, help="sites crawled at once (default: 4)")
+    parser.add_argument('--workers', type=int, default=2,
+                        help="processes transforming the pages of every site (default: 2)")
+    parser.add_argument('--concurrency', type=int, default=8,
+                        help="batches in flight across every site (default: 8)")
+    parser.add_argument('--rate', type=float, default=None,
+                        help="maximum Trieve requests per second across every site (default: unlimited)")
+    parser.add_argument('--crawl-rate', type=float, default=None,
+                        help="maximum Firecrawl requests per second across every site (default: unlimited)")
+    parser.add_argument('--poll-interval', type=float, default=pipeline.POLL_INTERVAL,
+                        help=f"seconds between crawl status polls (default: {pipeline.POLL_INTERVAL})")
+    parser.add_argument('--queue-size', type=int, default=pipeline.QUEUE_SIZE,
+                        help=f"pages and chunks buffered between stages (default: {pipeline.QUEUE_SIZE})")
+    parser.add_argument('--cache', nargs='?', const='page_cache.sqlite', default=None,
+                        help="reuse chunks of unchanged pages, from one cache per site "
+                             "(default: page_cache.<site>.sqlite)")
+    parser.add_argument('--journal', default=DEFAULT_JOURNAL,
+                        help=f"journal of acknowledged batches (default: {DEFAULT_JOURNAL})")
+    parser.add_argument('--report', default=None,
+                        help="write a JSON run report of stage timings, counters and site outcomes to this file")
+    parser.add_argument('--prometheus', default=None,
+                        help="write the same metrics in Prometheus text format to this file")
+    args = parser.parse_args(argv)
+
+    try:
+        sites = read_sites(args.sites)
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+    if args.only:
+        unknown = sorted(set(args.only) - {site['name'] for site in sites})
+        if unknown:
+            parser.error(f"Not in {args.sites}: {', '.join(unknown)}")
+        sites = [site for site in sites if site['name'] in args.only]
+
+    dotenv.load_dotenv(dotenv.find_dotenv(filename='../.env'))
+    load.setup_logging()
+    crawl_rate_limiter = load.TokenBucket(args.crawl_rate) if args.crawl_rate else None
+    client = pipeline.FirecrawlClient(os.getenv('FIRECRAWL_API_KEY'),
+                                      os.getenv('FIRECRAWL_API_URL') or pipeline.DEFAULT_API_URL,
+                                      rate_limiter=crawl_rate_limiter)
+
+    start = time.perf_counter()
+    results = {}
+    try:
+        with Journal(args.journal) as journal:
+            results = run(sites, client, workers=args.workers, concurrency=args.concurrency, rate=args.rate,
+                          max_sites=args.max_sites, upsert=args.u, poll_interval=args.poll_interval,
+                          queue_size=args.queue_size, cache_path=args.cache, journal=journal)
+        for name, result in results.items():
+            if result['status'] == 'loaded':
+                print(f"  {name:<20} {result['chunks']:>6} chunks from {result['crawl_results_file']}")
+            else:
+                print(f"  {name:<20} failed: {result['error']}")
+        print(f"{len(sites)} sites in {time.perf_counter() - start:.1f}s")
+    finally:
+        METRICS.export(args.report, args.prometheus, command='sites', sites=results, workers=args.workers,
+                       concurrency=args.concurrency, max_sites=args.max_sites)
+
+
+if __name__ == "__main__":
+    main()
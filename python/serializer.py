@@ -0,0 +1,95 @@
+"""Encode and decode chunk data as JSON, with orjson when it is installed"""
+
+import json
+
+AUTO_BACKEND = 'auto'
+
+
+def json_backend():
+    """
+    The json module, writing what json.dumps() writes.
+    """
+    def dumps(obj, indent=False):
+        return json.dumps(obj, indent=2 if indent else None).encode('utf-8')
+    return dumps, json.loads
+
+
+def orjson_backend():
+    """
+    orjson: compact UTF-8, several times faster than the json module on
+    chunks. Parses to the same objects, but the bytes differ from json.dumps().
+    """
+    import orjson
+
+    def dumps(obj, indent=False):
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else 0)
+    return dumps, orjson.loads
+
+
+# Backends map a name to a factory returning (dumps, loads): dumps(obj,
+# indent=False) -> bytes and loads(bytes or str) -> obj
+BACKENDS = {
+    'json': json_backend,
+    'orjson': orjson_backend,
+}
+
+
+def register_backend(name, factory):
+    BACKENDS[name] = factory
+
+
+def get_available_backend():
+    """
+    orjson if it can be imported, otherwise json.
+    """
+    try:
+        import orjson  # noqa: F401
+    except ImportError:
+        return 'json'
+    return 'orjson'
+
+
+_backend = None
+_dumps = None
+_loads = None
+
+
+def set_backend(backend=AUTO_BACKEND):
+    """
+    Select the backend of dumps() and loads() in this process; 'auto' picks
+    get_available_backend().
+
+    >>> set_backend('json'); get_backend()
+    'json'
+    >>> loads(dumps({'chunk_html': '<p>é</p>'}))
+    {'chunk_html': '<p>é</p>'}
+    >>> set_backend()
+    """
+    global _backend, _dumps, _loads
+    if backend == AUTO_BACKEND:
+        backend = get_available_backend()
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown serializer backend: {backend}")
+    _dumps, _loads = BACKENDS[backend]()
+    _backend = backend
+
+
+def get_backend():
+    if _backend is None:
+        set_backend()
+    return _backend
+
+
+def dumps(obj, indent=False):
+    """
+    obj as JSON bytes, indented by 2 spaces with indent.
+    """
+    if _dumps is None:
+        set_backend()
+    return _dumps(obj, indent)
+
+
+def loads(data):
+    if _loads is None:
+        set_backend()
+    return _loads(data)
@@ -1,39 +1,53 @@
-import requests
+import argparse
 import os
 import dotenv
 from urllib.parse import quote
 
-dotenv.load_dotenv()
+DEFAULT_BASE_URL = "https://api.trieve.ai"
+SEARCH_URL = "https://search.trieve.ai/?organization=45b8a3b5-6601-4d58-b918-a8dee39a2b93&searchType=fulltext&scoreThreshold=0&extendResults=false&slimChunks=false&groupUniqueSearch=false&sort_by=%7B%7D&pageSize=10&getTotalPages=false&highlightStrategy=exactmatch&highlightResults=true&highlightThreshold=0.8&highlightDelimiters=%3F%2C.%2C%21&highlightMaxLength=8&highlightMaxNum=3&highlightWindow=0&group_size=3&useQuoteNegatedTerms=false&removeStopWords=false&filters=null&multiQueries=%5B%5D&dataset=9f93ad6f-eae2-4cb5-936b-4fc8af3375c3&query={query}"
+
 
 def get_configuration():
     return {
         "api_key": os.getenv('TRIEVE_API_KEY'),
-        "base_path": "https://api.trieve.ai",
+        "base_path": os.getenv('TRIEVE_BASE_URL') or DEFAULT_BASE_URL,
         "dataset_id": os.getenv('TRIEVE_DATASET_ID_BASELINE')
     }
 
-config = get_configuration()
 
-url = f"{config['base_path']}/api/chunk/suggestions"
+def get_suggestions(config, query="<string>"):
+    import requests
+
+    url = f"{config['base_path']}/api/chunk/suggestions"
+
+    payload = {"query": query}
+    headers = {
+        "Authorization": f"Bearer {config['api_key']}",
+        "TR-Dataset": config['dataset_id'],
+        "Content-Type": "application/json"
+    }
+
+    response = requests.post(url, json=payload, headers=headers)
+    return response.json()
 
-payload = {"query": "<string>"}
-headers = {
-    "Authorization": f"Bearer {config['api_key']}",
-    "TR-Dataset": config['dataset_id'],
-    "Content-Type": "application/json"
-}
 
-response = requests.post(url, json=payload, headers=headers)
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Get suggested queries for the dataset from Trieve")
+    parser.add_argument('--query', default="<string>", help="query to suggest related queries for")
+    args = parser.parse_args(argv)
 
-response_data = response.json()
-if "queries" in response_data:
-    print("Suggested queries:")
-    print(response_data["queries"])
-    for query in response_data["queries"]:
-        query_link = f"https://search.trieve.ai/?organization=45b8a3b5-6601-4d58-b918-a8dee39a2b93&searchType=fulltext&scoreThreshold=0&extendResults=false&slimChunks=false&groupUniqueSearch=false&sort_by=%7B%7D&pageSize=10&getTotalPages=false&highlightStrategy=exactmatch&highlightResults=true&highlightThreshold=0.8&highlightDelimiters=%3F%2C.%2C%21&highlightMaxLength=8&highlightMaxNum=3&highlightWindow=0&group_size=3&useQuoteNegatedTerms=false&removeStopWords=false&filters=null&multiQueries=%5B%5D&dataset=9f93ad6f-eae2-4cb5-936b-4fc8af3375c3&query={quote(query)}"
-        print(f"- {query}")
-        print(f"  - Jump: {query_link}")
-else:
-    print("No suggested queries found in the response.")
+    dotenv.load_dotenv()
+    response_data = get_suggestions(get_configuration(), args.query)
+    if "queries" in response_data:
+        print("Suggested queries:")
+        print(response_data["queries"])
+        for query in response_data["queries"]:
+            query_link = SEARCH_URL.format(query=quote(query))
+            print(f"- {query}")
+            print(f"  - Jump: {query_link}")
+    else:
+        print("No suggested queries found in the response.")
 
 
+if __name__ == "__main__":
+    main()
@@ -1,46 +1,242 @@
+import argparse
+import hashlib
+import itertools
 import json
+import multiprocessing
 import re
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from contextlib import ExitStack, contextmanager
 from urllib.parse import urlparse
+import chunk_store
 import cleaners
-import markdown
+import dedup
+import page_cache
+import render
+import serializer
+from chunk_store import write_chunk_md
+from metrics import METRICS
 import os
 
 CONFIGS = {
     'boost': False,
     'max_words': 500,
     'max_depth': 3,
+    # Split sections still over max_words at max_depth, or without
+    # subsections, on paragraph, code fence and list item boundaries
+    'split_oversized': True,
+    # Words of the previous piece repeated at the start of the next one
+    'overlap_words': 0,
     'semantic_boost_distance_factor': 0.5,
     'fulltext_boost_factor': 5,
-    'root_url': 'https://signoz.io/'
+    'root_url': 'https://signoz.io/',
+    # Pages are tagged with the path segments after this one ('' for the
+    # whole path), leaving out the page itself
+    'tag_root': 'docs',
 }
 
-crawl_results_files = sorted(
-    [f for f in os.listdir('.') if f.startswith('crawl_results') and f.endswith('.json')],
-    reverse=True
-)
+# Named chunking variants, as overrides of CONFIGS
+VARIANTS = {
+    'baseline': {'boost': False},
+    'boost': {'boost': True},
+}
+# A run without variants: CONFIGS as they are, written to the usual file names
+DEFAULT_VARIANTS = {'': {}}
+VARIANT_NAME_PATTERN = re.compile(r'[\w-]+$')
+
+# Timestamp of the crawl being transformed: set by main(), and passed on
+# to worker processes by init_worker()
+TIMESTAMP = ''
+# run_firecrawl.py --incremental writes the new and changed pages of a crawl
+# to crawl_delta_<ts>.json and the URLs of removed pages to
+# crawl_removed_<ts>.json. The chunks of a delta go to chunks_delta_<ts>.json,
+# so they don't replace the chunks of the snapshot, and the groups of the
+# removed pages to removed_groups_<ts>.json
+DELTA_PREFIX = 'crawl_delta_'
+REMOVED_PREFIX = 'crawl_removed_'
+CHUNKS_PREFIX = 'chunks'
+DELTA_CHUNKS_PREFIX = 'chunks_delta'
+# Prefix of the chunk files being written: set by main()
+CHUNK_FILE_PREFIX = CHUNKS_PREFIX
+# Where pages whose cleaners ran past their time budget are recorded
+QUARANTINE_FILE = 'quarantine.jsonl'
+# Workers are started from a clean server process rather than forked from
+# this one: the pool starts workers on demand, while other threads may hold
+# locks (METRICS.lock among them) that a forked child would inherit held
+WORKER_START_METHOD = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+
+
+def find_crawl_results_file(directory='.'):
+    """
+    The latest crawl results file in a directory, or '' if there is none
+    """
+    crawl_results_files = sorted(
+        [f for f in os.listdir(directory) if f.startswith('crawl_results') and f.endswith('.json')],
+        reverse=True
+    )
+    return crawl_results_files[0] if crawl_results_files else ''
+
+
+def get_timestamp(crawl_results_file):
+    # Get the timestamp from the crawl results file name
+    return '_'.join(os.path.basename(crawl_results_file).split('_')[-2:]).split('.')[0]
+
+
+def is_delta_file(crawl_results_file):
+    return os.path.basename(crawl_results_file).startswith(DELTA_PREFIX)
+
+
+def find_removed_file(crawl_results_file):
+    """
+    The crawl_removed_<ts>.json next to a crawl_delta_<ts>.json, or '' if
+    there is none.
+    """
+    if not is_delta_file(crawl_results_file):
+        return ''
+    directory, filename = os.path.split(crawl_results_file)
+    removed_file = os.path.join(directory, REMOVED_PREFIX + filename[len(DELTA_PREFIX):])
+    return removed_file if os.path.exists(removed_file) else ''
+
 
-crawl_results_file = crawl_results_files[0] if crawl_results_files else ''
+def save_removed_groups(removed_file):
+    """
+    Write the group_tracking_ids of the chunks of the pages in removed_file
+    (a JSON list of URLs) to removed_groups_<ts>.json, for load.py to delete.
+
+    >>> import tempfile
+    >>> directory = tempfile.mkdtemp()
+    >>> removed_file = os.path.join(directory, 'crawl_removed_1.json')
+    >>> with open(removed_file, 'w') as f:
+    ...     json.dump([CONFIGS['root_url'] + 'docs/a/', CONFIGS['root_url'] + 'docs/b/'], f)
+    >>> path = save_removed_groups(removed_file)
+    >>> with open(path) as f:
+    ...     json.load(f)
+    ['docs-a', 'docs-b']
+    >>> os.remove(path)
+    """
+    with open(removed_file, 'r') as f:
+        urls = json.load(f)
+    groups = sorted({get_tracking_id(url) for url in urls})
+    removed_groups_file = f'removed_groups_{TIMESTAMP}.json'
+    with open(removed_groups_file, 'w') as f:
+        json.dump(groups, f, indent=2)
+    return removed_groups_file
 
-if not crawl_results_file:
-    print('No crawl results file found')
-    exit(1)
 
-# Load the crawl results
-with open(crawl_results_file, 'r') as f:
-    crawl_results = json.load(f)
+def init_worker(backend, timestamp, configs, cleaner_budgets=(None, None)):
+    """
+    Set up a worker process as the parent is set up, whether the worker is
+    forked or spawned.
+    """
+    global TIMESTAMP
+    render.set_backend(*backend)
+    TIMESTAMP = timestamp
+    CONFIGS.update(configs)
+    cleaners.CHUNK_CLEANERS.set_budgets(*cleaner_budgets)
 
-# Get the timestamp from the crawl results file name
-TIMESTAMP = '_'.join(crawl_results_file.split('_')[-2:]).split('.')[0]
 
-chunks = []
+@contextmanager
+def variant_configs(overrides):
+    """
+    Apply a variant's overrides to CONFIGS for the duration of the block.
+    """
+    saved = dict(CONFIGS)
+    CONFIGS.update(overrides)
+    try:
+        yield
+    finally:
+        CONFIGS.clear()
+        CONFIGS.update(saved)
+
+
+def parse_setting(setting):
+    """
+    (key, value) of a CONFIGS setting given as key=value, the value read as
+    JSON if it is JSON and as a string otherwise.
+    """
+    key, separator, value = setting.partition('=')
+    if not separator or key not in CONFIGS:
+        raise ValueError(f"Expected <config>=<value> with a config from {', '.join(CONFIGS)}: {setting!r}")
+    try:
+        return key, json.loads(value)
+    except ValueError:
+        return key, value
+
+
+def parse_variant(spec):
+    """
+    (name, CONFIGS overrides) of a variant given as one of VARIANTS, or as
+    name:key=value,... on top of the named variant if there is one.
+
+    >>> parse_variant('boost')
+    ('boost', {'boost': True})
+    >>> parse_variant('boost:max_words=800')
+    ('boost', {'boost': True, 'max_words': 800})
+    >>> parse_variant('wide:max_words=800,max_depth=2')
+    ('wide', {'max_words': 800, 'max_depth': 2})
+    """
+    name, _, settings = spec.partition(':')
+    if not VARIANT_NAME_PATTERN.match(name):
+        raise ValueError(f"Variant names may only use letters, digits, _ and -: {name!r}")
+    if not settings and name not in VARIANTS:
+        raise ValueError(f"Unknown variant {name!r}: use one of {', '.join(VARIANTS)} "
+                         f"or give its settings as {name}:<config>=<value>,...")
+    overrides = dict(VARIANTS.get(name, {}))
+    if settings:
+        overrides.update(parse_setting(setting) for setting in settings.split(','))
+    return name, overrides
+
+
+def get_sweep_variants(sweeps):
+    """
+    One variant for each combination of the values of the swept settings,
+    named after them.
+
+    >>> list(get_sweep_variants(['max_words=300,800', 'max_depth=2']).items())
+    [('max_words-300_max_depth-2', {'max_words': 300, 'max_depth': 2}), ('max_words-800_max_depth-2', {'max_words': 800, 'max_depth': 2})]
+    """
+    if not sweeps:
+        return {}
+    axes = []
+    for sweep in sweeps:
+        key, _, values = sweep.partition('=')
+        axes.append([parse_setting(f"{key}={value}") for value in values.split(',')])
+    variants = {}
+    for combination in itertools.product(*axes):
+        name = '_'.join(f"{key}-{value}" for key, value in combination)
+        # Keep names usable in file names: 0.5 -> 0-5
+        name = re.sub(r'[^\w-]', '-', name)
+        variants[name] = dict(combination)
+    return variants
+
+
+def get_variants(specs, sweeps):
+    """
+    The variants given with --variant and --sweep, or DEFAULT_VARIANTS.
+    """
+    variants = {}
+    for name, overrides in [parse_variant(spec) for spec in specs] + list(get_sweep_variants(sweeps).items()):
+        if name in variants:
+            raise ValueError(f"Variant {name!r} is given twice")
+        variants[name] = overrides
+    return variants or DEFAULT_VARIANTS
+
+
+def get_variant_path(path, variant):
+    # chunks.md -> chunks.<variant>.md
+    if not variant:
+        return path
+    root, extension = os.path.splitext(path)
+    return f"{root}.{variant}{extension}"
+
 
 def get_tags(url):
     parsed_url = urlparse(url)
     path_parts = parsed_url.path.split('/')
-    if 'docs' in path_parts:
-        docs_index = path_parts.index('docs')
-        # Return all non-empty tags after 'docs' except the last one
-        return [tag for tag in path_parts[docs_index + 1:-1] if tag]
+    if CONFIGS['tag_root'] in path_parts:
+        root_index = path_parts.index(CONFIGS['tag_root'])
+        # Return all non-empty tags after the tag root except the last one
+        return [tag for tag in path_parts[root_index + 1:-1] if tag]
     return []
 
 
@@ -56,30 +252,18 @@ def get_tracking_id(url):
     return url.replace('#', '-').replace(' ', '-').replace(':', '-').replace('/', '-').replace('--', '-').strip('-')
 
 
-def get_chunk_html(content, page_title, headingtext, start_index, chunk_end):
+def clean_chunk_text(chunk_content):
     """
-    Get the content for a sub-page
-    """        
-    try:
-        if chunk_end is not None:
-            chunk_content = content[start_index:chunk_end]
-        else:
-            chunk_content = content[start_index:]
-        chunk_text = "\n".join(chunk_content.splitlines()).strip().strip('-')
-        chunk_html = f"{chunk_text.strip()}"
+    Normalize and clean the markdown of a chunk, before its heading is set
+    """
+    chunk_text = "\n".join(chunk_content.splitlines()).strip().strip('-')
+    return cleaners.CHUNK_CLEANERS(chunk_text.strip())
 
-    except ValueError as e:
-        chunk_html = f"Error processing chunk: {str(e)}"
-        raise e
 
-    chunk_html = cleaners.clean_multi_column_links(chunk_html)
-    chunk_html = cleaners.clean_double_newline_markdown_links(chunk_html)
-    chunk_html = cleaners.clean_anchortag_headings(chunk_html)
-    chunk_html = cleaners.clean_extra_newlines_after_links(chunk_html)
-    chunk_html = cleaners.clean_double_asterisk_whitespace_gaps(chunk_html)
-    
-    
-    
+def finish_chunk_html(chunk_html, page_title, headingtext):
+    """
+    Flag heading-only chunks and replace the heading line of cleaned chunk text
+    """
     # Skip heading-only chunks
     if len(chunk_html.strip().splitlines()) <= 1:
         return {"HEADING_ONLY": chunk_html.strip()}
@@ -94,6 +278,24 @@ def get_chunk_html(content, page_title, headingtext, start_index, chunk_end):
     return chunk_html
 
 
+def get_chunk_html(content, page_title, headingtext, start_index, chunk_end):
+    """
+    Get the content for a sub-page
+    """        
+    try:
+        if chunk_end is not None:
+            chunk_content = content[start_index:chunk_end]
+        else:
+            chunk_content = content[start_index:]
+        chunk_html = clean_chunk_text(chunk_content)
+
+    except ValueError as e:
+        chunk_html = f"Error processing chunk: {str(e)}"
+        raise e
+
+    return finish_chunk_html(chunk_html, page_title, headingtext)
+
+
 def create_chunk(chunk_html, page_link, headinglink, headingtext, page_tags_set, page_title, page_description):
     if page_title.endswith(f": {headingtext}"):
         title = page_title
@@ -126,36 +328,294 @@ def create_chunk(chunk_html, page_link, headinglink, headingtext, page_tags_set,
 
     return chunk
 
-def process_content(page_markdown, page_title, page_link, page_tags_set,
-                    page_description, max_words=CONFIGS['max_words'], max_depth=CONFIGS['max_depth']):
-    def split_content(content, pattern, headingtext, headinglink):
-        matches = re.findall(pattern, content, re.DOTALL)
-
-        sections = []
-        if matches:
-            pre_split_content = content.split(matches[0][0])
-            if len(pre_split_content[0].strip()) > 0:
-                # sections contain: headinglink, headingtext, section_content
-                sections.append((headinglink, headingtext, pre_split_content[0]))
-        for i, match in enumerate(matches):
-            matchstring, headinglink, headingtext = match
-            start = content.index(matchstring)
-            end = len(content) if i == len(matches) - 1 else content.index(matches[i+1][0])
-            sections.append((headinglink, headingtext, content[start:end]))
-        return sections
+TOP_HEADING_PATTERN = re.compile(r'(\n\[\]\((#.*?)\))\n(.*?)\n', re.DOTALL)
+SUB_HEADING_PATTERN = re.compile(r'(\n###+ \[\]\((#.*?)\))\n(.*?)\n', re.DOTALL)
+
+
+class Section:
+    """
+    A heading section of a page: a character range of the page markdown.
+
+    The preamble before the first heading of a range has no heading of its
+    own and takes the heading of the section it was split from. The cleaned
+    text of a section is computed once, however often chunking visits it.
+    """
+
+    def __init__(self, page_markdown, start, end, headinglink='', headingtext='',
+                 is_preamble=False, is_subheading=False):
+        self.page_markdown = page_markdown
+        self.start = start
+        self.end = end
+        self.headinglink = headinglink
+        self.headingtext = headingtext
+        self.is_preamble = is_preamble
+        self.is_subheading = is_subheading
+        self.subsections = []
+        self._cleaned_text = None
+
+    @property
+    def content(self):
+        return self.page_markdown[self.start:self.end]
+
+    def cleaned_text(self):
+        if self._cleaned_text is None:
+            self._cleaned_text = clean_chunk_text(self.content)
+        return self._cleaned_text
+
+    def split(self, headinglink, headingtext):
+        """
+        (headinglink, headingtext, section) for each subsection, with the
+        preamble labelled by the given heading.
+
+        A ### section splits into just itself: ###+ matches every deeper
+        heading level too, so a ### section holds no other subheading.
+        """
+        if self.is_subheading:
+            return [(self.headinglink, self.headingtext, self)]
+        return [(headinglink, headingtext, section) if section.is_preamble
+                else (section.headinglink, section.headingtext, section)
+                for section in self.subsections]
+
+
+def split_sections(page_markdown, pattern, start, end, is_subheading=False):
+    """
+    Split page_markdown[start:end] at each heading matched by pattern, in one
+    scan, using the match offsets so repeated headings each get their own section.
+    """
+    matches = list(pattern.finditer(page_markdown, start, end))
+    sections = []
+    if matches and page_markdown[start:matches[0].start()].strip():
+        sections.append(Section(page_markdown, start, matches[0].start(), is_preamble=True))
+    for i, match in enumerate(matches):
+        section_end = matches[i + 1].start() if i + 1 < len(matches) else end
+        sections.append(Section(page_markdown, match.start(), section_end,
+                                match.group(2), match.group(3), is_subheading=is_subheading))
+    return sections
+
+
+def parse_sections(page_markdown):
+    """
+    Parse a page into its top-level ([](#anchor)) sections, each holding its
+    ### subsections
+    """
+    sections = split_sections(page_markdown, TOP_HEADING_PATTERN, 0, len(page_markdown))
+    for section in sections:
+        section.subsections = split_sections(page_markdown, SUB_HEADING_PATTERN,
+                                             section.start, section.end, is_subheading=True)
+    return sections
+
+
+class ParsedPage:
+    """
+    The parsing and cleaning of a page, which do not depend on CONFIGS:
+    done once, however many variants chunk the page.
+    """
+
+    def __init__(self, page_markdown):
+        self.page_markdown = page_markdown
+        self._sections = None
+        self._cleaned_text = None
+
+    def sections(self):
+        if self._sections is None:
+            with METRICS.timer('split_sections'):
+                self._sections = parse_sections(self.page_markdown)
+        return self._sections
+
+    def cleaned_text(self):
+        # The whole page as one chunk's text
+        if self._cleaned_text is None:
+            self._cleaned_text = clean_chunk_text(self.page_markdown)
+        return self._cleaned_text
+
+
+FENCE_PATTERN = re.compile(r'\s*(```|~~~)')
+LIST_ITEM_PATTERN = re.compile(r' {0,3}(?:[-*+]|\d+[.)])\s')
+
+
+class Block:
+    """
+    A paragraph, code fence or list item of chunk text, with its word count
+    and the separator that preceded it.
+    """
+
+    def __init__(self, lines, separator='\n\n'):
+        self.text = "\n".join(lines)
+        self.words = len(self.text.split())
+        self.separator = separator
+
+
+def split_blocks(text):
+    """
+    Split markdown into blocks in one pass over its lines: paragraphs end at
+    blank lines, a code fence is one block up to its closing fence, and each
+    list item starts a new block.
+
+    >>> [block.text for block in split_blocks("Intro\\n\\n- one\\n- two\\n\\n```\\na\\n\\nb\\n```")]
+    ['Intro', '- one', '- two', '```\\na\\n\\nb\\n```']
+    """
+    blocks = []
+    lines = []
+    separator = '\n'
+    fence = None
+    for line in text.split('\n'):
+        if fence:
+            lines.append(line)
+            if line.strip().startswith(fence):
+                blocks.append(Block(lines, separator))
+                lines, separator, fence = [], '\n', None
+            continue
+        fence_match = FENCE_PATTERN.match(line)
+        if not line.strip() or fence_match or LIST_ITEM_PATTERN.match(line):
+            if lines:
+                blocks.append(Block(lines, separator))
+                lines, separator = [], '\n'
+            if not line.strip():
+                separator = '\n\n'
+                continue
+            if fence_match:
+                fence = fence_match.group(1)
+        lines.append(line)
+    if lines:
+        blocks.append(Block(lines, separator))
+    return blocks
 
+
+def split_block(block, max_words):
+    """
+    Split a block over max_words on line boundaries, or on word boundaries
+    for a single long line. The pieces of a code fence are fenced again.
+    """
+    lines = block.text.split('\n')
+    opening = closing = None
+    fence_match = FENCE_PATTERN.match(lines[0])
+    if fence_match:
+        # Keep the info string (the language) on the opening fence of each piece
+        opening, closing = lines[0].strip(), fence_match.group(1)
+        lines = lines[1:-1] if len(lines) > 1 and lines[-1].strip().startswith(closing) else lines[1:]
+        # The fence lines take room in each piece
+        max_words = max(1, max_words - len(opening.split()) - 1)
+
+    pieces = []
+    current = []
+    words = 0
+    for line in lines:
+        line_words = line.split()
+        if len(line_words) > max_words:
+            parts = [" ".join(line_words[i:i + max_words]) for i in range(0, len(line_words), max_words)]
+        else:
+            parts = [line]
+        for part in parts:
+            part_words = len(part.split())
+            if current and words + part_words > max_words:
+                pieces.append(current)
+                current, words = [], 0
+            current.append(part)
+            words += part_words
+    if current:
+        pieces.append(current)
+
+    if opening:
+        pieces = [[opening] + piece + [closing] for piece in pieces]
+    return [Block(piece, block.separator if i == 0 else '\n\n') for i, piece in enumerate(pieces)]
+
+
+def split_oversized(chunk_html, has_heading, max_words, overlap_words=0):
+    """
+    Split chunk text into pieces of at most max_words words, packing whole
+    paragraphs, code fences and list items. Each piece after the first
+    starts with the heading line again and then with up to overlap_words
+    words of the blocks that ended the previous piece.
+
+    >>> text = "Title: Install\\n" + "\\n\\n".join(f"Paragraph {n} has five words" for n in range(4))
+    >>> [piece.splitlines()[-1] for piece in split_oversized(text, True, 12)]
+    ['Paragraph 1 has five words', 'Paragraph 3 has five words']
+    >>> split_oversized(text, True, 12, overlap_words=5)[1].split('\\n\\n')
+    ['Title: Install', 'Paragraph 1 has five words', 'Paragraph 2 has five words']
+    """
+    heading = ''
+    body = chunk_html
+    if has_heading:
+        heading, _, body = chunk_html.partition('\n')
+    budget = max(1, max_words - len(heading.split()))
+
+    blocks = []
+    for block in split_blocks(body):
+        blocks.extend(split_block(block, budget) if block.words > budget else [block])
+
+    pieces = []
+    current = []
+    words = 0
+    for block in blocks:
+        if current and words + block.words > budget:
+            pieces.append(current)
+            # Carry the trailing blocks that fit in the overlap and leave room for this block
+            carried = []
+            carried_words = 0
+            for previous in reversed(current):
+                if carried_words + previous.words > min(overlap_words, budget - block.words):
+                    break
+                carried.insert(0, previous)
+                carried_words += previous.words
+            current, words = carried, carried_words
+        current.append(block)
+        words += block.words
+    if current:
+        pieces.append(current)
+
+    texts = []
+    for n, piece in enumerate(pieces):
+        text = piece[0].text + "".join(block.separator + block.text for block in piece[1:])
+        if heading:
+            # The first piece keeps the section's own spacing after the heading line;
+            # the next ones leave a blank line so a list or fence starting them still renders
+            text = heading + (piece[0].separator if n == 0 else '\n\n') + text
+        texts.append(text)
+    return texts
+
+
+def create_section_chunks(chunk_html, word_count, page_link, headinglink, headingtext,
+                          page_tags_set, page_title, page_description, max_words=CONFIGS['max_words']):
+    """
+    The chunk of a section, or the pieces of an oversized one. The first
+    piece keeps the section's tracking_id and the next ones add -part-<n>.
+    """
+    if word_count <= max_words:
+        return [create_chunk(chunk_html, page_link, headinglink, headingtext,
+                             page_tags_set, page_title, page_description)]
+    if not CONFIGS['split_oversized']:
+        METRICS.inc('forced_oversize_chunks')
+        return [create_chunk(chunk_html, page_link, headinglink, headingtext,
+                             page_tags_set, page_title, page_description)]
+    pieces = split_oversized(chunk_html, bool(headingtext), max_words, CONFIGS['overlap_words'])
+    chunks = []
+    for part, piece in enumerate(pieces, 1):
+        chunk = create_chunk(piece, page_link, headinglink, headingtext,
+                             page_tags_set, page_title, page_description)
+        if part > 1:
+            chunk['tracking_id'] = f"{chunk['tracking_id']}-part-{part}"
+        chunks.append(chunk)
+    METRICS.inc('oversize_sections_split')
+    METRICS.inc('oversize_split_chunks', len(chunks))
+    return chunks
+
+
+def process_content(page_markdown, page_title, page_link, page_tags_set,
+                    page_description, max_words=CONFIGS['max_words'], max_depth=CONFIGS['max_depth'],
+                    sections=None):
     def create_chunks(sections, current_title='', depth=0):
         local_chunks = []
         last_chunk_heading_only = False
         
-        for headinglink, headingtext, section_content in sections:
+        for headinglink, headingtext, section in sections:
             if last_chunk_heading_only:
                 headingtext = last_chunk_heading_only + " - " + headingtext
                 last_chunk_heading_only = False
+                METRICS.inc('heading_only_merges')
 
             full_title = (f"{current_title}: {headingtext}" if current_title != headingtext
                           else headingtext).strip(': ')
-            chunk_html = get_chunk_html(section_content, page_title, headingtext, 0, None)
+            chunk_html = finish_chunk_html(section.cleaned_text(), page_title, headingtext)
             try:
                 last_chunk_heading_only = chunk_html["HEADING_ONLY"]
             except TypeError:
@@ -163,92 +623,513 @@ def process_content(page_markdown, page_title, page_link, page_tags_set,
             if last_chunk_heading_only:
                 continue
             
-            if len(chunk_html.split()) <= max_words or depth >= max_depth:
+            word_count = len(chunk_html.split())
+            if word_count <= max_words or depth >= max_depth:
                 # Create chunk if within word limit or max depth reached
-                chunk = create_chunk(chunk_html, page_link, headinglink, headingtext,
-                                     page_tags_set, page_title, page_description)
                 if full_title.endswith(f"{headingtext}: {headingtext}"):
                     full_title = full_title.replace(f": {headingtext}", "", 1)
-                chunk['metadata']['title'] = full_title
-                local_chunks.append(chunk)
+                for chunk in create_section_chunks(chunk_html, word_count, page_link, headinglink, headingtext,
+                                                   page_tags_set, page_title, page_description, max_words):
+                    chunk['metadata']['title'] = full_title
+                    local_chunks.append(chunk)
             else:
                 # Try to split into subsections
-                subsections = split_content(section_content, r'(\n###+ \[\]\((#.*?)\))\n(.*?)\n', headingtext, headinglink)
+                subsections = section.split(headinglink, headingtext)
                 if subsections:
                     local_chunks.extend(create_chunks(subsections,
                                                       current_title=full_title,
                                                       depth=depth + 1))
                 else:
                     # If no subsections, force create a chunk
-                    chunk = create_chunk(chunk_html, page_link, headinglink, headingtext,
-                                         page_tags_set, page_title, page_description)
-                    local_chunks.append(chunk)
+                    local_chunks.extend(create_section_chunks(chunk_html, word_count, page_link, headinglink,
+                                                              headingtext, page_tags_set, page_title,
+                                                              page_description, max_words))
         return local_chunks
 
     # Start with top-level headings
-    top_sections = split_content(page_markdown, r'(\n\[\]\((#.*?)\))\n(.*?)\n', "", "")
+    if sections is None:
+        sections = ParsedPage(page_markdown).sections()
+    top_sections = [(section.headinglink, section.headingtext, section) for section in sections]
     return create_chunks(top_sections, current_title=page_title)
 
-def main():
 
-    # Iterate through each item in the crawl results
-    for item in crawl_results:
-        url = item['metadata']['ogUrl']
+def iter_crawl_results(path, read_size=1 << 16):
+    """
+    Yield the items of a crawl results JSON array one at a time.
 
-        # Skip pages with pageStatusCode != 200
-        try:
-            if item['metadata']['pageStatusCode'] != 200:
+    Only the item currently being decoded is held in memory, so the whole
+    crawl file never has to be loaded at once.
+    """
+    decoder = json.JSONDecoder()
+    with open(path, 'r') as f:
+        buffer = f.read(read_size)
+        position = buffer.find('[')
+        if position == -1:
+            raise ValueError(f"{path} does not contain a JSON array")
+        position += 1
+        eof = False
+        while True:
+            # Skip whitespace and separators between items
+            while position < len(buffer) and buffer[position] in ' \t\r\n,':
+                position += 1
+            if position < len(buffer) and buffer[position] == ']':
+                return
+            try:
+                if position >= len(buffer):
+                    raise json.JSONDecodeError('Buffer exhausted', buffer, position)
+                item, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                # Item spans the buffer boundary: read more, doubling the read
+                # size so very large items are not re-parsed many times
+                more = f.read(max(read_size, len(buffer) - position))
+                eof = not more
+                buffer = buffer[position:] + more
+                position = 0
                 continue
-        except KeyError:
-            raise KeyError(f"pageStatusCode not found for url: {url}")
+            yield item
+
 
-        page_link = url
-        page_title = item['metadata']['ogTitle']
-        page_description = item['metadata'].get('description', '')
-        page_markdown = item['markdown']
-        page_tags_set = get_tags(url)
+def transform_page(item, variants=DEFAULT_VARIANTS):
+    """
+    Turn one crawl results item into the (unrendered) chunks of each variant,
+    by name. The page is parsed and cleaned once for all of them.
+
+    Every variant gets an empty list for pages skipped on pageStatusCode.
+    """
+    url = item['metadata']['ogUrl']
 
-        # Remove end matter
+    # Skip pages with pageStatusCode != 200
+    try:
+        if item['metadata']['pageStatusCode'] != 200:
+            METRICS.inc('pages_skipped_status')
+            return {name: [] for name in variants}
+    except KeyError:
+        raise KeyError(f"pageStatusCode not found for url: {url}")
+
+    page_link = url
+    page_title = item['metadata']['ogTitle']
+    page_description = item['metadata'].get('description', '')
+    page_markdown = item['markdown']
+    page_tags_set = get_tags(url)
+    # Cleaner time budgets and timeouts are per page
+    cleaners.CHUNK_CLEANERS.start_page(url)
+
+    # Remove end matter
+    with METRICS.timer('remove_end_matter'):
         page_markdown = cleaners.remove_end_matter(page_markdown)
 
-        # If the page is less than 500 words, then make one chunk for the page (baseline)
-        if len(page_markdown.split(" ")) < 500:
-            chunk_html = get_chunk_html(page_markdown, page_title, '', 0, None)
-            chunk = create_chunk(chunk_html, page_link, '', '', page_tags_set, page_title, page_description)
-            chunks.append(chunk)
-            continue
+    parsed = ParsedPage(page_markdown)
+    pages = {}
+    for name, overrides in variants.items():
+        with variant_configs(overrides):
+            pages[name] = chunk_page(page_markdown, page_title, page_link, page_tags_set, page_description, parsed)
+    return pages
+
+
+def chunk_page(page_markdown, page_title, page_link, page_tags_set, page_description, parsed=None):
+    """
+    Chunk the markdown of a page, once its end matter is removed, with the
+    current CONFIGS. Chunking the same ParsedPage again, with other CONFIGS,
+    reuses its parsing and cleaning.
+    """
+    if parsed is None:
+        parsed = ParsedPage(page_markdown)
 
-        # Otherwise, create subpage chunks 
-        chunks.extend(process_content(page_markdown, page_title, page_link,
-                                    page_tags_set, page_description))
+    # If the page is less than 500 words, then make one chunk for the page (baseline)
+    if len(page_markdown.split(" ")) < 500:
+        chunk_html = finish_chunk_html(parsed.cleaned_text(), page_title, '')
+        if isinstance(chunk_html, str) and CONFIGS['split_oversized']:
+            # Short by spaces, but newline separated words can still make it oversized
+            return create_section_chunks(chunk_html, len(chunk_html.split()), page_link, '', '',
+                                         page_tags_set, page_title, page_description, CONFIGS['max_words'])
+        return [create_chunk(chunk_html, page_link, '', '', page_tags_set, page_title, page_description)]
 
+    # Otherwise, create subpage chunks
+    return process_content(page_markdown, page_title, page_link, page_tags_set, page_description,
+                           CONFIGS['max_words'], CONFIGS['max_depth'], parsed.sections())
 
-    # render markdown to html
-    for chunk in chunks:
-        chunk['chunk_html'] = markdown.markdown(chunk['chunk_html'])
 
+def render_pages(items, variants=DEFAULT_VARIANTS):
+    """
+    Transform a group of crawl results items and render their chunks to html.
+
+    Returns the chunks of each variant per item so results can be
+    reassembled in crawl order. Variants that chunk a section the same way
+    share its rendering through the renderer's cache.
+    """
+    pages = []
+    for item in items:
+        page = transform_page(item, variants)
+        for page_chunks in page.values():
+            for chunk in page_chunks:
+                # render markdown to html
+                with METRICS.timer('render'):
+                    chunk['chunk_html'] = render.render_markdown(chunk['chunk_html'])
+        pages.append(page)
+    return pages
+
+
+def render_pages_in_worker(items, variants=DEFAULT_VARIANTS, overrides=None):
+    """
+    render_pages for a worker process, with CONFIGS overrides for these
+    items, also returning the metrics recorded while rendering and the
+    cleaner timeouts so the parent can merge them.
+    """
+    METRICS.reset()
+    with variant_configs(overrides or {}):
+        pages = render_pages(items, variants)
+    return pages, METRICS.snapshot(), cleaners.CHUNK_CLEANERS.take_timeouts()
 
-    # Save the chunks data to chunks.json
-    chunk_filename = f'chunks_{TIMESTAMP}.json'
+
+def iter_page_groups(crawl_items, group_size):
+    group = []
+    for item in crawl_items:
+        group.append(item)
+        if len(group) == group_size:
+            yield group
+            group = []
+    if group:
+        yield group
+
+
+def get_cache_version(variants=DEFAULT_VARIANTS):
+    """
+    Digest of everything besides the page itself that shapes its chunks:
+    the configs and variants, the cleaning and chunking code, and the
+    markdown renderer.
+    """
+    import markdown
+
+    version = hashlib.sha256()
+    version.update(json.dumps(CONFIGS, sort_keys=True).encode('utf-8'))
+    version.update(json.dumps(variants, sort_keys=True).encode('utf-8'))
+    version.update(markdown.__version__.encode('utf-8'))
+    version.update(render.get_backend().encode('utf-8'))
+    for module_file in (cleaners.__file__, render.__file__, __file__):
+        with open(module_file, 'rb') as f:
+            version.update(f.read())
+    return version.hexdigest()
+
+
+def get_page_digest(item):
+    metadata = item['metadata']
+    page = [item['markdown'], metadata.get('ogTitle'), metadata.get('description', ''),
+            metadata.get('pageStatusCode')]
+    return hashlib.sha256(json.dumps(page).encode('utf-8')).hexdigest()
+
+
+def get_cached_chunks(page_cache, item):
+    if page_cache is None:
+        return None
+    page = page_cache.get(item['metadata']['ogUrl'], get_page_digest(item))
+    if page is not None:
+        # Cached chunks carry the timestamp of the crawl that produced them
+        for page_chunks in page.values():
+            for chunk in page_chunks:
+                chunk['timestamp'] = TIMESTAMP
+    return page
+
+
+def quarantine(timeouts):
+    """
+    Append the cleaner timeouts of a group of pages to QUARANTINE_FILE, with
+    the rule that ran out of time and its input, and return the urls of
+    their pages.
+    """
+    if not timeouts:
+        return set()
+    with open(QUARANTINE_FILE, 'a') as f:
+        for timeout in timeouts:
+            print(f"Quarantined {timeout['page']}: {timeout['rule']} ran past {timeout['budget']} s, "
+                  f"used its fallback")
+            f.write(json.dumps({'url': timeout['page'], 'timestamp': TIMESTAMP, 'rule': timeout['rule'],
+                                'budget': timeout['budget'], 'text': timeout['text']}) + "\n")
+    return {timeout['page'] for timeout in timeouts}
+
+
+def merge_group(group, cached, rendered, page_cache):
+    """
+    Yield (variant, chunk) for the chunks of a group of pages in crawl
+    order, taking cache hits from cached and the rest, in order, from rendered.
+
+    Quarantined pages are not cached, so they are cleaned in full again
+    the next time.
+    """
+    if isinstance(rendered, Future):
+        rendered, worker_metrics, timeouts = rendered.result()
+        METRICS.merge(worker_metrics)
+    else:
+        timeouts = cleaners.CHUNK_CLEANERS.take_timeouts()
+    quarantined = quarantine(timeouts)
+    rendered = iter(rendered)
+    for item, page in zip(group, cached):
+        if page is None:
+            page = next(rendered)
+            if page_cache is not None and item['metadata']['ogUrl'] not in quarantined:
+                page_cache.put(item['metadata']['ogUrl'], get_page_digest(item), page)
+        METRICS.inc('pages')
+        for name, page_chunks in page.items():
+            METRICS.inc('chunks', len(page_chunks))
+            for chunk in page_chunks:
+                yield name, chunk
+
+
+def iter_chunks(crawl_items, workers=1, group_size=8, page_cache=None):
+    """
+    Yield rendered chunks for each crawl results item, in crawl order, with
+    CONFIGS as they are. Pages fanned out to worker processes come out as
+    the serial run writes them, byte for byte:
+
+    >>> path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+    ...                     'example_crawl_results_2024-08-20T16-35-59.json')
+    >>> serial = [json.dumps(chunk) for chunk in iter_chunks(iter_crawl_results(path))]
+    >>> parallel = [json.dumps(chunk) for chunk in iter_chunks(iter_crawl_results(path), workers=2, group_size=2)]
+    >>> len(serial) > 0, parallel == serial
+    (True, True)
+    """
+    for _, chunk in iter_variant_chunks(crawl_items, DEFAULT_VARIANTS, workers, group_size, page_cache):
+        yield chunk
+
+
+def start_workers(workers):
+    """
+    Process pool whose workers are set up as this process is.
+    """
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(WORKER_START_METHOD),
+                               initializer=init_worker,
+                               initargs=(render.get_backend_spec(), TIMESTAMP, CONFIGS,
+                                         cleaners.CHUNK_CLEANERS.get_budgets()))
+
+
+def iter_variant_chunks(crawl_items, variants=DEFAULT_VARIANTS, workers=1, group_size=8, page_cache=None,
+                        executor=None, overrides=None):
+    """
+    Yield (variant, rendered chunk) for each crawl results item, in crawl
+    order, and for each page in the order of variants.
+
+    With more than one worker, groups of pages are fanned out to a process
+    pool. At most 2 * workers groups are in flight at once, and results are
+    yielded in submission order, so the output matches the serial run.
+    Several runs can share one pool from start_workers() by passing it as
+    executor, each with its own CONFIGS overrides.
+
+    With a page_cache, pages whose content is unchanged since they were
+    cached are served from it and only the rest are transformed.
+    """
+    own_executor = None
+    if executor is None and workers > 1:
+        executor = own_executor = start_workers(workers)
+    max_pending = 2 * workers if executor else 1
+    try:
+        pending = deque()
+        for group in iter_page_groups(crawl_items, group_size):
+            cached = [get_cached_chunks(page_cache, item) for item in group]
+            misses = [item for item, page in zip(group, cached) if page is None]
+            if executor:
+                rendered = executor.submit(render_pages_in_worker, misses, variants, overrides)
+            else:
+                with variant_configs(overrides or {}):
+                    rendered = render_pages(misses, variants)
+            pending.append((group, cached, rendered))
+            if len(pending) >= max_pending:
+                yield from merge_group(*pending.popleft(), page_cache)
+        while pending:
+            yield from merge_group(*pending.popleft(), page_cache)
+    finally:
+        if own_executor:
+            own_executor.shutdown()
+
+
+def get_chunk_filename(extension='json', variant=''):
+    if variant:
+        return f'{CHUNK_FILE_PREFIX}_{TIMESTAMP}.{variant}.{extension}'
+    chunk_filename = f'{CHUNK_FILE_PREFIX}_{TIMESTAMP}.{extension}'
     if CONFIGS['boost']:
-        chunk_filename = f'chunks_{TIMESTAMP}_boost.json'
-    with open(chunk_filename, 'w') as f:
-        json.dump(chunks, f, indent=2)
-
-    print(f"Saved {len(chunks)} chunks to {chunk_filename}")
-
-    # Generate chunks.md
-    with open('chunks.md', 'w') as f:
-        for chunk in chunks:
-            f.write(f"link: {chunk['link']}\n")
-            f.write(f"tag_set: {', '.join(chunk['tags_set'])}\n")
-            f.write(f"image_urls: {', '.join(chunk['image_urls'])}\n")
-            f.write(f"tracking_id: {chunk['tracking_id']}\n")
-            f.write(f"group_tracking_ids: {', '.join(chunk['group_tracking_ids'])}\n")
-            f.write(chunk['chunk_html'])
-            f.write("\n" + "-" *80 + "\n\n")
-
-    print(f"Generated chunks.md with {len(chunks)} entries")
+        chunk_filename = f'{CHUNK_FILE_PREFIX}_{TIMESTAMP}_boost.{extension}'
+    return chunk_filename
+
+
+def get_md_filename(variant=''):
+    return get_variant_path(f'{CHUNK_FILE_PREFIX}.md', variant)
+
+
+def filter_duplicates(variant_chunks, deduplicators=None):
+    """
+    Drop the chunks that the deduplicator of their variant has seen before.
+    """
+    for name, chunk in variant_chunks:
+        if not deduplicators or deduplicators[name].add(chunk) is None:
+            yield name, chunk
+
+
+def stream(crawl_items, workers=1, page_cache=None, deduplicators=None, variants=DEFAULT_VARIANTS):
+    """
+    Write each variant's chunks to chunks_<ts>.jsonl and chunks.md (with the
+    variant's name before the extension) as each page is processed, so
+    memory use does not grow with the size of the crawl.
+    """
+    variant_chunks = iter_variant_chunks(crawl_items, variants, workers=workers, page_cache=page_cache)
+    counts = dict.fromkeys(variants, 0)
+    with ExitStack() as stack:
+        files = {name: (stack.enter_context(open(get_chunk_filename('jsonl', name), 'wb')),
+                        stack.enter_context(open(get_md_filename(name), 'w')))
+                 for name in variants}
+        for name, chunk in filter_duplicates(variant_chunks, deduplicators):
+            jsonl_file, md_file = files[name]
+            with METRICS.timer('serialize'):
+                line = serializer.dumps(chunk) + b"\n"
+            jsonl_file.write(line)
+            write_chunk_md(md_file, chunk)
+            counts[name] += 1
+
+    for name, count in counts.items():
+        print(f"Saved {count} chunks to {get_chunk_filename('jsonl', name)}")
+        print(f"Generated {get_md_filename(name)} with {count} entries")
+
+
+def store(crawl_items, workers=1, page_cache=None, deduplicators=None, variants=DEFAULT_VARIANTS):
+    """
+    Write each variant's chunks to a compact chunks_<ts>.jsonl.gz store with
+    an offset index, as each page is processed. chunk_store.py dump writes
+    its chunks.md.
+    """
+    variant_chunks = iter_variant_chunks(crawl_items, variants, workers=workers, page_cache=page_cache)
+    with ExitStack() as stack:
+        writers = {name: stack.enter_context(chunk_store.ChunkStoreWriter(
+            get_chunk_filename(chunk_store.STORE_EXTENSION, name))) for name in variants}
+        for name, chunk in filter_duplicates(variant_chunks, deduplicators):
+            with METRICS.timer('serialize'):
+                writers[name].write(chunk)
+
+    for name, writer in writers.items():
+        print(f"Saved {len(writer.tracking_ids)} chunks to {writer.path}")
+
+
+def save(crawl_results_file, workers=1, page_cache=None, deduplicators=None, variants=DEFAULT_VARIANTS):
+    # Load the crawl results
+    with METRICS.timer('crawl_read'), open(crawl_results_file, 'r') as f:
+        crawl_results = json.load(f)
+
+    variant_chunks = iter_variant_chunks(crawl_results, variants, workers=workers, page_cache=page_cache)
+    chunks = {name: [] for name in variants}
+    for name, chunk in filter_duplicates(variant_chunks, deduplicators):
+        chunks[name].append(chunk)
+
+    for name, variant_chunks in chunks.items():
+        # Save the chunks data to chunks.json
+        chunk_filename = get_chunk_filename('json', name)
+        with METRICS.timer('serialize'), open(chunk_filename, 'wb') as f:
+            f.write(serializer.dumps(variant_chunks, indent=True))
+
+        print(f"Saved {len(variant_chunks)} chunks to {chunk_filename}")
+
+        # Generate chunks.md
+        md_filename = get_md_filename(name)
+        with open(md_filename, 'w') as f:
+            for chunk in variant_chunks:
+                write_chunk_md(f, chunk)
+
+        print(f"Generated {md_filename} with {len(variant_chunks)} entries")
+
+
+def main(argv=None):
+    global TIMESTAMP, QUARANTINE_FILE, CHUNK_FILE_PREFIX
+
+    parser = argparse.ArgumentParser(description="Transform crawl results into Trieve chunks")
+    parser.add_argument('crawl_results_file', nargs='?', default=None,
+                        help="crawl results file (default: the latest crawl_results_*.json here)")
+    parser.add_argument('--removed', default=None, metavar='FILE',
+                        help="URLs of removed pages, whose chunk groups are written to removed_groups_<ts>.json "
+                             "(default: the crawl_removed_<ts>.json of a crawl_delta_<ts>.json)")
+    parser.add_argument('--stream', action='store_true',
+                        help="read the crawl one page at a time and write chunks as JSONL")
+    parser.add_argument('--store', action='store_true',
+                        help="read the crawl one page at a time and write chunks to a compact indexed store")
+    parser.add_argument('--variant', action='append', default=[], metavar='NAME[:CONFIG=VALUE,...]',
+                        help=f"write the chunks of a variant of CONFIGS to their own files: one of "
+                             f"{', '.join(VARIANTS)}, or a name with its settings (repeatable)")
+    parser.add_argument('--sweep', action='append', default=[], metavar='CONFIG=VALUE,...',
+                        help="add a variant for each combination of the swept values (repeatable)")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="number of processes used to transform pages (default: 1)")
+    parser.add_argument('--cache', nargs='?', const='page_cache.sqlite', default=None,
+                        help="reuse chunks of unchanged pages from this cache (default: page_cache.sqlite)")
+    parser.add_argument('--cache-max-mb', type=int, default=page_cache.DEFAULT_MAX_BYTES // (1024 * 1024),
+                        help="evict least recently used pages beyond this size")
+    parser.add_argument('--renderer', default=render.DEFAULT_BACKEND, choices=sorted(render.BACKENDS),
+                        help=f"markdown renderer backend (default: {render.DEFAULT_BACKEND})")
+    parser.add_argument('--serializer', default=serializer.AUTO_BACKEND,
+                        choices=[serializer.AUTO_BACKEND, *serializer.BACKENDS],
+                        help="JSON library the chunk files are written with; json writes the same bytes as "
+                             "earlier runs (default: orjson if installed, else json)")
+    parser.add_argument('--dedup', nargs='?', type=float, const=dedup.DEFAULT_THRESHOLD, default=None,
+                        help="drop chunks at least this similar to an earlier chunk "
+                             f"(default: {dedup.DEFAULT_THRESHOLD})")
+    parser.add_argument('--dedup-report', default='dedup_report.json',
+                        help="where --dedup writes which tracking_ids were merged (default: dedup_report.json)")
+    parser.add_argument('--cleaner-budget', type=float, default=cleaners.DEFAULT_RULE_BUDGET,
+                        help="seconds a cleaner rule may run on one chunk before its linear-time "
+                             f"fallback is used, 0 for no limit (default: {cleaners.DEFAULT_RULE_BUDGET})")
+    parser.add_argument('--page-budget', type=float, default=cleaners.DEFAULT_PAGE_BUDGET,
+                        help="seconds the cleaners may run on one page, 0 for no limit "
+                             f"(default: {cleaners.DEFAULT_PAGE_BUDGET})")
+    parser.add_argument('--quarantine', default=QUARANTINE_FILE,
+                        help=f"where pages that ran past a budget are recorded (default: {QUARANTINE_FILE})")
+    parser.add_argument('--report', default=None,
+                        help="write a JSON run report of stage timings and counters to this file")
+    parser.add_argument('--prometheus', default=None,
+                        help="write the same metrics in Prometheus text format to this file")
+    args = parser.parse_args(argv)
+    try:
+        variants = get_variants(args.variant, args.sweep)
+    except ValueError as e:
+        parser.error(str(e))
+
+    crawl_results_file = args.crawl_results_file or find_crawl_results_file()
+    if not crawl_results_file:
+        print('No crawl results file found')
+        exit(1)
+    TIMESTAMP = get_timestamp(crawl_results_file)
+    CHUNK_FILE_PREFIX = DELTA_CHUNKS_PREFIX if is_delta_file(crawl_results_file) else CHUNKS_PREFIX
+
+    render.set_backend(args.renderer)
+    serializer.set_backend(args.serializer)
+    cleaners.CHUNK_CLEANERS.set_budgets(args.cleaner_budget, args.page_budget)
+    QUARANTINE_FILE = args.quarantine
+    cache = None
+    if args.cache:
+        cache = page_cache.PageCache(args.cache, get_cache_version(variants),
+                                     max_bytes=args.cache_max_mb * 1024 * 1024)
+    deduplicators = None
+    if args.dedup is not None:
+        deduplicators = {name: dedup.Deduplicator(args.dedup) for name in variants}
+    try:
+        if args.stream or args.store:
+            crawl_items = METRICS.timed_iter(iter_crawl_results(crawl_results_file), 'crawl_read')
+            write = store if args.store else stream
+            write(crawl_items, workers=args.workers, page_cache=cache, deduplicators=deduplicators,
+                  variants=variants)
+        else:
+            save(crawl_results_file, workers=args.workers, page_cache=cache, deduplicators=deduplicators,
+                 variants=variants)
+        removed_file = args.removed or find_removed_file(crawl_results_file)
+        if removed_file:
+            print(f"Saved the chunk groups of the removed pages to {save_removed_groups(removed_file)}")
+        for name, deduplicator in (deduplicators or {}).items():
+            report = get_variant_path(args.dedup_report, name)
+            deduplicator.save_report(report)
+            print(f"Merged {deduplicator.report()['merged']} duplicate chunks, see {report}")
+    finally:
+        if cache:
+            print(f"Page cache: {cache.hits} unchanged, {cache.misses} new or changed")
+            METRICS.inc('page_cache_hits', cache.hits)
+            cache.close()
+        METRICS.export(args.report, args.prometheus, command='transform',
+                       crawl_results_file=crawl_results_file, workers=args.workers,
+                       variants={name: dict(CONFIGS, **overrides) for name, overrides in variants.items()})
+
 
 if __name__ == "__main__":
     main()
\ No newline at end of file